@@ -0,0 +1,138 @@
+# coding=utf-8
+"""Compares the tail-reading G-code analysis extractor with the previous full
+scan implementation on synthetic G-code files.
+
+Usage (from within OctoPrint's virtual environment)::
+
+    python benchmarks/bench_analysis.py --size 200 --size 500
+
+Sizes are given in MB. Files are generated in a temporary directory and
+removed afterwards unless ``--keep`` is given.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_slic3r.analysis import get_analysis_from_gcode
+
+def legacy_get_analysis_from_gcode(machinecode_path):
+  """The implementation up to 1.3.1, kept here as the baseline."""
+  filament_length = None
+  filament_volume = None
+  printing_seconds = None
+  with open(machinecode_path) as gcode_lines:
+    for gcode_line in gcode_lines:
+      m = re.match('\\s*;\\s*filament used\\s*=\\s*([0-9.]+)\\s*mm\\s*\\(([0-9.]+)cm3\\)\\s*', gcode_line)
+      if m:
+        filament_length = float(m.group(1))
+        filament_volume = float(m.group(2))
+      m = re.match('\\s*;\\s*estimated printing time\\s*=\\s(.*)\\s*', gcode_line)
+      if m:
+        time_text = m.group(1)
+        printing_seconds = 0
+        for time_part in time_text.split(' '):
+          for unit in [("h", 60*60),
+                       ("m", 60),
+                       ("s", 1),
+                       ("d", 24*60*60)]:
+            m = re.match('\\s*([0-9.]+)' + re.escape(unit[0]), time_part)
+            if m:
+              printing_seconds += float(m.group(1)) * unit[1]
+  analysis = None
+  if printing_seconds is not None or filament_length is not None or filament_volume is not None:
+    dd = lambda: defaultdict(dd)
+    analysis = dd()
+    if printing_seconds is not None:
+      analysis['estimatedPrintTime'] = printing_seconds
+    if filament_length is not None:
+      analysis['filament']['tool0']['length'] = filament_length
+    if filament_volume is not None:
+      analysis['filament']['tool0']['volume'] = filament_volume
+    return json.loads(json.dumps(analysis))
+  return None
+
+SLIC3R_SUMMARY = """; filament used = 12345.6mm (29.7cm3)
+; estimated printing time = 1d 2h 3m 4s
+"""
+
+PRUSASLICER_SUMMARY = """; filament used [mm] = 12345.60, 678.90
+; filament used [cm3] = 29.70, 1.63
+; filament used [g] = 36.83, 2.02
+; filament cost = 0.92, 0.05
+; total filament used [g] = 38.85
+; total filament cost = 0.97
+; total layers count = 412
+; estimated printing time (normal mode) = 1d 2h 3m 4s
+; estimated printing time (silent mode) = 1d 3h 0m 0s
+"""
+
+def write_gcode(path, size_mb, summary, config_keys=400):
+  block = "".join(";LAYER_CHANGE\n;Z:{z:.2f}\nG1 Z{z:.2f} F720\n".format(z=0.2 * i) +
+                  "G1 X{x:.3f} Y{y:.3f} E{e:.5f}\n".format(x=10 + i % 180, y=20 + i % 170, e=0.01 * i) * 200
+                  for i in range(10))
+  block = block.encode("ascii")
+  target = size_mb * 1024 * 1024
+  with open(path, "wb") as f:
+    f.write(b"; generated by PrusaSlicer 2.4.2\nG90\nM83\n")
+    written = 0
+    while written < target:
+      f.write(block)
+      written += len(block)
+    f.write(summary.encode("ascii"))
+    f.write(b"\n; prusaslicer_config = begin\n")
+    for i in range(config_keys):
+      f.write("; setting_{i} = {v}\n".format(i=i, v="x" * (i % 80)).encode("ascii"))
+    f.write(b"; prusaslicer_config = end\n")
+
+def measure(func, path, repeat):
+  best = None
+  result = None
+  for _ in range(repeat):
+    start = time.time()
+    result = func(path)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--size", type=int, action="append", help="file size in MB, may be given multiple times")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--keep", action="store_true")
+  args = parser.parse_args()
+
+  sizes = args.size or [200, 500]
+  folder = tempfile.mkdtemp(prefix="slic3r-bench-")
+  try:
+    print("{:>8} {:>12} {:>12} {:>12} {:>9}".format("size MB", "flavor", "legacy s", "tail s", "speedup"))
+    for size in sizes:
+      for flavor, summary in (("slic3r", SLIC3R_SUMMARY), ("prusaslicer", PRUSASLICER_SUMMARY)):
+        path = os.path.join(folder, "{}-{}.gcode".format(flavor, size))
+        write_gcode(path, size, summary)
+
+        legacy_time, legacy_result = measure(legacy_get_analysis_from_gcode, path, args.repeat)
+        new_time, new_result = measure(get_analysis_from_gcode, path, args.repeat)
+
+        if legacy_result is not None:
+          assert new_result["estimatedPrintTime"] == legacy_result["estimatedPrintTime"]
+          assert new_result["filament"]["tool0"] == legacy_result["filament"]["tool0"]
+
+        print("{:>8} {:>12} {:>12.3f} {:>12.4f} {:>8.0f}x".format(size, flavor, legacy_time, new_time, legacy_time / max(new_time, 1e-6)))
+        if not args.keep:
+          os.remove(path)
+  finally:
+    if not args.keep:
+      shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+  main()
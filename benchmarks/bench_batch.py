@@ -0,0 +1,116 @@
+# coding=utf-8
+"""Compares slicing small models one engine run each with batched runs.
+
+Each engine run pays the full start up cost of the slicer, batching several
+models sharing a profile into one run only pays it once. By default this
+uses ``fake_slicer.py`` with an emulated cold start, pass ``--engine``,
+``--model`` and ``--profile`` to measure a real PrusaSlicer.
+
+Usage (from within OctoPrint's virtual environment)::
+
+    python benchmarks/bench_batch.py --jobs 24 --workers 2 --batch-size 8 --startup 1.5
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r.batch import batch_output_path, stage_models
+from octoprint_slic3r.engine import probe_engine
+
+FAKE_SLICER = os.path.join(HERE, "fake_slicer.py")
+
+def run(args, env):
+  with open(os.devnull, "wb") as devnull:
+    subprocess.check_call(args, stdout=devnull, stderr=devnull, env=env)
+
+def run_pool(tasks, workers):
+  tasks = list(tasks)
+  lock = threading.Lock()
+
+  def worker():
+    while True:
+      with lock:
+        if not tasks:
+          return
+        task = tasks.pop(0)
+      task()
+
+  threads = [threading.Thread(target=worker) for _ in range(workers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+def one_shot(engine, capabilities, profile, models, folder, workers, env):
+  def task(index, model):
+    return lambda: run([engine] + capabilities.get_args(profile, 100, 100, os.path.join(folder, "%d.gcode" % index), model), env)
+  run_pool([task(index, model) for index, model in enumerate(models)], workers)
+
+def batched(engine, capabilities, profile, models, folder, workers, batch_size, env):
+  def task(index, chunk):
+    def execute():
+      staging = os.path.join(folder, "batch%d" % index)
+      output = os.path.join(staging, "output")
+      os.makedirs(output)
+      staged = stage_models(chunk, staging)
+      run([engine] + capabilities.get_batch_args(profile, 100, 100, output, staged), env)
+      for path in staged:
+        if not os.path.isfile(batch_output_path(output, path)):
+          raise RuntimeError("No output for {}".format(path))
+    return execute
+  chunks = [models[i:i + batch_size] for i in range(0, len(models), batch_size)]
+  run_pool([task(index, chunk) for index, chunk in enumerate(chunks)], workers)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--jobs", type=int, default=24, help="models to slice")
+  parser.add_argument("--workers", type=int, default=2, help="engine processes running at once")
+  parser.add_argument("--batch-size", type=int, default=8, help="models per batched engine run")
+  parser.add_argument("--startup", type=float, default=1.5, help="emulated cold start of the fake slicer in seconds")
+  parser.add_argument("--engine", help="slicer executable, defaults to fake_slicer.py")
+  parser.add_argument("--model", help="STL to slice with --engine")
+  parser.add_argument("--profile", help="profile to slice with with --engine")
+  args = parser.parse_args()
+
+  engine = args.engine or FAKE_SLICER
+  env = dict(os.environ, FAKE_SLICER_STARTUP=str(args.startup), FAKE_SLICER_LINES="200", FAKE_SLICER_GCODE_SIZE=str(256 * 1024))
+  capabilities = probe_engine(engine)
+  if not capabilities.supports_batches:
+    print("{} doesn't support batches ({!r})".format(engine, capabilities))
+    return
+
+  folder = tempfile.mkdtemp()
+  try:
+    model = args.model
+    if model is None:
+      model = os.path.join(folder, "model.stl")
+      with open(model, "w") as f:
+        f.write("solid model\nendsolid model\n")
+    profile = args.profile
+    if profile is None:
+      profile = os.path.join(HERE, "..", "octoprint_slic3r", "profiles", "default.profile.ini")
+    models = [model] * args.jobs
+
+    print("{:>10} {:>6} {:>8} {:>10} {:>10}".format("mode", "jobs", "workers", "wall s", "jobs/min"))
+    for name, execute in (("one-shot", lambda out: one_shot(engine, capabilities, profile, models, out, args.workers, env)),
+                          ("batched", lambda out: batched(engine, capabilities, profile, models, out, args.workers, args.batch_size, env))):
+      output = tempfile.mkdtemp(dir=folder)
+      start = time.time()
+      execute(output)
+      wall = time.time() - start
+      print("{:>10} {:>6} {:>8} {:>10.2f} {:>10.1f}".format(name, args.jobs, args.workers, wall, 60 * args.jobs / wall))
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,94 @@
+# coding=utf-8
+"""Compares ASCII with binary G-code output (PrusaSlicer 2.7+).
+
+Slices once per format and reports how long the engine took to write its
+output, the resulting file size and how long extracting the analysis from
+it takes. By default this uses ``fake_slicer.py``, whose G-code is very
+repetitive and compressed with deflate instead of PrusaSlicer's heatshrink,
+so only the analysis latency is representative; pass ``--engine``,
+``--model`` and ``--profile`` to measure a real PrusaSlicer.
+
+Usage::
+
+    python benchmarks/bench_bgcode.py --size 100
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r.analysis import get_analysis_from_gcode
+from octoprint_slic3r.engine import probe_engine
+
+FAKE_SLICER = os.path.join(HERE, "fake_slicer.py")
+
+def slice_model(engine, capabilities, profile, model, output, binary, env):
+  args = [engine] + capabilities.get_args(profile, 100, 100, output, model, binary=binary)
+  start = time.time()
+  with open(os.devnull, "wb") as devnull:
+    subprocess.check_call(args, stdout=devnull, stderr=devnull, env=env)
+  return time.time() - start
+
+def measure_analysis(path, repeat):
+  best = None
+  stats = dict()
+  for _ in range(repeat):
+    start = time.time()
+    analysis = get_analysis_from_gcode(path, stats=stats)
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+  if analysis is None:
+    raise RuntimeError("No analysis found in {}".format(path))
+  return best, stats["bytes_read"]
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--size", type=int, default=100, help="size of the fake slicer's ASCII G-code in MB")
+  parser.add_argument("--repeat", type=int, default=5, help="analysis runs per file, the best is reported")
+  parser.add_argument("--engine", help="slicer executable, defaults to fake_slicer.py")
+  parser.add_argument("--model", help="STL to slice with --engine")
+  parser.add_argument("--profile", help="profile to slice with with --engine")
+  args = parser.parse_args()
+
+  engine = args.engine or FAKE_SLICER
+  # probe_engine runs the engine with our environment as well
+  os.environ.update(FAKE_SLICER_BANNER="PrusaSlicer-2.7.1+linux-x64-GTK3-202312121425 based on Slic3r (with GUI support)",
+                    FAKE_SLICER_LINES="100",
+                    FAKE_SLICER_GCODE_SIZE=str(args.size * 1024 * 1024))
+  env = dict(os.environ)
+  capabilities = probe_engine(engine)
+  if not capabilities.supports_binary_gcode:
+    print("{} doesn't support binary G-code ({!r})".format(engine, capabilities))
+    return
+
+  folder = tempfile.mkdtemp()
+  try:
+    model = args.model
+    if model is None:
+      model = os.path.join(folder, "model.stl")
+      with open(model, "w") as f:
+        f.write("solid model\nendsolid model\n")
+    profile = args.profile
+    if profile is None:
+      profile = os.path.join(HERE, "..", "octoprint_slic3r", "profiles", "default.profile.ini")
+
+    print("{:>8} {:>10} {:>10} {:>14} {:>14}".format("format", "slice s", "size MB", "analysis ms", "bytes read"))
+    for name, binary in (("ascii", False), ("binary", True)):
+      output = os.path.join(folder, "output." + ("bgcode" if binary else "gcode"))
+      duration = slice_model(engine, capabilities, profile, model, output, binary, env)
+      analysis, bytes_read = measure_analysis(output, args.repeat)
+      print("{:>8} {:>10.2f} {:>10.1f} {:>14.2f} {:>14}".format(name, duration, os.path.getsize(output) / 1024.0 / 1024.0,
+                                                                analysis * 1000, bytes_read))
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,101 @@
+# coding=utf-8
+"""Measures the cost of logging the engine's output on the slicing thread.
+
+Feeds PrusaSlicer-like trace lines through the way the output used to be
+logged (string concatenation and a file handler on the calling thread) and
+through the queued pipeline, with and without debug logging enabled, with
+trace sampling and with a per-job log file. Reports the time per line spent
+on the calling thread and the time until everything was written.
+
+Usage::
+
+    python benchmarks/bench_logging.py --lines 200000
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import logging
+import logging.handlers
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r.logs import EngineLogPipeline, EngineOutputLog, JobFilter, JobLogHandler, TraceSampler
+
+LINE = b"[2022-04-22 21:44:51.396082] [0x75527010] [trace]   Making infill for layer %d"
+
+def make_file_handler(folder):
+  handler = logging.handlers.RotatingFileHandler(os.path.join(folder, "engine.log"), maxBytes=2 * 1024 * 1024)
+  handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+  return handler
+
+def make_logger(name, level):
+  logger = logging.getLogger("bench_logging." + name)
+  logger.setLevel(level)
+  logger.propagate = False
+  return logger
+
+def run_direct(folder, lines, level):
+  logger = make_logger("direct%d" % level, level)
+  handler = make_file_handler(folder)
+  logger.addHandler(handler)
+  start = time.time()
+  for line in lines:
+    logger.debug("stdout: " + str(line))
+  calling = time.time() - start
+  logger.removeHandler(handler)
+  handler.close()
+  return calling, time.time() - start
+
+def run_pipeline(folder, lines, level, rate=None, job_log=False):
+  logger = make_logger("pipeline%d%s%s" % (level, rate, job_log), level)
+  file_handler = make_file_handler(folder)
+  file_handler.addFilter(JobFilter())
+  job_handler = JobLogHandler(os.path.join(folder, "logs"))
+  job_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+  pipeline = EngineLogPipeline(logger, [file_handler, job_handler])
+
+  start = time.time()
+  output_log = EngineOutputLog(logger, name=EngineOutputLog.make_name("model.stl") if job_log else None,
+                               sampler=TraceSampler(rate) if rate else None)
+  for line in lines:
+    output_log.stdout(line)
+  output_log.close()
+  calling = time.time() - start
+  pipeline.stop()
+  if pipeline.dropped:
+    print("  {} records dropped".format(pipeline.dropped))
+  return calling, time.time() - start
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--lines", type=int, default=200000, help="lines of engine output")
+  parser.add_argument("--rate", type=int, default=200, help="trace lines per second for the sampled runs")
+  args = parser.parse_args()
+
+  lines = [LINE % index for index in range(args.lines)]
+  runs = (
+    ("direct, disabled", lambda folder: run_direct(folder, lines, logging.CRITICAL)),
+    ("direct, debug", lambda folder: run_direct(folder, lines, logging.DEBUG)),
+    ("queued, disabled", lambda folder: run_pipeline(folder, lines, logging.CRITICAL)),
+    ("queued, debug", lambda folder: run_pipeline(folder, lines, logging.DEBUG)),
+    ("queued, sampled", lambda folder: run_pipeline(folder, lines, logging.DEBUG, rate=args.rate)),
+    ("sampled + job log", lambda folder: run_pipeline(folder, lines, logging.DEBUG, rate=args.rate, job_log=True)),
+  )
+
+  print("{:>18} {:>16} {:>14}".format("logging", "calling us/line", "written s"))
+  for name, run in runs:
+    folder = tempfile.mkdtemp()
+    try:
+      calling, total = run(folder)
+      print("{:>18} {:>16.2f} {:>14.2f}".format(name, calling * 1000000 / len(lines), total))
+    finally:
+      shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,110 @@
+# coding=utf-8
+"""Measures inspecting STL models before slicing.
+
+Generates a binary and an ASCII STL made of many small cubes and measures
+``inspect_model`` with NumPy (if installed) and with the pure Python
+fallback, next to the z range reader it replaced.
+
+Usage::
+
+    python benchmarks/bench_mesh.py --cubes 200000
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r import mesh
+
+FACES = ((0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+         (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3))
+
+def cube_triangles(index, size=5.0):
+  offset = (index % 20) * size * 2, (index // 20 % 20) * size * 2, (index // 400) * size * 2
+  corners = [(offset[0] + x * size, offset[1] + y * size, offset[2] + z * size) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+  return [(corners[a], corners[b], corners[c]) for a, b, c in FACES]
+
+def write_models(folder, cubes):
+  binary = os.path.join(folder, "binary.stl")
+  ascii = os.path.join(folder, "ascii.stl")
+  record = struct.Struct("<12f2x")
+  with open(binary, "wb") as b, open(ascii, "w") as a:
+    b.write(b"\0" * 80 + struct.pack("<I", cubes * len(FACES)))
+    a.write("solid cubes\n")
+    for index in range(cubes):
+      for triangle in cube_triangles(index):
+        b.write(record.pack(0, 0, 0, *[c for vertex in triangle for c in vertex]))
+        a.write("facet normal 0 0 0\n outer loop\n")
+        for vertex in triangle:
+          a.write("  vertex {:e} {:e} {:e}\n".format(*vertex))
+        a.write(" endloop\nendfacet\n")
+    a.write("endsolid cubes\n")
+  return binary, ascii
+
+def legacy_z_range(path):
+  """The z range reader ``inspect_model`` replaced, only for comparison."""
+  triangle_z = struct.Struct("<20xf8xf8xf2x")
+  size = os.path.getsize(path)
+  with open(path, "rb") as f:
+    f.seek(84)
+    data = f.read()
+  if not data.lstrip().startswith(b"facet") and size > 84:
+    count = len(data) // 50
+    zs = [z for offset in range(0, count * 50, 50) for z in triangle_z.unpack_from(data, offset)]
+  else:
+    zs = [float(m.group(3)) for m in mesh.regex_vertex.finditer(data)]
+  return min(zs), max(zs)
+
+def without_numpy(function):
+  def execute(path):
+    numpy = mesh.numpy
+    mesh.numpy = None
+    try:
+      return function(path)
+    finally:
+      mesh.numpy = numpy
+  return execute
+
+def measure(function, path, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    function(path)
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+  return best
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--cubes", type=int, default=200000, help="cubes in the generated models, 12 triangles each")
+  parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best is reported")
+  args = parser.parse_args()
+
+  readers = [("z range (old)", legacy_z_range), ("pure Python", without_numpy(mesh.inspect_model))]
+  if mesh.numpy is not None:
+    readers.append(("NumPy", mesh.inspect_model))
+  else:
+    print("NumPy is not installed, only measuring the fallback")
+
+  folder = tempfile.mkdtemp()
+  try:
+    binary, ascii = write_models(folder, args.cubes)
+    print("{:>8} {:>10} {:>12} {:>16} {:>10}".format("file", "size MB", "triangles", "reader", "best ms"))
+    for name, path in (("binary", binary), ("ascii", ascii)):
+      for reader_name, reader in readers:
+        duration = measure(reader, path, args.repeat)
+        print("{:>8} {:>10.1f} {:>12} {:>16} {:>10.1f}".format(name, os.path.getsize(path) / 1024.0 / 1024.0, args.cubes * len(FACES),
+                                                             reader_name, duration * 1000))
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
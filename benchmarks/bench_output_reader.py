@@ -0,0 +1,88 @@
+# coding=utf-8
+"""Measures the CPU time the plugin spends reading the slicer's output.
+
+Runs ``fake_slicer.py`` emitting many trace lines and compares the busy
+polling loop ``do_slice`` used up to 1.3.1 (needs ``sarge``) with the
+blocking ``pump_output`` reader.
+
+Usage (from within OctoPrint's virtual environment)::
+
+    python benchmarks/bench_output_reader.py --lines 200000 --rate 20000
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r.process import pump_output
+
+FAKE_SLICER = os.path.join(HERE, "fake_slicer.py")
+
+def cpu_time():
+  return sum(os.times()[:2])
+
+def legacy_reader(env):
+  """The busy loop from 1.3.1, minus the progress reporting."""
+  import sarge
+  command = " ".join('"%s"' % arg for arg in (sys.executable, FAKE_SLICER, "--slice"))
+  p = sarge.run(command, stdout=sarge.Capture(buffer_size=1), stderr=sarge.Capture(buffer_size=1), env=env, async_=True)
+  p.wait_events()
+  lines = 0
+  stdout_buffer = b""
+  stderr_buffer = b""
+  while p.returncode is None:
+    p.commands[0].poll()
+    stdout_buffer += p.stdout.read(block=False)
+    stderr_buffer += p.stderr.read(block=False)
+    stdout_lines = stdout_buffer.split(b"\n")
+    stdout_buffer = stdout_lines[-1]
+    lines += len(stdout_lines) - 1
+    stderr_buffer = stderr_buffer.split(b"\n")[-1]
+  p.close()
+  return lines + len(stdout_buffer.split(b"\n")) - 1
+
+def pump_reader(env):
+  p = subprocess.Popen((sys.executable, FAKE_SLICER, "--slice"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+  counter = [0]
+  def on_line(line):
+    counter[0] += 1
+  pump_output(p, on_line, lambda line: None)
+  p.wait()
+  p.stdout.close()
+  p.stderr.close()
+  return counter[0]
+
+def measure(reader, env):
+  cpu_start = cpu_time()
+  wall_start = time.time()
+  lines = reader(env)
+  return lines, time.time() - wall_start, cpu_time() - cpu_start
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--lines", type=int, default=200000, help="trace lines emitted by the fake slicer")
+  parser.add_argument("--rate", type=float, default=20000, help="trace lines per second, 0 for unthrottled")
+  args = parser.parse_args()
+
+  env = dict(os.environ, FAKE_SLICER_LINES=str(args.lines), FAKE_SLICER_RATE=str(args.rate), FAKE_SLICER_GCODE_SIZE="0")
+
+  readers = [("pump_output", pump_reader)]
+  try:
+    import sarge
+    readers.insert(0, ("legacy busy loop", legacy_reader))
+  except ImportError:
+    print("sarge is not installed, skipping the legacy reader")
+
+  print("{:>18} {:>10} {:>10} {:>14} {:>10}".format("reader", "lines", "wall s", "plugin cpu s", "cpu/wall"))
+  for name, reader in readers:
+    lines, wall, cpu = measure(reader, env)
+    print("{:>18} {:>10} {:>10.2f} {:>14.2f} {:>9.0f}%".format(name, lines, wall, cpu, 100.0 * cpu / wall))
+
+if __name__ == "__main__":
+  main()
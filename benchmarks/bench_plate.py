@@ -0,0 +1,129 @@
+# coding=utf-8
+"""Measures packing many small models onto one plate.
+
+Generates boxes of varying footprints as binary STLs, then measures
+inspecting them, packing their footprints onto a rectangular and a
+circular bed and writing the combined plate STL, with NumPy (if
+installed) and with the pure Python fallback. Every packed plate is
+checked for overlapping footprints and footprints leaving the bed.
+
+Usage::
+
+    python benchmarks/bench_plate.py --parts 100 300 600 --bed 400
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import math
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r import mesh, plate
+
+FACES = ((0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+         (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3))
+
+def write_box(path, size):
+  corners = [(x * size[0], y * size[1], z * size[2]) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+  record = struct.Struct("<12f2x")
+  with open(path, "wb") as f:
+    f.write(b"\0" * 80 + struct.pack("<I", len(FACES)))
+    for a, b, c in FACES:
+      f.write(record.pack(0, 0, 0, *(corners[a] + corners[b] + corners[c])))
+
+def write_parts(folder, count, seed):
+  rng = random.Random(seed)
+  paths = []
+  for index in range(count):
+    path = os.path.join(folder, "part%d.stl" % index)
+    write_box(path, (rng.uniform(4, 20), rng.uniform(4, 20), rng.uniform(2, 10)))
+    paths.append(path)
+  return paths
+
+def check_plate(packed, volume):
+  (min_x, max_x), (min_y, max_y), _, radius = mesh.get_bed_bounds(volume)
+  cells = sorted(packed.cells)
+  for index, (left, bottom, right, top) in enumerate(cells):
+    if radius is not None:
+      corners = ((left, bottom), (left, top), (right, bottom), (right, top))
+      if any(math.hypot(x, y) > radius + 1e-6 for x, y in corners):
+        return "a model leaves the bed"
+    elif left < min_x - 1e-6 or right > max_x + 1e-6 or bottom < min_y - 1e-6 or top > max_y + 1e-6:
+      return "a model leaves the bed"
+    for other in cells[index + 1:]:
+      if other[0] >= right - 1e-6:
+        break
+      if other[1] < top - 1e-6 and other[3] > bottom + 1e-6:
+        return "two models overlap"
+  return None
+
+def without_numpy(function):
+  def execute(*args):
+    numpy = mesh.numpy
+    mesh.numpy = plate.numpy = None
+    try:
+      return function(*args)
+    finally:
+      mesh.numpy = plate.numpy = numpy
+  return execute
+
+def measure(function, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    result = function()
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+  return best, result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--parts", type=int, nargs="+", default=[100, 300, 600], help="models per plate")
+  parser.add_argument("--bed", type=float, default=400.0, help="width and depth (or diameter) of the bed in mm")
+  parser.add_argument("--spacing", type=float, default=2.0, help="distance between models in mm")
+  parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best is reported")
+  parser.add_argument("--seed", type=int, default=1, help="seed for the model sizes")
+  args = parser.parse_args()
+
+  beds = (("rectangular", dict(formFactor="rectangular", origin="lowerleft", width=args.bed, depth=args.bed, height=args.bed)),
+          ("circular", dict(formFactor="circular", origin="center", width=args.bed, depth=args.bed, height=args.bed)))
+  variants = [("pure Python", without_numpy(mesh.inspect_model), without_numpy(plate.write_plate_stl))]
+  if mesh.numpy is not None:
+    variants.append(("NumPy", mesh.inspect_model, plate.write_plate_stl))
+  else:
+    print("NumPy is not installed, only measuring the fallback")
+
+  folder = tempfile.mkdtemp()
+  try:
+    print("{:>6} {:>12} {:>12} {:>12} {:>10} {:>10}  {}".format("parts", "bed", "reader", "inspect ms", "pack ms", "write ms", "plate"))
+    for count in args.parts:
+      paths = write_parts(folder, count, args.seed)
+      for reader_name, inspect, write in variants:
+        inspect_time, meshes = measure(lambda: [inspect(path) for path in paths], args.repeat)
+        for bed_name, volume in beds:
+          try:
+            pack_time, packed = measure(lambda: plate.pack_plate(meshes, volume, spacing=args.spacing), args.repeat)
+          except plate.PlateError as e:
+            print("{:>6} {:>12} {:>12} {:>12.1f} {:>10} {:>10}  {}".format(count, bed_name, reader_name, inspect_time * 1000, "-", "-", e))
+            continue
+          target = os.path.join(folder, "plate.stl")
+          write_time, _ = measure(lambda: write(paths, packed, target), args.repeat)
+          error = check_plate(packed, volume)
+          summary = error or "%.0f x %.0f mm" % packed.size
+          print("{:>6} {:>12} {:>12} {:>12.1f} {:>10.1f} {:>10.1f}  {}".format(count, bed_name, reader_name, inspect_time * 1000,
+                                                                            pack_time * 1000, write_time * 1000, summary))
+      for path in paths:
+        os.remove(path)
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,368 @@
+# coding=utf-8
+"""Measures the plugin's own overhead around the slicer.
+
+Drives ``Slic3rPlugin.do_slice`` and ``cancel_slicing`` against
+``fake_slicer.py`` at several concurrency levels, next to the profile
+reader/writer and the G-code analysis on their own. The fake engine's
+``--help`` banner, trace line rate and G-code size are configurable, so
+the plugin's share of every job can be told apart from the engine's.
+
+Per concurrency level it reports jobs per second, CPU time of this process
+(that is, the plugin, not the engine) per job, the latency percentiles of
+``do_slice``, the time ``do_slice`` spent outside the engine and the peak
+memory. ``--save-baseline`` stores the results as JSON, ``--baseline``
+compares a run against them and exits with 1 if anything got slower or
+bigger by more than ``--tolerance``.
+
+Needs OctoPrint, so run it from within OctoPrint's virtual environment::
+
+    python benchmarks/bench_plugin.py --jobs 40 --concurrency 1 2 4 --save-baseline baseline.json
+    python benchmarks/bench_plugin.py --jobs 40 --concurrency 1 2 4 --baseline baseline.json
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import octoprint.slicing
+
+from octoprint_slic3r import Slic3rPlugin
+from octoprint_slic3r.analysis import get_analysis_from_gcode
+from octoprint_slic3r.metrics import _quantile
+from octoprint_slic3r.profile import Profile
+
+FAKE_SLICER = os.path.join(HERE, "fake_slicer.py")
+DEFAULT_PROFILE = os.path.join(HERE, "..", "octoprint_slic3r", "profiles", "default.profile.ini")
+
+PRINTER_PROFILE = dict(id="bench", volume=dict(formFactor="rectangular", origin="lowerleft", width=200, depth=200, height=200))
+
+# metrics where more is better, all others are better when smaller
+HIGHER_IS_BETTER = ("jobs_per_second", "operations_per_second")
+
+class BenchSettings(object):
+  """Just enough of OctoPrint's plugin settings for the plugin to run."""
+
+  def __init__(self, values, folder):
+    self._values = values
+    self._folder = folder
+
+  def get(self, path, **kwargs):
+    return self._values.get(path[0])
+
+  def get_boolean(self, path, **kwargs):
+    return bool(self.get(path))
+
+  def get_int(self, path, **kwargs):
+    value = self.get(path)
+    return int(value) if value not in (None, "") else None
+
+  def get_float(self, path, **kwargs):
+    value = self.get(path)
+    return float(value) if value not in (None, "") else None
+
+  def global_get(self, path, **kwargs):
+    return None
+
+  def get_plugin_logfile_path(self, postfix=None):
+    return os.path.join(self._folder, "plugin_slic3r_%s.log" % postfix)
+
+class BenchPluginManager(object):
+  def send_plugin_message(self, identifier, message):
+    pass
+
+def make_plugin(folder, settings):
+  plugin = Slic3rPlugin()
+  values = plugin.get_settings_defaults()
+  values.update(settings)
+  plugin._identifier = "slic3r"
+  plugin._logger = logging.getLogger("bench_plugin.%s" % os.path.basename(folder))
+  plugin._logger.propagate = False
+  plugin._settings = BenchSettings(values, folder)
+  plugin._plugin_manager = BenchPluginManager()
+  plugin._data_folder = os.path.join(folder, "data")
+  plugin.on_startup("127.0.0.1", 5000)
+  # probe the engine up front, that's not part of any job
+  plugin._get_engine_capabilities(values["slic3r_engine"])
+  return plugin
+
+def write_model(path, size=20.0):
+  faces = ((0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+           (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3))
+  corners = [(x * size, y * size, z * size) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+  record = struct.Struct("<12f2x")
+  with open(path, "wb") as f:
+    f.write(b"\0" * 80 + struct.pack("<I", len(faces)))
+    for a, b, c in faces:
+      f.write(record.pack(0, 0, 0, *(corners[a] + corners[b] + corners[c])))
+
+def cpu_time():
+  if resource is None:
+    return time.process_time()
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  return usage.ru_utime + usage.ru_stime
+
+def peak_rss():
+  if resource is None:
+    return None
+  # kilobytes on Linux, bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak if sys.platform == "darwin" else peak * 1024
+
+class MemoryPeak(object):
+  """Peak of the memory allocated by Python while measuring, falls back to
+  the process' peak resident set size (which never goes down) without
+  ``tracemalloc``."""
+
+  def __enter__(self):
+    self.peak = None
+    if tracemalloc is not None:
+      tracemalloc.start()
+    return self
+
+  def __exit__(self, *args):
+    if tracemalloc is not None:
+      _, self.peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+    else:
+      self.peak = peak_rss()
+
+class NoMemoryPeak(object):
+  peak = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+def run_pool(tasks, workers):
+  tasks = list(tasks)
+  lock = threading.Lock()
+
+  def worker():
+    while True:
+      with lock:
+        if not tasks:
+          return
+        task = tasks.pop(0)
+      task()
+
+  threads = [threading.Thread(target=worker) for _ in range(workers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+def run_slicing(plugin, model, profile, folder, jobs, concurrency, cancel_every, cancel_after, memory):
+  """Slices ``jobs`` times with ``concurrency`` threads, cancelling every
+  ``cancel_every``-th job ``cancel_after`` seconds after it started."""
+  latencies = []
+  cancel_latencies = []
+  failures = []
+  lock = threading.Lock()
+
+  def task(index):
+    def execute():
+      machinecode_path = os.path.join(folder, "%d.gco" % index)
+      cancelled = dict()
+      timer = None
+      if cancel_every and index % cancel_every == cancel_every - 1:
+        def cancel():
+          cancelled["at"] = time.time()
+          plugin.cancel_slicing(machinecode_path)
+        timer = threading.Timer(cancel_after, cancel)
+        timer.start()
+
+      start = time.time()
+      try:
+        ok, result = plugin.do_slice(model, PRINTER_PROFILE, machinecode_path=machinecode_path, profile_path=profile)
+        if not ok:
+          with lock:
+            failures.append(result)
+      except octoprint.slicing.SlicingCancelled:
+        with lock:
+          cancel_latencies.append(time.time() - cancelled.get("at", start))
+      end = time.time()
+      if timer is not None:
+        timer.cancel()
+      with lock:
+        if "at" not in cancelled:
+          latencies.append(end - start)
+      if os.path.exists(machinecode_path):
+        os.remove(machinecode_path)
+    return execute
+
+  cpu_start = cpu_time()
+  start = time.time()
+  with MemoryPeak() if memory else NoMemoryPeak() as peak:
+    run_pool([task(index) for index in range(jobs)], concurrency)
+  wall = time.time() - start
+  cpu = cpu_time() - cpu_start
+
+  # what do_slice spent besides waiting for the engine and for a free slot
+  records = [record for record in plugin._metrics.get_records() if record.get("wall") is not None]
+  overheads = [record["total"] - record["wall"] - record.get("queue_wait", 0) for record in records[-jobs:]]
+
+  result = dict(jobs_per_second=jobs / wall,
+                cpu_per_job_ms=cpu * 1000 / jobs,
+                overhead_ms=1000 * sum(overheads) / len(overheads) if overheads else None,
+                failures=len(failures))
+  for q in (0.5, 0.9, 0.99):
+    value = _quantile(latencies, q)
+    result["latency_p%d_ms" % int(q * 100)] = value * 1000 if value is not None else None
+  if cancel_latencies:
+    result["cancel_p50_ms"] = _quantile(cancel_latencies, 0.5) * 1000
+  if peak.peak is not None:
+    result["peak_memory_mb"] = peak.peak / 1024.0 / 1024.0
+  if failures:
+    print("  {} jobs failed, e.g.: {}".format(len(failures), failures[0]))
+  return result
+
+def run_operation(operation, repeat):
+  cpu_start = cpu_time()
+  start = time.time()
+  with MemoryPeak() as peak:
+    for _ in range(repeat):
+      operation()
+  wall = time.time() - start
+  result = dict(operations_per_second=repeat / wall, cpu_per_operation_ms=(cpu_time() - cpu_start) * 1000 / repeat)
+  if peak.peak is not None:
+    result["peak_memory_mb"] = peak.peak / 1024.0 / 1024.0
+  return result
+
+def compare(results, baseline, tolerance):
+  """Returns a line for every value that got worse than in ``baseline`` by
+  more than ``tolerance`` (a fraction)."""
+  regressions = []
+  for name, values in sorted(results.items()):
+    for key, value in sorted(values.items()):
+      previous = baseline.get(name, dict()).get(key)
+      if value is None or not previous or key == "failures":
+        continue
+      if key in HIGHER_IS_BETTER:
+        worse = value < previous * (1 - tolerance)
+      else:
+        worse = value > previous * (1 + tolerance)
+      if worse:
+        regressions.append("{}: {} {:.3f} -> {:.3f} ({:+.0%})".format(name, key, previous, value, value / previous - 1))
+  return regressions
+
+def format_value(value):
+  return "-" if value is None else "{:.2f}".format(value)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--jobs", type=int, default=40, help="slicing jobs per concurrency level")
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4], help="do_slice calls running at once")
+  parser.add_argument("--lines", type=int, default=2000, help="trace lines the fake engine emits per job")
+  parser.add_argument("--rate", type=float, default=0, help="trace lines per second, 0 emits them as fast as possible")
+  parser.add_argument("--gcode-size", type=int, default=4 * 1024 * 1024, help="approximate size of the G-code per job in bytes")
+  parser.add_argument("--banner", help="first line of the fake engine's --help output")
+  parser.add_argument("--cancel-every", type=int, default=0, help="cancel every n-th job, 0 cancels none")
+  parser.add_argument("--cancel-after", type=float, default=0.2, help="seconds after which jobs are cancelled")
+  parser.add_argument("--repeat", type=int, default=200, help="runs of the profile and analysis measurements")
+  parser.add_argument("--debug-logging", action="store_true", help="log the engine output like with debug logging enabled")
+  parser.add_argument("--no-memory", action="store_true", help="don't trace memory while slicing, tracing slows Python down")
+  parser.add_argument("--baseline", help="compare against the results stored in this file")
+  parser.add_argument("--save-baseline", help="store the results in this file")
+  parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline, as a fraction")
+  args = parser.parse_args()
+
+  os.environ.update(FAKE_SLICER_LINES=str(args.lines),
+                    FAKE_SLICER_RATE=str(args.rate),
+                    FAKE_SLICER_GCODE_SIZE=str(args.gcode_size),
+                    FAKE_SLICER_STARTUP="0",
+                    FAKE_SLICER_EXIT="0")
+  if args.banner:
+    os.environ["FAKE_SLICER_BANNER"] = args.banner
+
+  folder = tempfile.mkdtemp()
+  results = dict()
+  try:
+    model = os.path.join(folder, "model.stl")
+    write_model(model)
+    profile = os.path.join(folder, "profile.ini")
+    shutil.copyfile(DEFAULT_PROFILE, profile)
+    gcode = os.path.join(folder, "analysis.gcode")
+    sys.path.insert(0, HERE)
+    import fake_slicer
+    fake_slicer.write_gcode(gcode, args.gcode_size)
+
+    print("{:>26} {:>10} {:>12} {:>10} {:>10} {:>10} {:>12} {:>10} {:>10}".format(
+      "", "jobs/s", "CPU ms/job", "p50 ms", "p90 ms", "p99 ms", "overhead ms", "cancel ms", "peak MB"))
+
+    for concurrency in args.concurrency:
+      level_folder = tempfile.mkdtemp(dir=folder)
+      plugin = make_plugin(level_folder, dict(slic3r_engine=FAKE_SLICER,
+                                              default_profile=profile,
+                                              max_concurrent_jobs=concurrency,
+                                              debug_logging=args.debug_logging))
+      try:
+        name = "do_slice x%d" % concurrency
+        result = run_slicing(plugin, model, profile, level_folder, args.jobs, concurrency,
+                             args.cancel_every, args.cancel_after, not args.no_memory)
+      finally:
+        plugin.on_shutdown()
+      results[name] = result
+      print("{:>26} {:>10} {:>12} {:>10} {:>10} {:>10} {:>12} {:>10} {:>10}".format(
+        name, format_value(result["jobs_per_second"]), format_value(result["cpu_per_job_ms"]),
+        format_value(result["latency_p50_ms"]), format_value(result["latency_p90_ms"]), format_value(result["latency_p99_ms"]),
+        format_value(result["overhead_ms"]), format_value(result.get("cancel_p50_ms")), format_value(result.get("peak_memory_mb"))))
+
+    written = os.path.join(folder, "written.ini")
+    parsed, display_name, description = Profile.from_slic3r_ini(profile)
+    operations = (
+      ("Profile.from_slic3r_ini", lambda: Profile.from_slic3r_ini(profile)),
+      ("Profile.to_slic3r_ini", lambda: Profile.to_slic3r_ini(parsed, written, display_name=display_name, description=description)),
+      ("get_analysis_from_gcode", lambda: get_analysis_from_gcode(gcode)),
+    )
+    print()
+    print("{:>26} {:>10} {:>12} {:>10}".format("", "ops/s", "CPU ms/op", "peak MB"))
+    for name, operation in operations:
+      result = run_operation(operation, args.repeat)
+      results[name] = result
+      print("{:>26} {:>10} {:>12} {:>10}".format(name, format_value(result["operations_per_second"]),
+                                                 format_value(result["cpu_per_operation_ms"]), format_value(result.get("peak_memory_mb"))))
+  finally:
+    shutil.rmtree(folder)
+
+  if args.save_baseline:
+    with open(args.save_baseline, "w") as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+    print("\nStored the results in {}".format(args.save_baseline))
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    print()
+    if regressions:
+      print("Regressions against {}:".format(args.baseline))
+      for line in regressions:
+        print("  " + line)
+      sys.exit(1)
+    print("No regressions against {} (tolerance {:.0%})".format(args.baseline, args.tolerance))
+
+if __name__ == "__main__":
+  main()
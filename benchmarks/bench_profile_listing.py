@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Measures listing a folder of profiles.
+
+Generates profiles like the ones the plugin stores (name and description in
+the header, many settings with escaped multi line G-code) and compares
+parsing each one completely, as listing did before, with reading only their
+headers and with a warm profile index loaded from disk, as after a restart.
+
+Usage::
+
+    python benchmarks/bench_profile_listing.py --profiles 200 --keys 250
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r.cache import ProfileIndex
+from octoprint_slic3r.profile import Profile, read_profile_metadata
+
+def write_profiles(folder, count, keys):
+  profile = dict(("setting_%d" % index, "%d.5" % index) for index in range(keys))
+  profile["start_gcode"] = "G28\nG1 Z5 F5000\n" * 20
+  profile["end_gcode"] = "M104 S0\nG28 X0\nM84\n" * 20
+  paths = []
+  for index in range(count):
+    path = os.path.join(folder, "profile_%d.profile" % index)
+    Profile.to_slic3r_ini(profile, path, display_name="Profile %d" % index, description="Generated profile number %d" % index)
+    paths.append(path)
+  return paths
+
+def list_full(paths, index_path):
+  return [Profile.from_slic3r_ini(path)[1:] for path in paths]
+
+def list_headers(paths, index_path):
+  return [read_profile_metadata(path) for path in paths]
+
+def list_indexed(paths, index_path):
+  index = ProfileIndex(index_path, read_profile_metadata)
+  result = [index.get(path) for path in paths]
+  index.save()
+  return result
+
+def measure(function, paths, index_path, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    function(paths, index_path)
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+  return best
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--profiles", type=int, default=200, help="number of profiles in the folder")
+  parser.add_argument("--keys", type=int, default=250, help="settings per profile")
+  parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best is reported")
+  args = parser.parse_args()
+
+  folder = tempfile.mkdtemp()
+  try:
+    paths = write_profiles(folder, args.profiles, args.keys)
+    index_path = os.path.join(folder, "profiles.json")
+    # fill the index, the measured runs load it from disk like after a restart
+    list_indexed(paths, index_path)
+
+    print("{:>16} {:>10} {:>14}".format("listing", "best ms", "per profile us"))
+    for name, function in (("full parse", list_full), ("headers only", list_headers), ("index", list_indexed)):
+      duration = measure(function, paths, index_path, args.repeat)
+      print("{:>16} {:>10.1f} {:>14.1f}".format(name, duration * 1000, duration * 1000000 / len(paths)))
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,128 @@
+# coding=utf-8
+"""Compares the INI parser up to 1.3.1 with ``ConfigBundle``.
+
+Generates a PrusaSlicer style config export and a config bundle with many
+presets (each with escaped multi line G-code), then measures parse time and
+peak memory (via ``tracemalloc``) for both. The old parser can't tell the
+bundle's sections apart, it's measured flattening the whole file.
+
+Usage::
+
+    python benchmarks/bench_profile_parser.py --presets 300 --keys 250
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from octoprint_slic3r.profile import ConfigBundle, Profile
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+def legacy_from_slic3r_ini(path):
+  """``Profile.from_slic3r_ini`` as of 1.3.1."""
+  result = dict()
+  display_name = None
+  description = None
+  with open(path) as f:
+    for line in f:
+      if "#" in line:
+        if line.startswith("# Name: "):
+          display_name = line[len("# Name: "):]
+        elif line.startswith("# Description: "):
+          description = line[len("# Description: "):]
+      split_line = line.split("=", 1)
+      if len(split_line) != 2:
+        continue
+      key, v = map(str.strip, split_line)
+      if "#" in v and str.strip(v[0:v.find("#")]):
+        v = str.strip(v[0:v.find("#")])
+
+      result[key] = v
+
+  return result, display_name, description
+
+def bundle_profiles(path):
+  bundle = ConfigBundle.from_file(path)
+  return list(bundle.get_profiles()) or bundle.settings
+
+GCODE = "\\n".join(["G1 X{0}.5 Y{0}.25 F3000 ; move #{0}".format(i) for i in range(100)])
+
+def write_settings(f, prefix, keys):
+  for i in range(keys):
+    f.write("{}_setting_{} = {}\n".format(prefix, i, i * 0.1))
+  f.write("start_gcode = M117 Starting #1\\nG28 ; home all\\n{}\n".format(GCODE))
+  f.write("end_gcode = M104 S0\\n{}\n".format(GCODE))
+  f.write("extruder_colour = \"#FF8000\";\"#00FF00\"\n")
+
+def write_config(path, keys):
+  with open(path, "w") as f:
+    f.write("# generated by PrusaSlicer 2.4.2+linux-x64-GTK3 on 2022-04-22 at 21:44:51 UTC\n")
+    write_settings(f, "option", keys)
+
+def write_bundle(path, presets, keys):
+  per_type = max(1, presets // 3)
+  with open(path, "w") as f:
+    f.write("# generated by PrusaSlicer 2.4.2+linux-x64-GTK3 on 2022-04-22 at 21:44:51 UTC\n")
+    for section_type in ("print", "filament", "printer"):
+      f.write("\n[{}:*common*]\n".format(section_type))
+      write_settings(f, section_type, keys)
+      for i in range(per_type):
+        f.write("\n[{}:Preset {}]\n".format(section_type, i))
+        f.write("inherits = *common*\n")
+        write_settings(f, section_type, keys // 2)
+    f.write("\n[presets]\nprint = Preset 0\nfilament = Preset 0\nprinter = Preset 0\n")
+
+def measure(parser, path, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    parser(path)
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+
+  peak = None
+  if tracemalloc is not None:
+    tracemalloc.start()
+    result = parser(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+  return best, peak
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--presets", type=int, default=300, help="presets in the generated bundle")
+  parser.add_argument("--keys", type=int, default=250, help="settings per preset")
+  parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best is reported")
+  args = parser.parse_args()
+
+  folder = tempfile.mkdtemp()
+  try:
+    config = os.path.join(folder, "config.ini")
+    bundle = os.path.join(folder, "bundle.ini")
+    write_config(config, args.keys * 10)
+    write_bundle(bundle, args.presets, args.keys)
+
+    print("{:>12} {:>10} {:>18} {:>10} {:>12}".format("file", "size kB", "parser", "best ms", "peak kB"))
+    for name, path in (("config", config), ("bundle", bundle)):
+      for parser_name, parse in (("1.3.1", legacy_from_slic3r_ini), ("from_slic3r_ini", Profile.from_slic3r_ini),
+                                 ("ConfigBundle", ConfigBundle.from_file), ("+ get_profiles", bundle_profiles)):
+        duration, peak = measure(parse, path, args.repeat)
+        print("{:>12} {:>10.0f} {:>18} {:>10.1f} {:>12}".format(name, os.path.getsize(path) / 1024.0, parser_name, duration * 1000,
+                                                              "{:.0f}".format(peak / 1024.0) if peak is not None else "-"))
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""Measures moving cached G-code to another position on the bed.
+
+Generates G-code with ``fake_slicer.py`` at one center, shifts it to another
+one with ``translate_gcode`` and checks the result is identical to what the
+fake slicer writes for that center. Compare the throughput with how long
+a real slicer takes for G-code of that size.
+
+Usage::
+
+    python benchmarks/bench_translate.py --size 100
+"""
+from __future__ import absolute_import, print_function, division
+
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+from octoprint_slic3r.translate import translate_gcode
+
+import fake_slicer
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--size", type=int, default=100, help="size of the G-code in MB")
+  parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best is reported")
+  args = parser.parse_args()
+
+  source_center = (100.0, 100.0)
+  target_center = (57.25, 130.5)
+  size = args.size * 1024 * 1024
+
+  folder = tempfile.mkdtemp()
+  try:
+    source = os.path.join(folder, "source.gcode")
+    expected = os.path.join(folder, "expected.gcode")
+    output = os.path.join(folder, "output.gcode")
+
+    fake_slicer.write_gcode(source, size, center=source_center)
+    fake_slicer.write_gcode(expected, size, center=target_center)
+
+    best = None
+    for _ in range(args.repeat):
+      start = time.time()
+      with open(source, "rb") as src, open(output, "wb") as dst:
+        stats = translate_gcode(src, dst, target_center[0] - source_center[0], target_center[1] - source_center[1])
+      duration = time.time() - start
+      best = duration if best is None else min(best, duration)
+
+    if not filecmp.cmp(expected, output, shallow=False):
+      raise RuntimeError("Moved G-code differs from G-code generated at the target center")
+
+    megabytes = os.path.getsize(source) / 1024.0 / 1024.0
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>12}".format("size MB", "lines", "moves", "best s", "MB/s", "lines/s"))
+    print("{:>10.1f} {:>10} {:>10} {:>10.2f} {:>10.1f} {:>12.0f}".format(megabytes, stats["lines"], stats["moves"],
+                                                                     best, megabytes / best, stats["lines"] / best))
+  finally:
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+  main()
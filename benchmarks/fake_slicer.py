@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""A stand-in for the Slic3r/PrusaSlicer command line used by the benchmarks.
+
+It understands just enough of the command line the plugin builds (``--help``,
+``-o``/``--output``, ``--output-filename-format``, ``--binary-gcode``,
+``--center`` and the model files, each of which is "sliced" on its own) and
+is configured through environment variables:
+
+FAKE_SLICER_BANNER
+    First line of the ``--help`` output, defaults to a PrusaSlicer 2.4 banner.
+    ``--binary-gcode`` is only offered for versions from 2.7 on.
+FAKE_SLICER_LINES
+    Number of ``[trace]`` lines to emit while "slicing" (default 1000).
+FAKE_SLICER_RATE
+    Trace lines per second, 0 (default) emits them as fast as possible.
+FAKE_SLICER_GCODE_SIZE
+    Approximate size of the G-code to write in bytes (default 1 MB).
+FAKE_SLICER_STARTUP
+    Seconds to sleep before doing anything, to mimic a cold start (default 0).
+FAKE_SLICER_EXIT
+    Exit code to return, a non-zero value skips writing G-code (default 0).
+"""
+from __future__ import print_function
+
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+
+# status line printed before a phase, trace message per layer of that phase
+PHASES = (
+  ("10 => Processing triangulated mesh", "Slicing layer"),
+  ("20 => Generating perimeters", "Generating perimeters for layer"),
+  ("45 => Making infill", "Making infill for layer"),
+  ("90 => Exporting G-code", "Exported layer"),
+)
+
+HELP = """{banner}
+https://github.com/prusa3d/PrusaSlicer
+
+Usage: prusa-slicer [ ACTIONS ] [ TRANSFORM ] [ OPTIONS ] [ file.stl ... ]
+
+Actions:
+ --export-gcode, --gcode, -g
+                     Slice the model and export toolpaths as G-code.
+ --help, -h          Show this help.
+ --slice, -s         Slice the model as FFF or SLA based on the printer_technology configuration value.
+
+Transform options:
+ --center X,Y        Center the print around the given center.
+ --merge, -m         If multiple files are supplied, they will be composed into a single print rather than processed individually.
+
+Output options:
+ --output-filename-format ABCD
+                     Output file name format; all config options enclosed in brackets will be replaced by their values.
+{binary_option}
+Other options:
+ --load ABCD         Load configuration from the specified file.
+ --output ABCD, -o ABCD
+                     The file where the output will be written.
+"""
+
+SUMMARY = """; filament used [mm] = 1234.56
+; filament used [cm3] = 2.97
+; total filament cost = 0.09
+; estimated printing time (normal mode) = 1h 2m 3s
+; estimated printing time (silent mode) = 1h 5m 0s
+"""
+
+def env(name, default, cast=str):
+  return cast(os.environ.get(name, default))
+
+def trace(message):
+  sys.stdout.write("[2022-04-22 21:44:51.396082] [0x75527010] [trace]   {}\n".format(message))
+
+BINARY_OPTION = """ --binary-gcode       Export G-code in binary format.
+"""
+
+def coordinate(value):
+  # PrusaSlicer writes three decimals without trailing zeros
+  return ("%.3f" % value).rstrip("0").rstrip(".")
+
+def gcode_chunks(size, center=(100.0, 100.0)):
+  """Yields G-code structured like PrusaSlicer's: custom start and end G-code
+  at fixed positions, layers of perimeters and arcs around ``center``."""
+  x, y = center
+  lines = []
+  for index in range(1024):
+    side, step = divmod(index % 256, 64)
+    offset = step * 20.0 / 64 - 10
+    dx, dy = ((offset, -10), (10, offset), (-offset, 10), (-10, -offset))[side]
+    if index % 64 == 63:
+      lines.append("G2 X{} Y{} I2.5 J-2.5 E.01234\n".format(coordinate(x + dx), coordinate(y + dy)))
+    else:
+      lines.append("G1 X{} Y{} E.01234\n".format(coordinate(x + dx), coordinate(y + dy)))
+  block = "".join(lines).encode("ascii")
+  travel = "G1 X{} Y{} F9000\n;TYPE:External perimeter\n".format(coordinate(x - 10), coordinate(y - 10)).encode("ascii")
+
+  yield b"; generated by fake_slicer\n;TYPE:Custom\nG90\nM83\nG28\nG1 X0 Y-3 F6000\nG1 X60 E9 F1000\nG92 E0\n"
+  # the same number of layers for every center
+  for layer in range(max(1, size // (len(lines) * 30))):
+    yield ";LAYER_CHANGE\n;Z:{0:.2f}\n;HEIGHT:0.2\nG1 Z{0:.2f} F720\n".format(0.2 * (layer + 1)).encode("ascii") + travel + block
+  yield b";TYPE:Custom\nG91\nG1 Z1 F720\nG90\nG1 X0 Y200 F3000\nM84\n"
+
+def write_gcode(path, size, center=(100.0, 100.0)):
+  with open(path, "wb") as f:
+    for chunk in gcode_chunks(size, center=center):
+      f.write(chunk)
+    f.write(SUMMARY.encode("ascii"))
+
+def write_bgcode_block(f, block_type, data, compress=False, parameters=b"\0\0"):
+  if compress:
+    header = struct.pack("<HHII", block_type, 1, len(data), 0)
+    data = zlib.compress(data)
+    header = header[:8] + struct.pack("<I", len(data))
+  else:
+    header = struct.pack("<HHI", block_type, 0, len(data))
+  f.write(header + parameters + data)
+  f.write(struct.pack("<I", zlib.crc32(header + parameters + data) & 0xffffffff))
+
+def write_bgcode(path, size, center=(100.0, 100.0)):
+  """Writes binary G-code like PrusaSlicer 2.7, with deflate instead of
+  heatshrink compressed G-code blocks (which the standard library lacks)."""
+  summary = SUMMARY.replace("; ", "").replace(" = ", "=").encode("ascii")
+  with open(path, "wb") as f:
+    f.write(struct.pack("<4sIH", b"GCDE", 1, 1))
+    write_bgcode_block(f, 0, b"Producer=fake_slicer\n")
+    write_bgcode_block(f, 3, b"printer_model=MK4\nnozzle_diameter=0.4\n")
+    write_bgcode_block(f, 4, summary)
+    write_bgcode_block(f, 2, b"".join(b"option_%d = %d\n" % (i, i) for i in range(300)), compress=True)
+    pending = b""
+    for chunk in gcode_chunks(size, center=center):
+      pending += chunk
+      while len(pending) >= 65536:
+        write_bgcode_block(f, 1, pending[:65536], compress=True)
+        pending = pending[65536:]
+    if pending:
+      write_bgcode_block(f, 1, pending, compress=True)
+
+def supports_binary(banner):
+  m = re.search(r"(\d+)\.(\d+)", banner)
+  return m is not None and (int(m.group(1)), int(m.group(2))) >= (2, 7)
+
+def main(args):
+  startup = env("FAKE_SLICER_STARTUP", 0, float)
+  if startup:
+    time.sleep(startup)
+
+  if "--help" in args or "-h" in args:
+    banner = env("FAKE_SLICER_BANNER", "PrusaSlicer-2.4.2+linux-x64-GTK3-202204251110 based on Slic3r (with GUI support)")
+    print(HELP.format(banner=banner, binary_option=BINARY_OPTION if supports_binary(banner) else ""))
+    return 0
+
+  output = None
+  filename_format = "{input_filename_base}.gcode"
+  binary = False
+  center = (100.0, 100.0)
+  models = []
+  index = 0
+  while index < len(args):
+    arg = args[index]
+    if arg in ("-o", "--output"):
+      output = args[index + 1]
+    elif arg == "--output-filename-format":
+      filename_format = args[index + 1]
+    elif arg in ("--center", "--print-center"):
+      center = tuple(float(value) for value in args[index + 1].split(","))
+    elif arg == "--load":
+      pass
+    elif arg == "--binary-gcode":
+      binary = True
+      index += 1
+      continue
+    else:
+      if not arg.startswith("-"):
+        models.append(arg)
+      index += 1
+      continue
+    index += 2
+
+  lines = env("FAKE_SLICER_LINES", 1000, int)
+  rate = env("FAKE_SLICER_RATE", 0, float)
+  per_phase = max(1, lines // len(PHASES))
+  emitted = 0
+  start = time.time()
+  for model in models or [None]:
+    for status, phase in PHASES:
+      print(status)
+      for layer in range(per_phase):
+        trace("{} {}".format(phase, layer))
+        emitted += 1
+        if rate:
+          delay = start + emitted / rate - time.time()
+          if delay > 0:
+            sys.stdout.flush()
+            time.sleep(delay)
+    sys.stdout.flush()
+
+    exit_code = env("FAKE_SLICER_EXIT", 0, int)
+    if exit_code:
+      sys.stderr.write("fake_slicer failed on purpose\n")
+      return exit_code
+
+    path = output
+    if model is not None and (path is None or os.path.isdir(path)):
+      base, _ = os.path.splitext(os.path.basename(model))
+      path = os.path.join(path or os.path.dirname(model), filename_format.replace("{input_filename_base}", base))
+    if path:
+      write = write_bgcode if binary else write_gcode
+      write(path, env("FAKE_SLICER_GCODE_SIZE", 1024 * 1024, int), center=center)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
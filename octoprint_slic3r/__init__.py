@@ -6,9 +6,7 @@ import logging.handlers
 import os
 import flask
 import re
-import json
-from collections import defaultdict
-from pkg_resources import parse_version
+import time
 
 import octoprint.plugin
 import octoprint.util
@@ -17,59 +15,56 @@ import octoprint.settings
 
 from octoprint.util.paths import normalize as normalize_path
 
-from .profile import Profile
+from .profile import Profile, read_profile_metadata, read_profiles
+from .engine import EngineCapabilities, EngineCapabilitiesCache
+from .analysis import get_analysis_from_gcode
+from .bgcode import BgcodeError
+from .output import FifoTee
+from .cache import ConfigScratch, ModelCache, ProfileCache, ProfileIndex, SliceResultCache, default_scratch_folder, hash_file, hash_profile, move_file, staging_path
+from .job import SlicingJob, SlicingPriorities
+from .scheduler import SlicingScheduler
+from .process import pump_output, wait_process
+from .limits import ProcessTimeout, ResourceLimits
+from .metrics import JobResults, SlicingMetrics
+from .batch import BATCH_MAX_MODEL_SIZE, BatchJobStates, BatchProgress, SlicingBatch, batch_output_path, get_batch_entry_error, stage_models
+from .progress import SlicingProgress, expected_layer_count
+from .mesh import get_fit_error, inspect_model
+from .plate import PlateError, pack_plate, write_plate_stl
+from .translate import TranslationUnsafe, get_profile_blocker, translate_gcode
+from .remote import RemoteBackend, RemoteCancelled, RemoteUnavailable, parse_worker_urls
+from .logs import EngineLogPipeline, EngineOutputLog, JobFilter, JobLogHandler, TraceSampler
+
+
+class LazySlicingProfile(octoprint.slicing.SlicingProfile):
+  """A SlicingProfile whose settings are only loaded once ``data`` is accessed.
+
+  ``loader`` is called without arguments and returns the profile dict.
+  """
 
+  def __init__(self, slicer, name, loader, display_name=None, description=None, default=False):
+    self._loader = loader
+    self._data = None
+    octoprint.slicing.SlicingProfile.__init__(self, slicer, name, None, display_name=display_name, description=description, default=default)
 
-def get_analysis_from_gcode(machinecode_path):
-  """Extracts the analysis data structure from the gocde.
+  @property
+  def data(self):
+    if self._data is None:
+      self._data = self._loader()
+    return self._data
+
+  @data.setter
+  def data(self, value):
+    self._data = value
 
-  The analysis structure should look like this:
-  http://docs.octoprint.org/en/master/modules/filemanager.html#octoprint.filemanager.analysis.GcodeAnalysisQueue
-  (There is a bug in the documentation, estimatedPrintTime should be in seconds.)
-  Return None if there is no analysis information in the file.
-  """
-  filament_length = None
-  filament_volume = None
-  printing_seconds = None
-  with open(machinecode_path) as gcode_lines:
-    for gcode_line in gcode_lines:
-      m = re.match('\s*;\s*filament used\s*=\s*([0-9.]+)\s*mm\s*\(([0-9.]+)cm3\)\s*', gcode_line)
-      if m:
-        filament_length = float(m.group(1))
-        filament_volume = float(m.group(2))
-      m = re.match('\s*;\s*estimated printing time\s*=\s(.*)\s*', gcode_line)
-      if m:
-        time_text = m.group(1)
-        # Now extract the days, hours, minutes, and seconds
-        printing_seconds = 0
-        for time_part in time_text.split(' '):
-          for unit in [("h", 60*60),
-                       ("m", 60),
-                       ("s", 1),
-                       ("d", 24*60*60)]:
-            m = re.match('\s*([0-9.]+)' + re.escape(unit[0]), time_part)
-            if m:
-              printing_seconds += float(m.group(1)) * unit[1]
-  # Now build up the analysis struct
-  analysis = None
-  if printing_seconds is not None or filament_length is not None or filament_volume is not None:
-    dd = lambda: defaultdict(dd)
-    analysis = dd()
-    if printing_seconds is not None:
-      analysis['estimatedPrintTime'] = printing_seconds
-    if filament_length is not None:
-      analysis['filament']['tool0']['length'] = filament_length
-    if filament_volume is not None:
-      analysis['filament']['tool0']['volume'] = filament_volume
-    return json.loads(json.dumps(analysis)) # We need to be strict about our return type, unfortunately.
-  return None
 
 class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
                    octoprint.plugin.SettingsPlugin,
                    octoprint.plugin.TemplatePlugin,
                    octoprint.plugin.AssetPlugin,
                    octoprint.plugin.BlueprintPlugin,
-                   octoprint.plugin.StartupPlugin):
+                   octoprint.plugin.StartupPlugin,
+                   octoprint.plugin.ShutdownPlugin,
+                   octoprint.plugin.EventHandlerPlugin):
 
   def __init__(self):
     # setup job tracking across threads
@@ -78,6 +73,27 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
     self._slicing_commands_mutex = threading.Lock()
     self._cancelled_jobs = []
     self._cancelled_jobs_mutex = threading.Lock()
+    self._engine_capabilities = None
+    self._result_cache = None
+    self._profile_cache = ProfileCache(Profile.from_slic3r_ini)
+    self._profile_index = None
+    self._config_scratch = ConfigScratch(default_scratch_folder(), Profile.to_slic3r_ini)
+    self._model_cache = ModelCache(inspect_model)
+    # placement keys of cached results that turned out not to be movable
+    self._unmovable_placements = set()
+    self._scheduler = SlicingScheduler(on_preempt=self._on_preempt)
+    self._preslicing = set()
+    self._preslicing_mutex = threading.Lock()
+    # built from the settings when first needed, jobs running on a worker by machinecode_path
+    self._remote_backend = None
+    self._remote_jobs = dict()
+    self._remote_mutex = threading.Lock()
+    self._metrics = SlicingMetrics()
+    self._log_pipeline = None
+    self._job_log_handler = None
+    self._trace_sampler = None
+    self._batches = dict()
+    self._batches_mutex = threading.Lock()
 
   ##~~ Softwareupdate hook
 
@@ -109,13 +125,173 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
     slic3r_logging_handler = logging.handlers.RotatingFileHandler(self._settings.get_plugin_logfile_path(postfix="engine"), maxBytes=2*1024*1024)
     slic3r_logging_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
     slic3r_logging_handler.setLevel(logging.DEBUG)
+    slic3r_logging_handler.addFilter(JobFilter())
+    self._job_log_handler = JobLogHandler(os.path.join(self.get_plugin_data_folder(), "logs"))
+    self._job_log_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    self._configure_job_logs()
 
-    self._slic3r_logger.addHandler(slic3r_logging_handler)
+    # written by a background thread, so slicing never waits for the disk
+    self._log_pipeline = EngineLogPipeline(self._slic3r_logger, [slic3r_logging_handler, self._job_log_handler])
     self._slic3r_logger.setLevel(logging.DEBUG if self._settings.get_boolean(["debug_logging"]) else logging.CRITICAL)
     self._slic3r_logger.propagate = False
 
+    self._engine_capabilities = EngineCapabilitiesCache(os.path.join(self.get_plugin_data_folder(), "engine.json"))
+    self._probe_engine_async()
+
+    self._result_cache = SliceResultCache(os.path.join(self.get_plugin_data_folder(), "cache"), max_size=self._get_cache_size())
+    self._profile_index = ProfileIndex(os.path.join(self.get_plugin_data_folder(), "profiles.json"), read_profile_metadata)
+    self._scheduler.max_jobs = self._settings.get_int(["max_concurrent_jobs"])
+
+  ##~~ ShutdownPlugin API
+
+  def on_shutdown(self):
+    if self._log_pipeline is not None:
+      self._log_pipeline.stop()
+
+  ##~~ EventHandlerPlugin API
+
+  def on_event(self, event, payload):
+    from octoprint.events import Events
+    from octoprint.filemanager.destinations import FileDestinations
+
+    if event != Events.UPLOAD or not self._settings.get_boolean(["preslice_enabled"]):
+      return
+    path = payload.get("path")
+    if payload.get("target") != FileDestinations.LOCAL or not path or not path.lower().endswith(".stl"):
+      return
+    if self._result_cache is None or not self._settings.get_boolean(["cache_enabled"]):
+      return
+
+    import threading
+    thread = threading.Thread(target=self._preslice, args=(self._file_manager.path_on_disk(FileDestinations.LOCAL, path),))
+    thread.daemon = True
+    thread.start()
+
+  def _preslice(self, model_path, attempts=3):
+    """Slices a freshly uploaded model with the default profile into the
+    result cache, so slicing it for real afterwards is a cache hit.
+
+    Runs at background priority, so any other job is preferred and preempts
+    it. A preempted model is queued again, up to ``attempts`` times.
+    """
+    import tempfile
+
+    with self._preslicing_mutex:
+      if model_path in self._preslicing:
+        return
+      self._preslicing.add(model_path)
+
+    try:
+      for attempt in range(attempts):
+        reason = self._get_preslice_blocker()
+        if reason is not None:
+          self._logger.info("Not pre-slicing %s, %s" % (model_path, reason))
+          return
+
+        fd, machinecode_path = tempfile.mkstemp(prefix="slic3r-preslice-", suffix=".gco")
+        os.close(fd)
+        try:
+          printer_profile = self._printer_profile_manager.get_current_or_default()
+          # the profile slicing the upload through OctoPrint will use, so the
+          # cache key matches
+          success, result = self.do_slice(model_path, printer_profile, machinecode_path=machinecode_path,
+                                          profile_path=self.get_default_profile_path(),
+                                          priority=SlicingPriorities.BACKGROUND)
+          if success:
+            self._logger.info("Pre-sliced %s into the result cache" % model_path)
+          else:
+            self._logger.info("Could not pre-slice %s: %s" % (model_path, result))
+          return
+        except octoprint.slicing.SlicingCancelled:
+          self._logger.info("Pre-slicing of %s was preempted (attempt %d of %d)" % (model_path, attempt + 1, attempts))
+        finally:
+          if os.path.exists(machinecode_path):
+            os.remove(machinecode_path)
+    except Exception:
+      self._logger.exception("Error while pre-slicing %s" % model_path)
+    finally:
+      with self._preslicing_mutex:
+        self._preslicing.discard(model_path)
+
+  def _get_preslice_blocker(self):
+    """Returns why background slicing shouldn't start right now, None if it may."""
+    if self._printer.is_printing():
+      return "the printer is printing"
+    if hasattr(os, "getloadavg"):
+      from .scheduler import default_max_jobs
+      load = os.getloadavg()[0]
+      if load >= default_max_jobs():
+        return "the system is busy (load %.2f)" % load
+    return None
+
+  def _on_preempt(self, job):
+    self._logger.info("Preempting background slicing of %s" % job.model_path)
+    self.cancel_slicing(job.id)
+
   ##~~ BlueprintPlugin API
 
+  @octoprint.plugin.BlueprintPlugin.route("/cache", methods=["GET"])
+  def getCacheStats(self):
+    result = dict(results=self._result_cache.get_stats() if self._result_cache is not None else None,
+                  profiles=self._profile_cache.get_stats(),
+                  profile_index=self._profile_index.get_stats() if self._profile_index is not None else None,
+                  models=self._model_cache.get_stats(),
+                  configs=self._config_scratch.get_stats())
+    return flask.jsonify(result)
+
+  @octoprint.plugin.BlueprintPlugin.route("/cache", methods=["DELETE"])
+  def clearCache(self):
+    if self._result_cache is not None:
+      self._result_cache.clear()
+    self._unmovable_placements.clear()
+    self._profile_cache.invalidate()
+    if self._profile_index is not None:
+      self._profile_index.invalidate()
+    self._model_cache.invalidate()
+    self._config_scratch.clear()
+    return flask.make_response("", 204)
+
+  @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+  def getMetrics(self):
+    if flask.request.values.get("format") == "prometheus":
+      stats = self._scheduler.get_stats()
+      gauges = dict(
+        slic3r_jobs_running=("Slicing jobs currently running", stats["running"]),
+        slic3r_jobs_queued=("Slicing jobs waiting for a free slot", stats["queued"]),
+        slic3r_jobs_max=("Maximum number of concurrent slicing jobs", stats["max_jobs"]),
+        slic3r_log_records_dropped=("Log records dropped because the log writer couldn't keep up",
+                                    self._log_pipeline.dropped if self._log_pipeline is not None else 0)
+      )
+      backend = self._remote_backend
+      if backend is not None:
+        gauges["slic3r_remote_workers_healthy"] = ("Slicing workers that answered their last health check",
+                                                   len([worker for worker in backend.workers if worker.healthy]))
+      r = flask.make_response(self._metrics.to_prometheus(gauges=gauges))
+      r.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+      return r
+
+    result = self._metrics.get_summary()
+    result.update(scheduler=self._scheduler.get_stats(), records=self._metrics.get_records())
+    return flask.jsonify(result)
+
+  @octoprint.plugin.BlueprintPlugin.route("/logs", methods=["GET"])
+  def getJobLogs(self):
+    folder = self._job_log_handler.folder if self._job_log_handler is not None else None
+    logs = []
+    if folder is not None and os.path.isdir(folder):
+      for name in sorted(os.listdir(folder), reverse=True):
+        if name.endswith(".log.gz"):
+          stat = os.stat(os.path.join(folder, name))
+          logs.append(dict(name=name, size=stat.st_size, date=int(stat.st_mtime)))
+    return flask.jsonify(dict(logs=logs))
+
+  @octoprint.plugin.BlueprintPlugin.route("/logs/<filename>", methods=["GET"])
+  def getJobLog(self, filename):
+    if self._job_log_handler is None or not filename.endswith(".log.gz"):
+      return flask.make_response("Unknown log file", 404)
+    # refuses paths outside the folder
+    return flask.send_from_directory(self._job_log_handler.folder, filename, as_attachment=True)
+
   @octoprint.plugin.BlueprintPlugin.route("/import", methods=["POST"])
   def importSlic3rProfile(self):
     import datetime
@@ -130,7 +306,7 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
       try:
         profile_dict, imported_name, imported_description = Profile.from_slic3r_ini(flask.request.values[input_upload_path])
       except Exception as e:
-        return flask.make_response("Something went wrong while converting imported profile: {message}".format(e.message), 500)
+        return flask.make_response("Something went wrong while converting imported profile: {message}".format(message=str(e)), 500)
 
     elif input_name in flask.request.files:
       temp_file = tempfile.NamedTemporaryFile("wb", delete=False)
@@ -140,9 +316,9 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
         upload.save(temp_file.name)
         profile_dict, imported_name, imported_description = Profile.from_slic3r_ini(temp_file.name)
       except Exception as e:
-        return flask.make_response("Something went wrong while converting imported profile: {message}".format(e.message), 500)
+        return flask.make_response("Something went wrong while converting imported profile: {message}".format(message=str(e)), 500)
       finally:
-        os.remove(temp_file)
+        os.remove(temp_file.name)
 
       filename = upload.filename
 
@@ -184,6 +360,310 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
     r.headers["Location"] = result["resource"]
     return r
 
+  @octoprint.plugin.BlueprintPlugin.route("/import/bulk", methods=["POST"])
+  def importSlic3rProfiles(self):
+    import datetime
+    import tempfile
+    from octoprint.events import Events
+
+    # adds, replaces and may select the default profile, like OctoPrint's own
+    # slicing profile API
+    forbidden = self._check_permissions("SETTINGS")
+    if forbidden is not None:
+      return forbidden
+
+    input_name = "file"
+    input_upload_name = input_name + "." + self._settings.global_get(["server", "uploads", "nameSuffix"])
+    input_upload_path = input_name + "." + self._settings.global_get(["server", "uploads", "pathSuffix"])
+
+    temp_path = None
+    if input_upload_name in flask.request.values and input_upload_path in flask.request.values:
+      filename = flask.request.values[input_upload_name]
+      upload_path = flask.request.values[input_upload_path]
+    elif input_name in flask.request.files:
+      upload = flask.request.files[input_name]
+      filename = upload.filename
+      fd, temp_path = tempfile.mkstemp()
+      os.close(fd)
+      upload.save(temp_path)
+      upload_path = temp_path
+    else:
+      return flask.make_response("No file included", 400)
+
+    allow_overwrite = False
+    if "allowOverwrite" in flask.request.values:
+      from octoprint.server.api import valid_boolean_trues
+      allow_overwrite = flask.request.values["allowOverwrite"] in valid_boolean_trues
+
+    default_description = "Imported from {filename} on {date}".format(filename=filename, date=octoprint.util.get_formatted_datetime(datetime.datetime.now()))
+    first_profile = len(self._slicing_manager.all_profiles("slic3r", require_configured=False)) == 0
+
+    results = []
+    saved = set()
+    try:
+      for entry in read_profiles(upload_path, filename=filename):
+        result = dict(source=entry["source"])
+        results.append(result)
+        if "error" in entry:
+          result.update(result="failed", error=entry["error"])
+          continue
+
+        try:
+          profile_name = _sanitize_name(entry["name"])
+          if not profile_name:
+            raise ValueError("Invalid profile name {name!r}".format(name=entry["name"]))
+          result.update(name=profile_name, displayName=entry["display_name"])
+          if profile_name in saved:
+            raise ValueError("Another profile in the upload is already named {name}".format(name=profile_name))
+
+          path = self._slicing_manager.get_profile_path("slic3r", profile_name)
+          is_overwrite = os.path.exists(path)
+          if is_overwrite and not allow_overwrite:
+            result.update(result="skipped", error="Profile already exists")
+            continue
+
+          self._save_profile(path, entry["profile"], display_name=entry["display_name"], description=entry["description"] or default_description)
+        except Exception as e:
+          result.update(result="failed", error=str(e))
+          continue
+
+        saved.add(profile_name)
+        result.update(result="modified" if is_overwrite else "added",
+                      resource=flask.url_for("api.slicingGetSlicerProfile", slicer="slic3r", name=profile_name, _external=True))
+        self._event_bus.fire(Events.SLICING_PROFILE_MODIFIED if is_overwrite else Events.SLICING_PROFILE_ADDED,
+                             dict(slicer="slic3r", profile=profile_name))
+    except Exception as e:
+      self._logger.exception("Could not import profiles from %s" % filename)
+      return flask.make_response("Something went wrong while reading {filename}: {message}".format(filename=filename, message=str(e)), 400)
+    finally:
+      if temp_path is not None:
+        os.remove(temp_path)
+
+    if first_profile and saved:
+      self._slicing_manager.set_default_profile("slic3r", sorted(saved)[0])
+
+    summary = dict((state, sum(1 for result in results if result["result"] == state)) for state in ("added", "modified", "skipped", "failed"))
+    return flask.jsonify(dict(profiles=results, **summary))
+
+  @octoprint.plugin.BlueprintPlugin.route("/batch", methods=["POST"])
+  def startBatch(self):
+    from octoprint.filemanager.destinations import FileDestinations
+
+    forbidden = self._check_permissions("SLICE", "FILES_UPLOAD")
+    if forbidden is not None:
+      return forbidden
+
+    data = flask.request.get_json(silent=True)
+    if not data or not isinstance(data.get("files"), list) or not data["files"]:
+      return flask.make_response("Expected a list of files to slice", 400)
+
+    profile_path = None
+    if data.get("profile"):
+      try:
+        profile_path = self._slicing_manager.get_profile_path("slic3r", data["profile"], must_exist=True)
+      except Exception:
+        return flask.make_response("Unknown profile {name}".format(name=data["profile"]), 404)
+
+    printer_profile = None
+    if data.get("printerProfile"):
+      printer_profile = self._printer_profile_manager.get(data["printerProfile"])
+      if printer_profile is None:
+        return flask.make_response("Unknown printer profile {id}".format(id=data["printerProfile"]), 404)
+
+    allow_overwrite = data.get("allowOverwrite") is True
+
+    # check everything before staging any output
+    entries = []
+    targets = set()
+    for entry in data["files"]:
+      if not isinstance(entry, dict):
+        entry = dict(path=entry)
+      error = get_batch_entry_error(entry)
+      if error is not None:
+        return flask.make_response(error, 400)
+      path = entry["path"]
+      gcode = entry.get("gcode") or os.path.splitext(path)[0] + ".gco"
+      try:
+        if not self._file_manager.file_exists(FileDestinations.LOCAL, path):
+          return flask.make_response("Unknown file {path}".format(path=path), 404)
+        model_path = self._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+        gcode_path = self._file_manager.path_on_disk(FileDestinations.LOCAL, gcode)
+        exists = self._file_manager.file_exists(FileDestinations.LOCAL, gcode)
+      except ValueError as e:
+        return flask.make_response("Invalid file name in {entry!r}: {message}".format(entry=entry, message=str(e)), 400)
+      if gcode_path in targets:
+        return flask.make_response("More than one model would be sliced to {gcode}".format(gcode=gcode), 400)
+      if exists and not allow_overwrite:
+        return flask.make_response("{gcode} exists already, set allowOverwrite to replace it".format(gcode=gcode), 409)
+      targets.add(gcode_path)
+      entries.append((entry, path, gcode, model_path, gcode_path))
+
+    models = []
+    try:
+      for entry, path, gcode, model_path, gcode_path in entries:
+        # in the target folder, storing the result is then just a rename
+        models.append(dict(model_path=model_path,
+                           machinecode_path=staging_path(gcode_path, suffix=".gco"),
+                           position=entry.get("position"),
+                           path=path,
+                           gcode=gcode))
+    except Exception:
+      self._remove_staged(models)
+      raise
+
+    def on_event(batch, event):
+      if event["type"] == "done":
+        self._store_batch_result(batch, event, models[event["index"]], printer_profile, allow_overwrite=allow_overwrite)
+      self._plugin_manager.send_plugin_message(self._identifier, dict(type="batch", batch=batch.id, event=event))
+
+    try:
+      batch = self.slice_batch(models, profile_path=profile_path, printer_profile=printer_profile, on_event=on_event, wait=False)
+    except ValueError as e:
+      self._remove_staged(models)
+      return flask.make_response(str(e), 400)
+    except Exception:
+      self._remove_staged(models)
+      raise
+
+    result = dict(id=batch.id,
+                  resource=flask.url_for("plugin.slic3r.getBatch", identifier=batch.id, _external=True))
+    r = flask.make_response(flask.jsonify(result), 202)
+    r.headers["Location"] = result["resource"]
+    return r
+
+  @octoprint.plugin.BlueprintPlugin.route("/batch/<identifier>", methods=["GET"])
+  def getBatch(self, identifier):
+    forbidden = self._check_permissions("SLICE")
+    if forbidden is not None:
+      return forbidden
+
+    with self._batches_mutex:
+      batch = self._batches.get(identifier)
+    if batch is None:
+      return flask.make_response("Unknown batch {id}".format(id=identifier), 404)
+    return flask.jsonify(batch.to_dict())
+
+  @octoprint.plugin.BlueprintPlugin.route("/batch/<identifier>", methods=["DELETE"])
+  def cancelBatch(self, identifier):
+    forbidden = self._check_permissions("SLICE")
+    if forbidden is not None:
+      return forbidden
+
+    with self._batches_mutex:
+      batch = self._batches.get(identifier)
+    if batch is None:
+      return flask.make_response("Unknown batch {id}".format(id=identifier), 404)
+    self.cancel_batch(batch)
+    return flask.make_response("", 204)
+
+  @octoprint.plugin.BlueprintPlugin.route("/plate", methods=["POST"])
+  def slicePlate(self):
+    import threading
+    from octoprint.filemanager.destinations import FileDestinations
+    from octoprint.filemanager.util import DiskFileWrapper
+
+    forbidden = self._check_permissions("SLICE", "FILES_UPLOAD")
+    if forbidden is not None:
+      return forbidden
+
+    data = flask.request.get_json(silent=True)
+    if not data or not isinstance(data.get("files"), list) or not data["files"]:
+      return flask.make_response("Expected a list of files to slice", 400)
+    for path in data["files"]:
+      error = get_batch_entry_error(dict(path=path))
+      if error is not None:
+        return flask.make_response(error, 400)
+    if data.get("gcode") is not None and get_batch_entry_error(dict(path=data["gcode"])) is not None:
+      return flask.make_response("Expected a file name as gcode", 400)
+    spacing = data.get("spacing")
+    if spacing is not None and (not isinstance(spacing, (int, float)) or isinstance(spacing, bool) or spacing < 0):
+      return flask.make_response("Expected the spacing in mm, got {spacing!r}".format(spacing=spacing), 400)
+
+    if data.get("profile"):
+      try:
+        profile_path = self._slicing_manager.get_profile_path("slic3r", data["profile"], must_exist=True)
+      except Exception:
+        return flask.make_response("Unknown profile {name}".format(name=data["profile"]), 404)
+    else:
+      profile_path = self.get_default_profile_path()
+
+    if data.get("printerProfile"):
+      printer_profile = self._printer_profile_manager.get(data["printerProfile"])
+      if printer_profile is None:
+        return flask.make_response("Unknown printer profile {id}".format(id=data["printerProfile"]), 404)
+    else:
+      printer_profile = self._printer_profile_manager.get_current_or_default()
+
+    paths = data["files"]
+    gcode = data.get("gcode") or os.path.splitext(paths[0])[0] + "_plate.gco"
+    try:
+      for path in paths:
+        if not self._file_manager.file_exists(FileDestinations.LOCAL, path):
+          return flask.make_response("Unknown file {path}".format(path=path), 404)
+      model_paths = [self._file_manager.path_on_disk(FileDestinations.LOCAL, path) for path in paths]
+      gcode_path = self._file_manager.path_on_disk(FileDestinations.LOCAL, gcode)
+      exists = self._file_manager.file_exists(FileDestinations.LOCAL, gcode)
+    except ValueError as e:
+      return flask.make_response("Invalid file name: {message}".format(message=str(e)), 400)
+
+    allow_overwrite = data.get("allowOverwrite") is True
+    if exists and not allow_overwrite:
+      return flask.make_response("{gcode} exists already, set allowOverwrite to replace it".format(gcode=gcode), 409)
+
+    try:
+      plate = self.plan_plate(model_paths, printer_profile, spacing=spacing)
+    except PlateError as e:
+      return flask.make_response(str(e), 400)
+
+    temp_path = staging_path(gcode_path, suffix=".gco")
+
+    def on_progress(_progress=0.0):
+      self._plugin_manager.send_plugin_message(self._identifier, dict(type="plate", gcode=gcode, progress=_progress))
+
+    def slice_plate():
+      event = dict(type="plate", gcode=gcode, done=True)
+      try:
+        ok, result = self.slice_plate(model_paths, printer_profile, temp_path, profile_path=profile_path, plate=plate, on_progress=on_progress)
+        if ok:
+          self._file_manager.add_file(FileDestinations.LOCAL,
+                                      gcode,
+                                      DiskFileWrapper(os.path.basename(gcode), temp_path, move=True),
+                                      links=[("model", dict(name=path)) for path in paths],
+                                      allow_overwrite=allow_overwrite,
+                                      printer_profile=printer_profile,
+                                      analysis=result.get("analysis"))
+          event.update(result)
+        else:
+          event["error"] = result
+      except octoprint.slicing.SlicingCancelled:
+        event["error"] = "Cancelled"
+      except Exception as e:
+        self._logger.exception("Could not slice the plate %s" % gcode)
+        event["error"] = str(e)
+      finally:
+        if os.path.exists(temp_path):
+          os.remove(temp_path)
+      self._plugin_manager.send_plugin_message(self._identifier, event)
+
+    thread = threading.Thread(target=slice_plate)
+    thread.daemon = True
+    thread.start()
+
+    return flask.make_response(flask.jsonify(dict(gcode=gcode, objects=plate.get_objects())), 202)
+
+  def _check_permissions(self, *names):
+    """Returns a 403 response unless the current user has all of the named
+    permissions, None otherwise. OctoPrint before 1.4 has no permissions, a
+    login is all it takes there."""
+    try:
+      from octoprint.access.permissions import Permissions
+    except ImportError:
+      return None
+    for name in names:
+      if not getattr(Permissions, name).can():
+        return flask.make_response("Insufficient rights", 403)
+    return None
+
   ##~~ AssetPlugin mixin
 
   def get_assets(self):
@@ -197,9 +677,25 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
 
   def on_settings_save(self, data):
     old_debug_logging = self._settings.get_boolean(["debug_logging"])
+    old_slic3r_engine = self._settings.get(["slic3r_engine"])
+    old_remote = (self._settings.get(["remote_workers"]), self._settings.get(["remote_token"]))
 
     octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
 
+    if old_remote != (self._settings.get(["remote_workers"]), self._settings.get(["remote_token"])):
+      with self._remote_mutex:
+        backend, self._remote_backend = self._remote_backend, None
+      if backend is not None:
+        backend.close()
+
+    if old_slic3r_engine != self._settings.get(["slic3r_engine"]):
+      self._probe_engine_async()
+
+    if self._result_cache is not None:
+      self._result_cache.max_size = self._get_cache_size()
+    self._scheduler.max_jobs = self._settings.get_int(["max_concurrent_jobs"])
+    self._configure_job_logs()
+
     new_debug_logging = self._settings.get_boolean(["debug_logging"])
     if old_debug_logging != new_debug_logging:
       if new_debug_logging:
@@ -211,7 +707,28 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
     return dict(
       slic3r_engine=None,
       default_profile=None,
-      debug_logging=False
+      debug_logging=False,
+      stream_output=False,
+      cache_enabled=False,
+      cache_size=500,
+      cache_translate=True,
+      preslice_enabled=False,
+      max_concurrent_jobs=None,
+      progress_interval=0.5,
+      batch_slicing=False,
+      batch_size=8,
+      check_model_fit=False,
+      limit_memory=None,
+      limit_reserve_cpu=False,
+      limit_nice=None,
+      limit_io_idle=False,
+      limit_timeout=None,
+      remote_workers=None,
+      remote_token=None,
+      job_logs=False,
+      job_log_size=10,
+      log_trace_rate=200,
+      plate_spacing=5.0
     )
 
   ##~~ SlicerPlugin API
@@ -225,7 +742,7 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
       type="slic3r",
       name="Slic3r",
       same_device=True,
-      progress_report=False
+      progress_report=True
     )
 
   def get_slicer_default_profile(self):
@@ -234,12 +751,64 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
       path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "profiles", "default.profile.ini")
     return self.get_slicer_profile(path)
 
+  def get_default_profile_path(self):
+    """Path of the profile OctoPrint slices with when none is given.
+
+    That's the default slicing profile selected in OctoPrint's settings, or
+    if there is none (or it's gone) the plugin's own default profile, just
+    like OctoPrint's slicing manager picks it.
+    """
+    name = (self._settings.global_get(["slicing", "defaultProfiles"]) or dict()).get("slic3r")
+    if name:
+      try:
+        return self._slicing_manager.get_profile_path("slic3r", name, must_exist=True)
+      except Exception:
+        self._logger.warn("The default profile %s doesn't exist, using the built-in one" % name)
+    path = self._settings.get(["default_profile"])
+    if path and os.path.isfile(path):
+      return path
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), "profiles", "default.profile.ini")
+
   def get_slicer_profile(self, path):
     profile_dict, display_name, description = self._load_profile(path)
 
     properties = self.get_slicer_properties()
     return octoprint.slicing.SlicingProfile(properties["type"], "unknown", profile_dict, display_name=display_name, description=description)
 
+  def get_slicer_profiles(self, profile_path):
+    """Lists the profiles stored in ``profile_path`` without parsing them.
+
+    Only the display name and description are needed for the list. Those are
+    taken from the profile index, or read from the header of profiles that
+    changed since they were last listed. The settings are only parsed once
+    ``data`` of a returned profile is accessed.
+    """
+    properties = self.get_slicer_properties()
+    profiles = dict()
+    paths = []
+    for filename in os.listdir(profile_path):
+      if not filename.endswith(".profile") or octoprint.util.is_hidden_path(filename):
+        continue
+      path = os.path.join(profile_path, filename)
+      try:
+        if self._profile_index is not None:
+          display_name, description = self._profile_index.get(path)
+        else:
+          display_name, description = read_profile_metadata(path)
+      except (IOError, OSError):
+        # removed in the meantime
+        continue
+
+      name = filename[:-len(".profile")]
+      paths.append(path)
+      profiles[name] = LazySlicingProfile(properties["type"], name, self._get_profile_loader(path),
+                                          display_name=display_name, description=description)
+
+    if self._profile_index is not None:
+      self._profile_index.prune(profile_path, paths)
+      self._profile_index.save()
+    return profiles
+
   def save_slicer_profile(self, path, profile, allow_overwrite=True, overrides=None):
     from octoprint.util import dict_merge
     if overrides is not None:
@@ -249,17 +818,16 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
 
     self._save_profile(path, new_profile, allow_overwrite=allow_overwrite, display_name=profile.display_name, description=profile.description)
 
-  def do_slice(self, model_path, printer_profile, machinecode_path=None, profile_path=None, position=None, on_progress=None, on_progress_args=None, on_progress_kwargs=None):
-    if on_progress is not None:
-      if on_progress_args is None:
-        on_progress_args = ()
-      if on_progress_kwargs is None:
-        on_progress_kwargs = dict()
-      on_progress_kwargs["_progress"] = 0
-      on_progress(*on_progress_args, **on_progress_kwargs)
+  def do_slice(self, model_path, printer_profile, machinecode_path=None, profile_path=None, position=None, on_progress=None, on_progress_args=None, on_progress_kwargs=None, priority=SlicingPriorities.INTERACTIVE, overrides=None):
+    """Slices ``model_path``, see :class:`octoprint.plugin.SlicerPlugin`.
 
+    ``overrides`` is an optional dict of settings that take precedence over
+    the profile's for this job only. They are passed to the engine on the
+    command line if possible, otherwise the effective config is written to
+    a scratch folder in memory. The profile itself is never touched.
+    """
     if not profile_path:
-      profile_path = self._settings.get(["default_profile"])
+      profile_path = self.get_default_profile_path()
     if not machinecode_path:
       path, _ = os.path.splitext(model_path)
       machinecode_path = path + ".gco"
@@ -273,124 +841,426 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
     else:
       posX = printer_profile["volume"]["width"] / 2.0
       posY = printer_profile["volume"]["depth"] / 2.0
-    
+
+    job = SlicingJob(model_path, machinecode_path, profile_path, (posX, posY), priority=priority,
+                     volume=printer_profile.get("volume"), overrides=overrides, on_progress=on_progress, on_progress_args=on_progress_args, on_progress_kwargs=on_progress_kwargs)
+    job.report_progress(0)
+
+    result = JobResults.FAILED
+    try:
+      success, data = self._slice(job)
+      if success:
+        if job.metrics.get("cached"):
+          result = JobResults.CACHED
+        elif job.metrics.get("translated"):
+          result = JobResults.TRANSLATED
+        else:
+          result = JobResults.SUCCESS
+      return success, data
+    except octoprint.slicing.SlicingCancelled:
+      result = JobResults.CANCELLED
+      raise
+    finally:
+      job.metrics["total"] = time.time() - job.created
+      record = self._metrics.record(job.metrics, result)
+      self._slic3r_logger.info("Metrics: %r" % record)
+
+  def _slice(self, job):
+    model_path = job.model_path
+    machinecode_path = job.machinecode_path
+    profile_path = job.profile_path
+    posX, posY = job.center
+    job.metrics.update(model=os.path.basename(model_path), started=job.created)
+
     self._slic3r_logger.info("### Slicing %s to %s using profile stored at %s" % (model_path, machinecode_path, profile_path))
 
     executable = normalize_path(self._settings.get(["slic3r_engine"]))
     if not executable:
       return False, "Path to Slic3r is not configured "
 
-    args = ['"%s"' % executable, '--load', '"%s"' % profile_path, '--print-center', '"%f,%f"' % (posX, posY), '-o', '"%s"' % machinecode_path, '"%s"' % model_path]
-    env = {}
-    
+    probe_start = time.time()
+    capabilities = self._get_engine_capabilities(executable)
+    job.metrics.update(probe=time.time() - probe_start, engine="%s %s" % (capabilities.flavor, capabilities.version))
+    self._logger.info("Running %r" % capabilities)
+
+    if job.overrides:
+      try:
+        self._apply_overrides(job, capabilities)
+      except Exception:
+        self._logger.exception("Could not apply the overrides %r to %s" % (job.overrides, profile_path))
+        return False, "Could not apply the overrides to the profile"
+      profile_path = job.profile_path
+
+    error = self._check_output_format(job, capabilities)
+    if error is not None:
+      self._slic3r_logger.info("### " + error)
+      return False, error
+
+    inspect_start = time.time()
+    job.mesh = self._inspect_model(model_path)
+    job.metrics["inspect"] = time.time() - inspect_start
+    if job.mesh is not None:
+      self._slic3r_logger.info("### Model: %r" % job.mesh)
+      job.metrics["triangles"] = job.mesh.triangles
+      error = get_fit_error(job.mesh, job.volume, job.center) if job.volume else None
+      if error is not None:
+        self._slic3r_logger.info("### " + error)
+        if self._settings.get_boolean(["check_model_fit"]):
+          # no need to have the engine find that out
+          self._logger.warn("Not slicing %s: %s" % (model_path, error))
+          return False, error
+        # printer profiles often understate the print volume, let the engine decide
+        self._logger.warn("Slicing %s anyway: %s" % (model_path, error))
+
+    cache_key = None
+    if self._result_cache is not None and self._settings.get_boolean(["cache_enabled"]):
+      cache_key = self._get_cache_key(job, capabilities)
+      if cache_key is not None:
+        hit, analysis, method = self._result_cache.deliver(cache_key, machinecode_path)
+        if hit:
+          self._slic3r_logger.info("### Delivered from the result cache")
+          job.metrics.update(cached=True, delivery=method,
+                             copied=os.path.getsize(machinecode_path) if method == "copy" else 0)
+          job.report_progress(1.0)
+          if analysis:
+            analysis = {'analysis': analysis}
+          return True, analysis
+        if not job.binary and self._settings.get_boolean(["cache_translate"]):
+          job.placement_key = self._get_placement_key(job, capabilities)
+    job.cache_key = cache_key
+
+    if job.placement_key is not None:
+      result = self._translate_cached(job)
+      if result is not None:
+        return result
+
+    result = self._slice_remote(job)
+    if result is not None:
+      return result
+
+    if self._settings.get_boolean(["batch_slicing"]) and capabilities.supports_batches and job.priority < SlicingPriorities.BACKGROUND:
+      job.batch_key = self._get_batch_key(executable, job)
+
+    queue_start = time.time()
+    acquired = self._scheduler.acquire(job, on_position=self._on_queue_position)
+    job.metrics["queue_wait"] = time.time() - queue_start
+    if not acquired:
+      self._slic3r_logger.info("### Cancelled while queued")
+      raise octoprint.slicing.SlicingCancelled()
+
+    if job.batch is not None:
+      return self._wait_for_batch(job)
+
     try:
-      import subprocess
-
-      help_process = subprocess.Popen((executable, '--help'), stdout=subprocess.PIPE)
-      help_text_all = help_process.communicate()
-      
-      # help output includes a trace statement now on the first line. If we find it, use the second
-      # line instead
-      # [2022-04-22 21:44:51.396082] [0x75527010] [trace]   Initializing StaticPrintConfigs
-      if help_text_all[0].find(b'trace') >= 0:
-        help_text = help_text_all[1]
+      companions = []
+      if job.batch_key is not None:
+        companions = self._take_batch(job)
+      if companions:
+        return self._run_batch(job, companions, executable, capabilities)
+      return self._run_slicer(job, executable, capabilities, cache_key)
+    finally:
+      self._scheduler.release(job)
+
+  def slice_batch(self, models, profile_path=None, printer_profile=None, on_event=None, max_workers=None, wait=True):
+    """Slices several models with the same profile.
+
+    ``models`` is a list of model paths or of dicts with ``model_path`` and
+    optionally ``machinecode_path`` and ``position`` (as for ``do_slice``).
+    The profile is resolved once, the jobs are run at batch priority by a
+    bounded number of worker threads, so interactive slicing jobs still go
+    first. ``on_event`` is called with the batch and a dict for every job
+    that starts, progresses or finishes.
+
+    Returns the :class:`SlicingBatch`, once all jobs are done if ``wait`` is
+    True, right away otherwise.
+    """
+    import threading
+
+    if not profile_path:
+      profile_path = self.get_default_profile_path()
+    if not os.path.isfile(profile_path):
+      raise ValueError("No such profile: {path}".format(path=profile_path))
+    # parse it once up front, the jobs then find it in the profile cache
+    self._load_profile(profile_path)
+
+    if printer_profile is None:
+      printer_profile = self._printer_profile_manager.get_current_or_default()
+
+    batch = SlicingBatch(models, profile_path)
+    with self._batches_mutex:
+      self._batches[batch.id] = batch
+      finished = sorted((b for b in self._batches.values() if b.done), key=lambda b: b.finished)
+      for old in finished[:-20]:
+        del self._batches[old.id]
+
+    def notify(index, event_type, **kwargs):
+      job = batch.update(index, **kwargs)
+      if on_event is None:
+        return
+      event = dict(type=event_type, index=index, model=os.path.basename(job["model_path"]), state=job["state"], progress=job["progress"])
+      if event_type == "done":
+        event.update(machinecode_path=job["machinecode_path"], analysis=job["analysis"], error=job["error"])
+      try:
+        on_event(batch, event)
+      except Exception:
+        self._logger.exception("Error in batch event handler")
+
+    def slice_job(job):
+      index = job["index"]
+      if batch.cancelled:
+        notify(index, "done", state=BatchJobStates.CANCELLED)
+        return
+
+      notify(index, "started", state=BatchJobStates.SLICING)
+      def on_progress(_progress=0.0):
+        if _progress > batch.jobs[index]["progress"]:
+          notify(index, "progress", progress=_progress)
+
+      try:
+        ok, result = self.do_slice(job["model_path"], printer_profile,
+                                   machinecode_path=job["machinecode_path"],
+                                   profile_path=profile_path,
+                                   position=job["position"],
+                                   on_progress=on_progress,
+                                   priority=SlicingPriorities.BATCH)
+      except octoprint.slicing.SlicingCancelled:
+        notify(index, "done", state=BatchJobStates.CANCELLED)
+      except Exception as e:
+        self._logger.exception("Error while slicing %s as part of batch %s" % (job["model_path"], batch.id))
+        notify(index, "done", state=BatchJobStates.FAILED, error=str(e))
       else:
-        help_text = help_text_all[0]
+        if ok:
+          notify(index, "done", state=BatchJobStates.DONE, progress=1.0, analysis=(result or dict()).get("analysis"))
+        else:
+          notify(index, "done", state=BatchJobStates.FAILED, error=result)
+
+    for job in batch.jobs:
+      if not job["machinecode_path"]:
+        path, _ = os.path.splitext(job["model_path"])
+        job["machinecode_path"] = path + ".gco"
+
+    # enough workers to keep every slot busy and, if enabled, to let jobs queue
+    # up for batched engine runs
+    if max_workers is None:
+      max_workers = self._scheduler.max_jobs
+      if self._settings.get_boolean(["batch_slicing"]):
+        max_workers *= self._settings.get_int(["batch_size"]) or 1
+    pending = list(batch.jobs)
+    pending_mutex = threading.Lock()
+
+    def worker():
+      while True:
+        with pending_mutex:
+          if not pending:
+            return
+          job = pending.pop(0)
+        slice_job(job)
+
+    threads = []
+    for _ in range(max(1, min(max_workers, len(pending)))):
+      thread = threading.Thread(target=worker)
+      thread.daemon = True
+      thread.start()
+      threads.append(thread)
+
+    def finish():
+      for thread in threads:
+        thread.join()
+      batch.finish()
+      self._slic3r_logger.info("### Batch %s done: %r" % (batch.id, batch.to_dict()["counts"]))
+
+    if wait:
+      finish()
+    else:
+      thread = threading.Thread(target=finish)
+      thread.daemon = True
+      thread.start()
+    return batch
+
+  def plan_plate(self, model_paths, printer_profile, spacing=None):
+    """Packs the models at ``model_paths`` onto the bed of ``printer_profile``.
+
+    Returns the :class:`Plate`, raises :class:`PlateError` if a model can't
+    be read or they don't all fit.
+    """
+    meshes = []
+    for model_path in model_paths:
+      mesh = self._inspect_model(model_path)
+      if mesh is None:
+        raise PlateError("Can't place {name}, only STL models can be put on a plate".format(name=os.path.basename(model_path)))
+      meshes.append(mesh)
+    if spacing is None:
+      spacing = self._settings.get_float(["plate_spacing"])
+    return pack_plate(meshes, printer_profile["volume"], spacing=spacing or 0.0)
+
+  def slice_plate(self, model_paths, printer_profile, machinecode_path, profile_path=None, plate=None, on_progress=None, on_progress_args=None, on_progress_kwargs=None, priority=SlicingPriorities.INTERACTIVE, overrides=None):
+    """Slices several models as one print, see :func:`pack_plate`.
+
+    The models are packed onto the bed (unless ``plate`` from
+    :meth:`plan_plate` is given), written into one STL and sliced with a
+    single ``do_slice``. Returns ``(True, dict(analysis=..., objects=[...]))``
+    with the analysis of the whole plate and every model's position and
+    ``estimated_analysis``, its share of the plate's analysis by volume (the
+    engine only sees one object). ``(False, reason)`` otherwise.
+    """
+    import tempfile
+
+    if not profile_path:
+      profile_path = self.get_default_profile_path()
+    if plate is None:
+      try:
+        plate = self.plan_plate(model_paths, printer_profile)
+      except PlateError as e:
+        return False, str(e)
+
+    handle, plate_path = tempfile.mkstemp(prefix="slic3r-plate-", suffix=".stl")
+    os.close(handle)
+    try:
+      write_start = time.time()
+      write_plate_stl(model_paths, plate, plate_path)
+      self._slic3r_logger.info("### Packed %d models onto a plate of %.1f x %.1f mm in %.2fs: %s"
+                               % (len(model_paths), plate.size[0], plate.size[1], time.time() - write_start, ", ".join(model_paths)))
+
+      ok, result = self.do_slice(plate_path, printer_profile,
+                                 machinecode_path=machinecode_path,
+                                 profile_path=profile_path,
+                                 position=dict(x=plate.center[0], y=plate.center[1]),
+                                 on_progress=on_progress,
+                                 on_progress_args=on_progress_args,
+                                 on_progress_kwargs=on_progress_kwargs,
+                                 priority=priority,
+                                 overrides=overrides)
+    finally:
+      os.remove(plate_path)
+
+    if not ok:
+      return ok, result
+    analysis = (result or dict()).get("analysis")
+    return True, dict(analysis=analysis, objects=plate.get_objects(analysis))
+
+  def cancel_batch(self, batch):
+    batch.cancelled = True
+    for job in batch.jobs:
+      if job["state"] in (BatchJobStates.QUEUED, BatchJobStates.SLICING):
+        self.cancel_slicing(job["machinecode_path"])
 
-      self._logger.debug(help_text)
+  def cancel_slicing(self, machinecode_path):
+    if self._scheduler.cancel(machinecode_path):
+      self._logger.info("Cancelled queued slicing of %s" % machinecode_path)
+      return
+
+    with self._remote_mutex:
+      remote = self._remote_jobs.get(machinecode_path)
+    if remote is not None:
+      remote["job"].cancelled = True
+      if remote["id"] is not None:
+        remote["backend"].cancel(remote["worker"], remote["id"])
+      self._logger.info("Cancelled slicing of %s on %s" % (machinecode_path, remote["worker"].url))
+      return
 
-      if help_text.startswith(b'PrusaSlicer-2.3') or help_text.startswith(b'PrusaSlicer-2.4'):
-        args = ['"%s"' % executable, '-g --load', '"%s"' % profile_path, '--center', '"%f,%f"' % (posX, posY), '-o', '"%s"' % machinecode_path, '"%s"' % model_path]
-        env['SLIC3R_LOGLEVEL'] = "9"
-        self._logger.info("Running Prusa Slic3r >= 2.3")
-      elif help_text.startswith(b'PrusaSlicer-2'):
-        args = ['"%s"' % executable, '--slice --load', '"%s"' % profile_path, '--center', '"%f,%f"' % (posX, posY), '-o', '"%s"' % machinecode_path, '"%s"' % model_path]
-        self._logger.info("Running Prusa Slic3r >= 2")
-    except e:
-      self._logger.info("Error during Prusa Slic3r detection:" + str(e))
+    with self._slicing_commands_mutex:
+      if machinecode_path in self._slicing_commands:
+        with self._cancelled_jobs_mutex:
+          self._cancelled_jobs.append(machinecode_path)
+        self._slicing_commands[machinecode_path].terminate()
+        self._logger.info("Cancelled slicing of %s" % machinecode_path)
 
-    import sarge
+  def _run_slicer(self, job, executable, capabilities, cache_key):
+    model_path = job.model_path
+    machinecode_path = job.machinecode_path
+    profile_path = job.profile_path
+    posX, posY = job.center
+
+    tee = None
+    tee_finished = False
+    # the engine (or the tee) writes next to the destination, so the result
+    # can be renamed into place once it's complete
+    staged_path = output_path = staging_path(machinecode_path, suffix=".bgcode" if job.binary else ".gcode")
+    if self._settings.get_boolean(["stream_output"]) and capabilities.streamable_output and FifoTee.is_supported():
+      tee = FifoTee(staged_path).start()
+      output_path = tee.path
+
+    args = [executable] + capabilities.get_args(profile_path, posX, posY, output_path, model_path, binary=job.binary,
+                                                config_args=job.config_args)
+    env = dict(os.environ)
+    env.update(capabilities.env)
+
+    import subprocess
 
     working_dir, _ = os.path.split(executable)
 
-    command = " ".join(args)
-    self._logger.info("Running %r in %s" % (command, working_dir))
+    limits = self._get_resource_limits(background=job.priority >= SlicingPriorities.BACKGROUND)
+    args = limits.wrap_args(args)
+
+    self._logger.info("Running %r in %s" % (" ".join(args), working_dir))
     try:
-      if parse_version(sarge.__version__) >= parse_version('0.1.5'): # Because in version 0.1.5 the name was changed in sarge.
-        async_kwarg = 'async_'
-      else:
-        async_kwarg = 'async'
-      p = sarge.run(command, cwd=working_dir, stdout=sarge.Capture(buffer_size=1), stderr=sarge.Capture(buffer_size=1), env=env, **{async_kwarg: True})
-      p.wait_events()
-      last_error=""
+      spawn_start = time.time()
+      p = subprocess.Popen(args, cwd=working_dir or None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+      limits.apply(p.pid)
+      job.metrics["spawn"] = time.time() - spawn_start
+      timeout = ProcessTimeout(p, limits.timeout)
+      state = dict(last_error="")
+      progress = None
+      output_log = self._create_output_log(job)
       try:
+        # reads the model while the engine is starting up
+        progress = self._create_progress(job)
+
         with self._slicing_commands_mutex:
-          self._slicing_commands[machinecode_path] = p.commands[0]
-
-        stdout_buffer = b""
-        stderr_buffer = b""
-        total_layers = 1
-
-        matched_lines = 0
-        while p.returncode is None:
-          p.commands[0].poll()
-
-          # Can't use readline because it removes newlines and we can't tell if we have gotten a full line.
-          stdout_buffer += p.stdout.read(block=False)
-          stderr_buffer += p.stderr.read(block=False)
-
-          stdout_lines = stdout_buffer.split(b'\n')
-          stdout_buffer = stdout_lines[-1]
-          stdout_lines = stdout_lines[0:-1]
-          for stdout_line in stdout_lines:
-            self._slic3r_logger.debug("stdout: " + str(stdout_line))
-            print(stdout_line.decode('utf-8'))
-            m = re.search(r"\[trace\].*layer ([0-9]+)", stdout_line.decode('utf-8'))
-            if m:
-              matched_lines += 1
-              current_layer = int(m.group(1))
-              total_layers = max(total_layers, current_layer)
-              if on_progress is not None:
-                print("sending progress" + str(matched_lines / total_layers / 4))
-                on_progress_kwargs["_progress"] = matched_lines / total_layers / 4
-                on_progress(*on_progress_args, **on_progress_kwargs)
-
-          stderr_lines = stderr_buffer.split(b'\n')
-          stderr_buffer = stderr_lines[-1]
-          stderr_lines = stderr_lines[0:-1]
-          for stderr_line in stderr_lines:
-            self._slic3r_logger.debug("stderr: " + str(stderr_line))
-            if len(stderr_line.strip()) > 0:
-              last_error = stderr_line.strip()
+          self._slicing_commands[machinecode_path] = p
+        if job.cancelled:
+          self.cancel_slicing(machinecode_path)
+
+        def on_stdout_line(stdout_line):
+          output_log.stdout(stdout_line)
+          if progress is not None:
+            progress.feed_line(stdout_line.decode("utf-8", "replace"))
+
+        def on_stderr_line(stderr_line):
+          output_log.stderr(stderr_line)
+          if len(stderr_line.strip()) > 0:
+            state["last_error"] = stderr_line.strip().decode("utf-8", "replace")
+
+        pump_output(p, on_stdout_line, on_stderr_line)
+        self._record_process_metrics(job, wait_process(p), spawn_start)
       finally:
-        if stdout_buffer:
-          stdout_lines = stdout_buffer.split(b'\n')
-          for stdout_line in stdout_lines:
-            self._slic3r_logger.debug("stdout: " + str(stdout_line))
-
-        if stderr_buffer:
-          stderr_lines = stderr_buffer.split(b'\n')
-          for stderr_line in stderr_lines:
-            self._slic3r_logger.debug("stderr: " + str(stderr_line))
-            if len(stderr_line.strip()) > 0:
-              last_error = stderr_line.strip()
-        p.close()
+        timeout.cancel()
+        output_log.close()
+        for stream in (p.stdout, p.stderr):
+          stream.close()
+        if p.returncode is None:
+          p.kill()
+          p.wait()
+
+        if tee is not None:
+          tee.finish()
+          tee_finished = True
+      last_error = state["last_error"]
 
       with self._cancelled_jobs_mutex:
         if machinecode_path in self._cancelled_jobs:
           self._slic3r_logger.info("### Cancelled")
           raise octoprint.slicing.SlicingCancelled()
 
+      if timeout.expired:
+        message = "Slicing took longer than %d seconds and was aborted" % limits.timeout
+        self._slic3r_logger.info("### " + message)
+        self._logger.warn("Could not slice %s: %s" % (model_path, message))
+        return False, message
+
       self._slic3r_logger.info("### Finished, returncode %d" % p.returncode)
       if p.returncode == 0:
-        analysis = get_analysis_from_gcode(machinecode_path)
-        self._slic3r_logger.info("Analysis found in gcode: %s" % str(analysis))
-        if analysis:
-          analysis = {'analysis': analysis}
-        return True, analysis
+        self._deliver_output(job, staged_path, machinecode_path)
+        if progress is not None:
+          progress.finish()
+        return self._collect_result(job, cache_key, analysis=tee.analysis if tee is not None else None)
       else:
         self._logger.warn("Could not slice via Slic3r, got return code %r" % p.returncode)
         self._logger.warn("Error was: %s" % last_error)
+        message = limits.describe_failure(p.returncode, last_error)
+        if message is not None:
+          self._slic3r_logger.info("### " + message)
+          return False, "%s (returncode %r: %s)" % (message, p.returncode, last_error)
         return False, "Got returncode %r: %s" % (p.returncode, last_error)
 
     except octoprint.slicing.SlicingCancelled as e:
@@ -400,6 +1270,10 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
       return False, "Unknown error, please consult the log file"
 
     finally:
+      if tee is not None and not tee_finished:
+        tee.abort()
+      if os.path.exists(staged_path):
+        os.remove(staged_path)
       with self._cancelled_jobs_mutex:
         if machinecode_path in self._cancelled_jobs:
           self._cancelled_jobs.remove(machinecode_path)
@@ -409,22 +1283,578 @@ class Slic3rPlugin(octoprint.plugin.SlicerPlugin,
 
       self._slic3r_logger.info("-" * 40)
 
-  def cancel_slicing(self, machinecode_path):
-    with self._slicing_commands_mutex:
-      if machinecode_path in self._slicing_commands:
+  def _slice_remote(self, job):
+    """Slices the job on the least busy of the configured slicing workers.
+
+    Returns the ``do_slice`` result, None if no worker could take the job
+    and it has to be sliced locally.
+    """
+    backend = self._get_remote_backend()
+    if backend is None:
+      return None
+    worker = backend.choose()
+    if worker is None:
+      self._slic3r_logger.info("### No slicing worker reachable, slicing locally")
+      return None
+    try:
+      return self._slice_on_worker(job, backend, worker)
+    finally:
+      backend.release(worker)
+
+  def _slice_on_worker(self, job, backend, worker):
+    machinecode_path = job.machinecode_path
+    remote = dict(job=job, backend=backend, worker=worker, id=None)
+    with self._remote_mutex:
+      self._remote_jobs[machinecode_path] = remote
+
+    def on_job(remote_id):
+      remote["id"] = remote_id
+
+    progress = self._create_progress(job)
+    output_log = self._create_output_log(job)
+    def on_line(line):
+      output_log.stdout(line)
+      if progress is not None:
+        progress.feed_line(line)
+
+    self._slic3r_logger.info("### Slicing on %s (%s)" % (worker.url, worker.engine))
+    staged_path = staging_path(machinecode_path, suffix=".bgcode" if job.binary else ".gcode")
+    stats = dict()
+    try:
+      returncode, error = backend.slice(worker, job.model_path, job.profile_path, job.center, staged_path,
+                                        binary=job.binary, overrides=job.overrides if job.config_args else None,
+                                        on_line=on_line, on_job=on_job, is_cancelled=lambda: job.cancelled, stats=stats)
+      job.metrics.update(remote=worker.url, **dict((key, stats[key]) for key in ("upload", "download", "uploaded", "wall") if key in stats))
+      if "cpu_user" in stats:
+        job.metrics.update(cpu=stats["cpu_user"] + stats["cpu_system"], peak_rss=stats["peak_rss"])
+
+      self._slic3r_logger.info("### Finished on %s, returncode %r" % (worker.url, returncode))
+      if returncode != 0:
+        self._logger.warn("Could not slice via Slic3r on %s, got return code %r" % (worker.url, returncode))
+        self._logger.warn("Error was: %s" % error)
+        return False, "Got returncode %r: %s (on %s)" % (returncode, error, worker.url)
+
+      self._deliver_output(job, staged_path, machinecode_path)
+      if progress is not None:
+        progress.finish()
+      return self._collect_result(job, job.cache_key)
+
+    except RemoteCancelled:
+      self._slic3r_logger.info("### Cancelled")
+      raise octoprint.slicing.SlicingCancelled()
+    except RemoteUnavailable as e:
+      if job.cancelled:
+        self._slic3r_logger.info("### Cancelled")
+        raise octoprint.slicing.SlicingCancelled()
+      self._slic3r_logger.info("### %s, slicing locally" % e)
+      self._logger.warn("%s, slicing %s locally" % (e, job.model_path))
+      return None
+    except Exception:
+      self._logger.exception("Could not slice %s on %s, slicing locally" % (job.model_path, worker.url))
+      return None
+
+    finally:
+      output_log.close()
+      if os.path.exists(staged_path):
+        os.remove(staged_path)
+      with self._remote_mutex:
+        self._remote_jobs.pop(machinecode_path, None)
+
+  def _get_remote_backend(self):
+    urls = parse_worker_urls(self._settings.get(["remote_workers"]))
+    if not urls:
+      return None
+    with self._remote_mutex:
+      if self._remote_backend is None:
+        self._remote_backend = RemoteBackend(urls, token=self._settings.get(["remote_token"]) or None)
+      return self._remote_backend
+
+  def _check_output_format(self, job, capabilities):
+    """Returns why the job's output format can't be produced, None if it can."""
+    if job.binary:
+      if not capabilities.supports_binary_gcode:
+        return "Binary G-code needs PrusaSlicer 2.7 or later"
+      return None
+
+    if capabilities.supports_binary_gcode:
+      try:
+        profile = self._get_job_profile(job)
+      except Exception:
+        # the engine will complain about the profile soon enough
+        return None
+      if profile.get("binary_gcode", "0").strip().lower() in ("1", "true"):
+        return "The profile enables binary G-code (binary_gcode = 1), which can't be streamed to the printer. " \
+               "Disable it in the profile or slice to a .bgcode file."
+    return None
+
+  def _deliver_output(self, job, source, destination):
+    method, copied = move_file(source, destination)
+    job.metrics.update(delivery=method, copied=copied)
+    self._slic3r_logger.info("### Delivered to %s via %s, %d bytes copied" % (destination, method, copied))
+
+  def _translate_cached(self, job):
+    """Produces the job's G-code by moving a cached result of the same model
+    and profile sliced at a different position, if there is one.
+
+    Returns the ``do_slice`` result, None if the model has to be sliced.
+    """
+    if job.placement_key in self._unmovable_placements:
+      return None
+    found = self._result_cache.find_placement(job.placement_key)
+    if found is None:
+      return None
+    key, entry = found
+    dx = job.center[0] - entry["center"][0]
+    dy = job.center[1] - entry["center"][1]
+
+    translate_start = time.time()
+    source = self._result_cache.open(key)
+    if source is None:
+      return None
+    staged_path = staging_path(job.machinecode_path)
+    try:
+      with source:
+        with open(staged_path, "wb") as destination:
+          stats = translate_gcode(source, destination, dx, dy)
+      self._deliver_output(job, staged_path, job.machinecode_path)
+    except TranslationUnsafe as e:
+      self._slic3r_logger.info("### Cached result can't be moved: %s" % e)
+      self._unmovable_placements.add(job.placement_key)
+      return None
+    except Exception:
+      self._logger.exception("Could not move cached result %s to %s" % (key, job.machinecode_path))
+      return None
+    finally:
+      if os.path.exists(staged_path):
+        os.remove(staged_path)
+
+    job.metrics.update(translated=True, translate=time.time() - translate_start)
+    self._slic3r_logger.info("### Moved cached result %s by %.3f, %.3f, shifted %d moves in %d lines in %.3fs"
+                             % (key, dx, dy, stats["moves"], stats["lines"], job.metrics["translate"]))
+    job.report_progress(1.0)
+    return self._collect_result(job, job.cache_key, analysis=entry.get("analysis"))
+
+  def _collect_result(self, job, cache_key, analysis=None):
+    machinecode_path = job.machinecode_path
+    analysis_start = time.time()
+    analysis_stats = dict(bytes_read=0)
+    if analysis is None:
+      try:
+        analysis = get_analysis_from_gcode(machinecode_path, stats=analysis_stats)
+      except BgcodeError as e:
+        # the slice itself worked, OctoPrint can still analyse the file later on
+        self._logger.warn("Could not analyse %s: %s" % (machinecode_path, e))
+        self._slic3r_logger.info("Could not read the analysis: %s" % e)
+        cache_key = None
+    job.metrics.update(analysis=time.time() - analysis_start, output_size=os.path.getsize(machinecode_path))
+    self._slic3r_logger.info("Analysis found in gcode: %s" % str(analysis))
+    self._slic3r_logger.info("Analysis took %.3fs and read %d of %d bytes from disk" % (time.time() - analysis_start, analysis_stats["bytes_read"], os.path.getsize(machinecode_path)))
+    if cache_key is not None:
+      try:
+        self._result_cache.put(cache_key, machinecode_path, analysis, placement=job.placement_key, center=job.center)
+      except Exception:
+        self._logger.exception("Could not add %s to the result cache" % machinecode_path)
+    if analysis:
+      analysis = {'analysis': analysis}
+    return True, analysis
+
+  def _remove_staged(self, models):
+    for model in models:
+      if os.path.exists(model["machinecode_path"]):
+        os.remove(model["machinecode_path"])
+
+  def _store_batch_result(self, batch, event, model, printer_profile, allow_overwrite=False):
+    """Moves a batch job's G-code into the local storage, just like OctoPrint
+    does for slicing jobs started through its API. Existing files are only
+    replaced with ``allow_overwrite``."""
+    from octoprint.filemanager.destinations import FileDestinations
+    from octoprint.filemanager.util import DiskFileWrapper
+
+    temp_path = model["machinecode_path"]
+    try:
+      if event["state"] != BatchJobStates.DONE:
+        return
+      self._file_manager.add_file(FileDestinations.LOCAL,
+                                  model["gcode"],
+                                  DiskFileWrapper(os.path.basename(model["gcode"]), temp_path, move=True),
+                                  links=[("model", dict(name=model["path"]))],
+                                  allow_overwrite=allow_overwrite,
+                                  printer_profile=printer_profile,
+                                  analysis=event["analysis"])
+      event["machinecode_path"] = model["gcode"]
+      batch.update(event["index"], machinecode_path=model["gcode"])
+    except Exception as e:
+      self._logger.exception("Could not store %s" % model["gcode"])
+      event.update(state=BatchJobStates.FAILED, error=str(e))
+      batch.update(event["index"], state=BatchJobStates.FAILED, error=str(e))
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+  def _record_process_metrics(self, job, usage, spawn_start):
+    job.metrics["wall"] = time.time() - spawn_start
+    if usage is not None:
+      job.metrics.update(cpu=usage["cpu_user"] + usage["cpu_system"], peak_rss=usage["peak_rss"])
+
+  def _get_batch_key(self, executable, job):
+    try:
+      # OctoPrint hands every job its own copy of the profile
+      return "%s|%s|%.3f,%.3f|%s|%s" % (executable, hash_file(job.profile_path), job.center[0], job.center[1],
+                                        "bgcode" if job.binary else "gcode", " ".join(job.config_args or []))
+    except Exception:
+      self._logger.exception("Could not compute the batch key for %s" % job.profile_path)
+      return None
+
+  def _take_batch(self, job):
+    limit = (self._settings.get_int(["batch_size"]) or 1) - 1
+    state = dict(size=os.path.getsize(job.model_path))
+
+    def accept(other):
+      try:
+        size = os.path.getsize(other.model_path)
+      except OSError:
+        return False
+      if state["size"] + size > BATCH_MAX_MODEL_SIZE:
+        return False
+      state["size"] += size
+      return True
+
+    return self._scheduler.take_batch(job, limit, accept=accept)
+
+  def _wait_for_batch(self, job):
+    self._slic3r_logger.info("### Sliced as part of the batch of %s" % job.batch.model_path)
+    try:
+      while not job.wait(timeout=0.5):
+        if job.cancelled:
+          break
+    finally:
+      self._scheduler.release(job)
+
+    if job.cancelled:
+      self._slic3r_logger.info("### Cancelled")
+      raise octoprint.slicing.SlicingCancelled()
+    if isinstance(job.result, Exception):
+      raise job.result
+    return job.result
+
+  def _run_batch(self, leader, companions, executable, capabilities):
+    """Slices ``leader`` and ``companions`` in one engine invocation.
+
+    Results are handed to the companions' threads via ``SlicingJob.finish``,
+    the leader's result is returned. Any model the batch didn't produce
+    output for is sliced on its own afterwards.
+    """
+    import shutil
+    import subprocess
+    import tempfile
+
+    jobs = [leader] + companions
+    posX, posY = leader.center
+    staging = tempfile.mkdtemp(prefix="slic3r-batch-")
+    output_folder = None
+    results = dict()
+    cancelled = False
+    failure = None
+    self._slic3r_logger.info("### Slicing %d models in one batch: %s" % (len(jobs), ", ".join(job.model_path for job in jobs)))
+
+    try:
+      staged = stage_models([job.model_path for job in jobs], staging)
+      try:
+        # next to the leader's destination, so the results can usually be
+        # renamed into place
+        output_folder = tempfile.mkdtemp(prefix=".slic3r-batch-", dir=os.path.dirname(os.path.abspath(leader.machinecode_path)))
+      except (IOError, OSError):
+        output_folder = os.path.join(staging, "output")
+        os.mkdir(output_folder)
+
+      args = [executable] + capabilities.get_batch_args(leader.profile_path, posX, posY, output_folder, staged, binary=leader.binary,
+                                                        config_args=leader.config_args)
+      env = dict(os.environ)
+      env.update(capabilities.env)
+      working_dir, _ = os.path.split(executable)
+      limits = self._get_resource_limits()
+      args = limits.wrap_args(args)
+
+      self._logger.info("Running %r in %s" % (" ".join(args), working_dir))
+      spawn_start = time.time()
+      p = subprocess.Popen(args, cwd=working_dir or None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+      limits.apply(p.pid)
+      leader.metrics["spawn"] = time.time() - spawn_start
+      # the time limit applies per model
+      timeout = ProcessTimeout(p, limits.timeout * len(jobs) if limits.timeout else None)
+      for job in jobs:
+        job.metrics["batch_size"] = len(jobs)
+      # the output of the whole run goes to the leader's log
+      output_log = self._create_output_log(leader)
+      try:
+        with self._slicing_commands_mutex:
+          self._slicing_commands[leader.machinecode_path] = p
+        if leader.cancelled:
+          self.cancel_slicing(leader.machinecode_path)
+
+        progresses = [self._create_progress(job) for job in jobs]
+        batch_progress = BatchProgress(progresses)
+
+        def on_stdout_line(stdout_line):
+          output_log.stdout(stdout_line)
+          batch_progress.feed_line(stdout_line.decode("utf-8", "replace"))
+
+        def on_stderr_line(stderr_line):
+          output_log.stderr(stderr_line)
+
+        pump_output(p, on_stdout_line, on_stderr_line)
+        # the process' resources are accounted to the leader only
+        self._record_process_metrics(leader, wait_process(p), spawn_start)
+      finally:
+        timeout.cancel()
+        output_log.close()
+        for stream in (p.stdout, p.stderr):
+          stream.close()
+        if p.returncode is None:
+          p.kill()
+          p.wait()
+        with self._slicing_commands_mutex:
+          self._slicing_commands.pop(leader.machinecode_path, None)
         with self._cancelled_jobs_mutex:
-          self._cancelled_jobs.append(machinecode_path)
-        self._slicing_commands[machinecode_path].terminate()
-        self._logger.info("Cancelled slicing of %s" % machinecode_path)
+          if leader.machinecode_path in self._cancelled_jobs:
+            self._cancelled_jobs.remove(leader.machinecode_path)
+            cancelled = True
+
+      if timeout.expired:
+        # slicing the models one by one would most likely just run into the limit again
+        failure = "Slicing took longer than %d seconds per model and was aborted" % limits.timeout
+        self._slic3r_logger.info("### " + failure)
+        self._logger.warn("Could not slice batch: %s" % failure)
+
+      self._slic3r_logger.info("### Batch finished, returncode %d" % p.returncode)
+      for job, staged_path, progress in zip(jobs, staged, progresses):
+        output_path = batch_output_path(output_folder, staged_path, binary=leader.binary)
+        if job.cancelled or (job is leader and cancelled) or not os.path.isfile(output_path):
+          continue
+        try:
+          self._deliver_output(job, output_path, job.machinecode_path)
+          if progress is not None:
+            progress.finish()
+          results[job.id] = self._collect_result(job, job.cache_key)
+        except Exception:
+          self._logger.exception("Could not deliver the batch result for %s" % job.model_path)
+
+    except Exception:
+      self._logger.exception("Could not slice batch via Slic3r, slicing the models one by one")
+
+    finally:
+      shutil.rmtree(staging, ignore_errors=True)
+      if output_folder is not None:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+      # whatever the batch didn't produce is sliced the usual way
+      for job in jobs:
+        if job.id in results or job is leader:
+          continue
+        if job.cancelled:
+          job.finish(octoprint.slicing.SlicingCancelled())
+          continue
+        if failure is not None:
+          job.finish((False, failure))
+          continue
+        try:
+          job.finish(self._run_slicer(job, executable, capabilities, job.cache_key))
+        except Exception as e:
+          job.finish(e)
+      for job in companions:
+        if not job.done:
+          job.finish(results[job.id])
+
+      self._slic3r_logger.info("-" * 40)
+
+    if cancelled or leader.cancelled:
+      raise octoprint.slicing.SlicingCancelled()
+    if leader.id in results:
+      return results[leader.id]
+    if failure is not None:
+      return False, failure
+    return self._run_slicer(leader, executable, capabilities, leader.cache_key)
+
+  def _get_engine_capabilities(self, executable):
+    capabilities = None
+    if self._engine_capabilities is not None:
+      try:
+        capabilities = self._engine_capabilities.get(executable)
+      except Exception:
+        self._logger.exception("Error during Slic3r engine detection")
+    if capabilities is None:
+      capabilities = EngineCapabilities()
+    return capabilities
+
+  def _probe_engine_async(self):
+    executable = normalize_path(self._settings.get(["slic3r_engine"]))
+    if not executable or not os.path.exists(executable):
+      return
+
+    import threading
+    thread = threading.Thread(target=self._get_engine_capabilities, args=(executable,))
+    thread.daemon = True
+    thread.start()
+
+  def _on_queue_position(self, job, position):
+    self._slic3r_logger.info("Slicing of %s waiting at position %d in the queue", job.model_path, position + 1)
+    self._plugin_manager.send_plugin_message(self._identifier, dict(type="queue",
+                                                                    model=os.path.basename(job.model_path),
+                                                                    position=position + 1))
+    job.report_queue_position(position + 1)
+
+  def _create_progress(self, job):
+    if job.on_progress is None:
+      return None
+
+    def on_progress(value, eta):
+      if eta is not None:
+        self._slic3r_logger.info("Slicing of %s at %.1f%%, about %ds remaining", job.model_path, value * 100, eta)
+      self._plugin_manager.send_plugin_message(self._identifier, dict(type="progress",
+                                                                      model=os.path.basename(job.model_path),
+                                                                      progress=value,
+                                                                      eta=eta))
+      job.report_progress(value)
+
+    interval = self._settings.get_float(["progress_interval"])
+    return SlicingProgress(expected_layers=self._get_expected_layers(job), callback=on_progress,
+                           interval=interval if interval is not None else 0.5)
+
+  def _create_output_log(self, job):
+    name = None
+    if self._settings.get_boolean(["job_logs"]) and self._slic3r_logger.isEnabledFor(logging.DEBUG):
+      name = EngineOutputLog.make_name(job.model_path)
+      job.metrics["log"] = name + ".gz"
+    return EngineOutputLog(self._slic3r_logger, name=name, sampler=self._trace_sampler)
+
+  def _configure_job_logs(self):
+    if self._job_log_handler is not None:
+      self._job_log_handler.max_size = (self._settings.get_int(["job_log_size"]) or 10) * 1024 * 1024
+    rate = self._settings.get_int(["log_trace_rate"])
+    self._trace_sampler = TraceSampler(rate) if rate else None
+
+  def _get_expected_layers(self, job):
+    try:
+      height = job.mesh.height if job.mesh is not None else None
+      if not height:
+        return None
+
+      profile = self._get_job_profile(job)
+      layer_height = float(profile.get("layer_height", 0))
+      first_layer_height = profile.get("first_layer_height")
+      if first_layer_height and first_layer_height.endswith("%"):
+        # percentage of the layer height
+        first_layer_height = layer_height * float(first_layer_height[:-1]) / 100.0
+      elif first_layer_height:
+        first_layer_height = float(first_layer_height)
+
+      return expected_layer_count(height, layer_height, first_layer_height)
+    except Exception:
+      self._logger.exception("Could not determine the expected number of layers for %s" % job.model_path)
+      return None
+
+  def _get_resource_limits(self, background=False):
+    memory = self._settings.get_int(["limit_memory"])
+    nice = self._settings.get_int(["limit_nice"])
+    if background:
+      # only use what's left over
+      nice = 19
+    return ResourceLimits(memory=memory * 1024 * 1024 if memory else None,
+                          reserve_cpu=self._settings.get_boolean(["limit_reserve_cpu"]),
+                          nice=nice,
+                          io_idle=background or self._settings.get_boolean(["limit_io_idle"]),
+                          timeout=self._settings.get_int(["limit_timeout"]))
+
+  def _inspect_model(self, path):
+    try:
+      return self._model_cache.get(path)
+    except Exception:
+      self._logger.exception("Could not inspect %s" % path)
+      return None
+
+  def _get_cache_size(self):
+    return (self._settings.get_int(["cache_size"]) or 0) * 1024 * 1024
+
+  def _get_cache_key(self, job, capabilities):
+    try:
+      profile = self._get_job_profile(job)
+      engine = "%s-%s" % (capabilities.flavor, capabilities.version)
+      # ASCII results keep their keys from before binary G-code was supported
+      extra = dict(binary=1) if job.binary else dict()
+      return SliceResultCache.make_key(hash_file(job.model_path), hash_profile(profile), job.center, engine, **extra)
+    except Exception:
+      self._logger.exception("Could not compute the result cache key for %s" % job.model_path)
+      return None
+
+  def _get_placement_key(self, job, capabilities):
+    model_path = job.model_path
+    try:
+      profile = self._get_job_profile(job)
+      blocker = get_profile_blocker(profile)
+      if blocker is not None:
+        self._slic3r_logger.info("### Results can't be moved on the bed, %s" % blocker)
+        return None
+      engine = "%s-%s" % (capabilities.flavor, capabilities.version)
+      return SliceResultCache.make_placement_key(hash_file(model_path), hash_profile(profile), engine)
+    except Exception:
+      self._logger.exception("Could not compute the placement key for %s" % model_path)
+      return None
+
+  def _apply_overrides(self, job, capabilities):
+    """Makes the engine use the job's overrides on top of its profile.
+
+    Either as command line flags (``job.config_args``), or by pointing the
+    job at a file with the effective config in the scratch folder, which is
+    shared by all jobs with the same effective config.
+    """
+    job.config_args = capabilities.get_config_args(job.overrides)
+    if job.config_args:
+      self._slic3r_logger.info("### Overrides on the command line: %s" % " ".join(job.config_args))
+      return
+
+    from octoprint.util import dict_merge
+    profile, _, _ = self._load_profile(job.profile_path)
+    # INI files written by Slic3r and PrusaSlicer have 1 and 0 for booleans
+    overrides = dict((key, ("1" if value else "0") if isinstance(value, bool) else value) for key, value in job.overrides.items())
+    job.profile_path = self._config_scratch.get_path(dict_merge(profile, overrides))
+    self._slic3r_logger.info("### Effective config with overrides at %s" % job.profile_path)
+
+  def _get_job_profile(self, job):
+    """The settings the job is sliced with, its profile plus overrides."""
+    profile, _, _ = self._load_profile(job.profile_path)
+    if job.config_args:
+      profile.update(job.overrides)
+    return profile
+
+  def _get_profile_loader(self, path):
+    def load():
+      return self._load_profile(path)[0]
+    return load
 
   def _load_profile(self, path):
-    profile, display_name, description = Profile.from_slic3r_ini(path)
-    return profile, display_name, description
+    profile, display_name, description = self._profile_cache.get(path)
+    # callers may modify the profile, the cached one has to stay untouched
+    return dict(profile), display_name, description
 
   def _save_profile(self, path, profile, allow_overwrite=True, display_name=None, description=None):
     if not allow_overwrite and os.path.exists(path):
       raise IOError("Cannot overwrite {path}".format(path=path))
-    Profile.to_slic3r_ini(profile, path, display_name=display_name, description=description)
+
+    # write to a temporary file next to the profile and move that into place,
+    # so a profile is never seen half written
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+      Profile.to_slic3r_ini(profile, temp_path, display_name=display_name, description=description)
+      os.chmod(temp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+      if os.name == "nt" and os.path.exists(path):
+        os.remove(path)
+      os.rename(temp_path, path)
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+      self._profile_cache.invalidate(path)
 
 def _sanitize_name(name):
   if name is None:
@@ -0,0 +1,225 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import os
+import re
+
+from .bgcode import BlockTypes, is_bgcode, read_metadata
+
+# Slic3r 1.x writes one of these per extruder:
+#   ; filament used = 1234.5mm (7.3cm3)
+regex_filament_used = re.compile(r"\s*;\s*filament used\s*=\s*([0-9.]+)\s*mm\s*\(([0-9.]+)cm3\)")
+
+# PrusaSlicer writes comma separated per extruder lists:
+#   ; filament used [mm] = 1234.56, 789.01
+#   ; estimated printing time (normal mode) = 1h 2m 3s
+regex_summary = re.compile(r"\s*;\s*(filament used \[mm\]|filament used \[cm3\]|filament cost|total filament cost"
+                           r"|estimated printing time(?: \((normal|silent) mode\))?|total layers count)\s*=\s*(.*?)\s*$")
+
+regex_time_part = re.compile(r"([0-9.]+)\s*([dhms])")
+
+regex_layer_change = re.compile(r";\s*LAYER_CHANGE")
+
+time_units = dict(d=24*60*60, h=60*60, m=60, s=1)
+
+TAIL_SIZES = (64 * 1024, 256 * 1024, 1024 * 1024)
+"""Window sizes at the end of the file to look for the summary block in before
+falling back to a full scan."""
+
+def parse_time(time_text):
+  """Parses a time string like ``1d 2h 3m 4s`` into seconds."""
+  return sum(float(value) * time_units[unit] for value, unit in regex_time_part.findall(time_text))
+
+def _parse_floats(text):
+  result = []
+  for value in text.split(","):
+    try:
+      result.append(float(value))
+    except ValueError:
+      pass
+  return result
+
+class GcodeSummary(object):
+  """Collects the summary values Slic3r and PrusaSlicer write into their G-code
+  and turns them into OctoPrint's analysis structure."""
+
+  def __init__(self):
+    self.filament_lengths = []
+    self.filament_volumes = []
+    self.printing_times = dict()
+    self.filament_cost = None
+    self.layer_count = None
+    self.layer_changes = 0
+
+  @property
+  def found(self):
+    return bool(self.filament_lengths or self.filament_volumes or self.printing_times)
+
+  def feed_line(self, line):
+    if ";" not in line:
+      return
+
+    m = regex_summary.match(line)
+    if m:
+      key, mode, value = m.groups()
+      if key == "filament used [mm]":
+        self.filament_lengths = _parse_floats(value)
+      elif key == "filament used [cm3]":
+        self.filament_volumes = _parse_floats(value)
+      elif key.startswith("estimated printing time"):
+        self.printing_times[mode or "normal"] = parse_time(value)
+      elif key == "total filament cost":
+        self.filament_cost = sum(_parse_floats(value))
+      elif key == "filament cost" and self.filament_cost is None:
+        self.filament_cost = sum(_parse_floats(value))
+      elif key == "total layers count":
+        self.layer_count = int(sum(_parse_floats(value)))
+      return
+
+    m = regex_filament_used.match(line)
+    if m:
+      self.filament_lengths.append(float(m.group(1)))
+      self.filament_volumes.append(float(m.group(2)))
+      return
+
+    if regex_layer_change.match(line):
+      self.layer_changes += 1
+
+  def to_analysis(self):
+    """Returns the analysis dict or None if no summary was found."""
+    if not self.found:
+      return None
+
+    analysis = dict()
+    if "normal" in self.printing_times:
+      analysis["estimatedPrintTime"] = self.printing_times["normal"]
+    elif self.printing_times:
+      analysis["estimatedPrintTime"] = list(self.printing_times.values())[0]
+    if len(self.printing_times) > 1:
+      analysis["estimatedPrintTimes"] = dict(self.printing_times)
+
+    if self.filament_lengths or self.filament_volumes:
+      filament = dict()
+      for tool in range(max(len(self.filament_lengths), len(self.filament_volumes))):
+        entry = dict()
+        if tool < len(self.filament_lengths):
+          entry["length"] = self.filament_lengths[tool]
+        if tool < len(self.filament_volumes):
+          entry["volume"] = self.filament_volumes[tool]
+        filament["tool%d" % tool] = entry
+      analysis["filament"] = filament
+
+    if self.filament_cost is not None:
+      analysis["filamentCost"] = self.filament_cost
+
+    layer_count = self.layer_count if self.layer_count is not None else self.layer_changes
+    if layer_count:
+      analysis["layerCount"] = layer_count
+
+    return analysis
+
+def _decode(line):
+  return line.decode("utf-8", "replace")
+
+def _scan_window(data, truncated):
+  """Feeds a window of bytes from the end of the G-code to a summary.
+
+  ``truncated`` tells whether the window starts somewhere in the middle of the
+  file. Returns the summary if it was found completely inside the window, None
+  otherwise.
+  """
+  lines = data.split(b"\n")
+  if truncated:
+    # first line is most likely incomplete
+    lines = lines[1:]
+
+  summary = GcodeSummary()
+  first_match = None
+  offset = 0
+  for line in lines:
+    if b";" in line:
+      found = summary.found
+      summary.feed_line(_decode(line))
+      if first_match is None and summary.found and not found:
+        first_match = offset
+    offset += len(line) + 1
+
+  if not summary.found:
+    return None
+  if truncated and first_match < 4096:
+    # the summary might extend beyond the start of our window
+    return None
+
+  if truncated:
+    # layer changes are only counted completely on a full scan
+    summary.layer_changes = 0
+  return summary
+
+def get_analysis_from_tail(data, truncated=True):
+  """Extracts the analysis data structure from the last bytes of the gcode.
+
+  Return None if there is no (complete) analysis information in ``data``.
+  """
+  summary = _scan_window(bytes(data), truncated)
+  if summary is None:
+    return None
+  return summary.to_analysis()
+
+def get_analysis_from_gcode(machinecode_path, stats=None):
+  """Extracts the analysis data structure from the gcode.
+
+  The analysis structure should look like this:
+  http://docs.octoprint.org/en/master/modules/filemanager.html#octoprint.filemanager.analysis.GcodeAnalysisQueue
+  (There is a bug in the documentation, estimatedPrintTime should be in seconds.)
+
+  Slic3r and PrusaSlicer write their summary at the very end of the file, so
+  only the tail of the file is read unless no summary can be found there.
+  Binary G-code is analysed from its metadata blocks. If ``stats`` is a dict,
+  the number of bytes read is stored in it as ``bytes_read``. Return None if
+  there is no analysis information in the file.
+  """
+  if stats is None:
+    stats = dict()
+  stats["bytes_read"] = 0
+
+  if is_bgcode(machinecode_path):
+    return get_analysis_from_bgcode(machinecode_path, stats=stats)
+
+  size = os.path.getsize(machinecode_path)
+  with open(machinecode_path, "rb") as f:
+    for tail_size in TAIL_SIZES:
+      start = max(0, size - tail_size)
+      f.seek(start)
+      data = f.read()
+      stats["bytes_read"] += len(data)
+
+      summary = _scan_window(data, start > 0)
+      if summary is not None:
+        return summary.to_analysis()
+      if start == 0:
+        return None
+
+    f.seek(0)
+    summary = GcodeSummary()
+    for line in f:
+      stats["bytes_read"] += len(line)
+      if line.lstrip().startswith(b";"):
+        summary.feed_line(_decode(line))
+  return summary.to_analysis()
+
+def get_analysis_from_bgcode(machinecode_path, stats=None):
+  """Extracts the analysis data structure from the metadata of binary G-code.
+
+  The print metadata block carries the same summary values the ASCII G-code
+  has at its end, so neither the G-code blocks nor their compression have to
+  be dealt with.
+  """
+  metadata = read_metadata(machinecode_path, stats=stats)
+  summary = GcodeSummary()
+  for block_type in (BlockTypes.PRINTER_METADATA, BlockTypes.PRINT_METADATA):
+    for key, value in metadata.get(block_type, ()):
+      summary.feed_line("; %s = %s" % (key, value))
+  return summary.to_analysis()
@@ -0,0 +1,168 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import os
+import shutil
+import threading
+import time
+
+from .progress import regex_status
+
+# Keeps a single engine process from growing too large, it's restarted
+# for the next batch anyway
+BATCH_MAX_MODEL_SIZE = 64 * 1024 * 1024
+
+def stage_models(model_paths, folder):
+  """Links (or copies) the models into ``folder`` as ``0.stl``, ``1.stl``, ...
+
+  The engine names its output after its inputs, this keeps them unique and
+  predictable even if several models share a name. Returns the new paths.
+  """
+  staged = []
+  for index, path in enumerate(model_paths):
+    _, extension = os.path.splitext(path)
+    target = os.path.join(folder, "%d%s" % (index, extension.lower()))
+    try:
+      os.symlink(os.path.abspath(path), target)
+    except (AttributeError, NotImplementedError, OSError):
+      shutil.copyfile(path, target)
+    staged.append(target)
+  return staged
+
+def batch_output_path(output_folder, staged_path, binary=False):
+  name, _ = os.path.splitext(os.path.basename(staged_path))
+  return os.path.join(output_folder, name + (".bgcode" if binary else ".gcode"))
+
+try:
+  string_types = basestring
+except NameError:
+  string_types = str
+
+def get_batch_entry_error(entry, key="path"):
+  """Checks a model of a batch request, a dict with the model's path under
+  ``key`` and optionally ``gcode`` and ``position``. Returns a message
+  explaining what's wrong with it, None if it's fine."""
+  if not isinstance(entry, dict):
+    return "Expected a file name or an object, got {entry!r}".format(entry=entry)
+  if not isinstance(entry.get(key), string_types) or not entry[key]:
+    return "Expected a file name as {key} of {entry!r}".format(key=key, entry=entry)
+  if entry.get("gcode") is not None and not isinstance(entry["gcode"], string_types):
+    return "Expected a file name as gcode of {entry!r}".format(entry=entry)
+  position = entry.get("position")
+  if position is not None:
+    if not isinstance(position, dict) or not all(isinstance(position.get(axis), (int, float)) and not isinstance(position.get(axis), bool)
+                                                 for axis in ("x", "y")):
+      return "Expected a position with numeric x and y in {entry!r}".format(entry=entry)
+  return None
+
+class BatchProgress(object):
+  """Hands the engine output of a batch to the progress of the model that is
+  currently being sliced.
+
+  The engine processes the models one after the other, its status percentage
+  starting over marks the next model.
+  """
+
+  def __init__(self, progresses):
+    self._progresses = progresses
+    self._cursor = 0
+    self._last_percent = -1
+
+  def feed_line(self, line):
+    if "=>" in line:
+      m = regex_status.match(line)
+      if m and m.group(1) is not None:
+        percent = int(m.group(1))
+        if percent < self._last_percent and self._cursor + 1 < len(self._progresses):
+          self._cursor += 1
+        self._last_percent = percent
+
+    progress = self._progresses[self._cursor]
+    if progress is not None:
+      progress.feed_line(line)
+
+class BatchJobStates(object):
+  QUEUED = "queued"
+  SLICING = "slicing"
+  DONE = "done"
+  FAILED = "failed"
+  CANCELLED = "cancelled"
+
+class SlicingBatch(object):
+  """Several models sliced with the same profile, see ``Slic3rPlugin.slice_batch``.
+
+  ``models`` is a list of model paths or of dicts with ``model_path`` and
+  optionally ``machinecode_path`` and ``position``. Raises ``ValueError``
+  for anything else.
+  """
+
+  def __init__(self, models, profile_path):
+    import uuid
+    self.id = uuid.uuid4().hex
+    self.profile_path = profile_path
+    self.created = time.time()
+    self.finished = None
+    self.cancelled = False
+    self._mutex = threading.Lock()
+
+    self.jobs = []
+    for index, model in enumerate(models):
+      if not isinstance(model, dict):
+        model = dict(model_path=model)
+      error = get_batch_entry_error(model, key="model_path")
+      if error is not None:
+        raise ValueError(error)
+      self.jobs.append(dict(index=index,
+                            model_path=model["model_path"],
+                            machinecode_path=model.get("machinecode_path"),
+                            position=model.get("position"),
+                            state=BatchJobStates.QUEUED,
+                            progress=0.0,
+                            analysis=None,
+                            error=None,
+                            started=None,
+                            finished=None))
+
+  @property
+  def done(self):
+    return self.finished is not None
+
+  def update(self, index, **kwargs):
+    with self._mutex:
+      job = self.jobs[index]
+      state = kwargs.get("state")
+      if state == BatchJobStates.SLICING:
+        job["started"] = time.time()
+      elif state is not None and state != BatchJobStates.QUEUED:
+        job["finished"] = time.time()
+      job.update(kwargs)
+      return dict(job)
+
+  def finish(self):
+    with self._mutex:
+      self.finished = time.time()
+
+  def to_dict(self):
+    with self._mutex:
+      jobs = [dict(job) for job in self.jobs]
+      finished = self.finished
+
+    counts = dict((state, 0) for state in (BatchJobStates.QUEUED, BatchJobStates.SLICING, BatchJobStates.DONE,
+                                           BatchJobStates.FAILED, BatchJobStates.CANCELLED))
+    for job in jobs:
+      counts[job["state"]] += 1
+      if job["started"] is not None:
+        job["duration"] = (job["finished"] or time.time()) - job["started"]
+      del job["started"]
+      del job["finished"]
+
+    return dict(id=self.id,
+                done=finished is not None,
+                cancelled=self.cancelled,
+                duration=(finished or time.time()) - self.created,
+                progress=sum(job["progress"] for job in jobs) / len(jobs) if jobs else 1.0,
+                counts=counts,
+                jobs=jobs)
@@ -0,0 +1,144 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import struct
+import zlib
+
+# PrusaSlicer's binary G-code format (2.7+), see
+# https://github.com/prusa3d/libbgcode/blob/main/doc/specifications.md
+
+BGCODE_MAGIC = b"GCDE"
+
+struct_file_header = struct.Struct("<4sIH")
+struct_block_header = struct.Struct("<HHI")
+struct_compressed_size = struct.Struct("<I")
+
+CHECKSUM_SIZE = 4
+
+class BlockTypes(object):
+  FILE_METADATA = 0
+  GCODE = 1
+  SLICER_METADATA = 2
+  PRINTER_METADATA = 3
+  PRINT_METADATA = 4
+  THUMBNAIL = 5
+
+class CompressionTypes(object):
+  NONE = 0
+  DEFLATE = 1
+  HEATSHRINK_11_4 = 2
+  HEATSHRINK_12_4 = 3
+
+class ChecksumTypes(object):
+  NONE = 0
+  CRC32 = 1
+
+METADATA_BLOCKS = (BlockTypes.FILE_METADATA, BlockTypes.SLICER_METADATA, BlockTypes.PRINTER_METADATA, BlockTypes.PRINT_METADATA)
+
+class BgcodeError(Exception):
+  pass
+
+def is_bgcode(path):
+  with open(path, "rb") as f:
+    return f.read(len(BGCODE_MAGIC)) == BGCODE_MAGIC
+
+def _parameters_size(block_type):
+  # thumbnails have format, width and height, everything else an encoding
+  return 6 if block_type == BlockTypes.THUMBNAIL else 2
+
+def iter_blocks(f):
+  """Yields ``(type, compression, size, header, parameters, data_offset)`` per block.
+
+  ``size`` is the size of the (possibly compressed) data following the block
+  header and parameters at ``data_offset``. The data itself isn't read, the
+  caller may read it before asking for the next block.
+  """
+  f.seek(0)
+  header = f.read(struct_file_header.size)
+  if len(header) < struct_file_header.size:
+    raise BgcodeError("Truncated file header")
+  magic, version, checksum_type = struct_file_header.unpack(header)
+  if magic != BGCODE_MAGIC:
+    raise BgcodeError("Not a binary G-code file")
+  checksum_size = CHECKSUM_SIZE if checksum_type == ChecksumTypes.CRC32 else 0
+
+  offset = struct_file_header.size
+  while True:
+    f.seek(offset)
+    block_header = f.read(struct_block_header.size)
+    if not block_header:
+      return
+    if len(block_header) < struct_block_header.size:
+      raise BgcodeError("Truncated block header at %d" % offset)
+    block_type, compression, uncompressed_size = struct_block_header.unpack(block_header)
+    size = uncompressed_size
+    if compression != CompressionTypes.NONE:
+      compressed_size = f.read(struct_compressed_size.size)
+      if len(compressed_size) < struct_compressed_size.size:
+        raise BgcodeError("Truncated block header at %d" % offset)
+      size, = struct_compressed_size.unpack(compressed_size)
+      block_header += compressed_size
+
+    parameters = f.read(_parameters_size(block_type))
+    data_offset = offset + len(block_header) + len(parameters)
+    yield block_type, compression, size, block_header, parameters, data_offset
+    offset = data_offset + size + checksum_size
+
+def _checksum_type(f):
+  f.seek(0)
+  header = f.read(struct_file_header.size)
+  if len(header) < struct_file_header.size:
+    raise BgcodeError("Truncated file header")
+  return struct_file_header.unpack(header)[2]
+
+def _parse_ini(data):
+  result = []
+  for line in data.decode("utf-8", "replace").splitlines():
+    key, sep, value = line.partition("=")
+    if sep:
+      result.append((key.strip(), value.strip()))
+  return result
+
+def read_metadata(path, stats=None):
+  """Reads the metadata blocks of a binary G-code file.
+
+  PrusaSlicer writes them in front of the G-code, so reading stops at the
+  first G-code block and the (large) rest of the file isn't touched. Returns
+  a dict mapping block type to a list of ``(key, value)`` pairs. If ``stats``
+  is a dict, the offset reading stopped at is stored in it as ``bytes_read``.
+  """
+  if stats is None:
+    stats = dict()
+
+  metadata = dict()
+  with open(path, "rb") as f:
+    verify = _checksum_type(f) == ChecksumTypes.CRC32
+    for block_type, compression, size, header, parameters, data_offset in iter_blocks(f):
+      if block_type == BlockTypes.GCODE:
+        break
+      if block_type not in METADATA_BLOCKS:
+        continue
+
+      f.seek(data_offset)
+      data = f.read(size)
+      if len(data) < size:
+        raise BgcodeError("Truncated block at %d" % data_offset)
+      if verify:
+        checksum = f.read(CHECKSUM_SIZE)
+        if len(checksum) < CHECKSUM_SIZE:
+          raise BgcodeError("Truncated block at %d" % data_offset)
+        checksum, = struct.unpack("<I", checksum)
+        if zlib.crc32(header + parameters + data) & 0xffffffff != checksum:
+          raise BgcodeError("Checksum mismatch in block at %d" % data_offset)
+
+      if compression == CompressionTypes.DEFLATE:
+        data = zlib.decompress(data)
+      elif compression != CompressionTypes.NONE:
+        # PrusaSlicer only uses heatshrink for the G-code itself
+        continue
+      metadata[block_type] = _parse_ini(data)
+    stats["bytes_read"] = f.tell()
+  return metadata
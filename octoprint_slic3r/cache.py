@@ -0,0 +1,581 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_file_hashes = dict()
+_file_hashes_mutex = threading.Lock()
+
+def hash_file(path):
+  """Returns the SHA256 of the file's contents, remembered per path, mtime and size."""
+  stat = os.stat(path)
+  key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+  with _file_hashes_mutex:
+    if key in _file_hashes:
+      return _file_hashes[key]
+
+  sha = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+      sha.update(chunk)
+  digest = sha.hexdigest()
+
+  with _file_hashes_mutex:
+    if len(_file_hashes) > 1024:
+      _file_hashes.clear()
+    _file_hashes[key] = digest
+  return digest
+
+def hash_profile(profile):
+  """Returns a SHA256 of the profile dict that doesn't depend on key order."""
+  data = json.dumps(profile, sort_keys=True, separators=(",", ":"))
+  return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def reflink(source, destination):
+  """Clones ``source`` to ``destination`` sharing the data blocks (btrfs, xfs, ...).
+
+  Raises an OSError/IOError if the platform or the filesystem doesn't support it.
+  """
+  import fcntl
+  FICLONE = 0x40049409
+  with open(source, "rb") as src:
+    with open(destination, "wb") as dst:
+      try:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+      except Exception:
+        dst.close()
+        os.remove(destination)
+        raise
+
+def place_file(source, destination, allow_hardlink=False):
+  """Puts a copy of ``source`` at ``destination`` as cheaply as possible.
+
+  Tries a reflink, then (if ``allow_hardlink``) a hard link, then falls back
+  to copying. A hard link shares its data with ``source``, so only allow it
+  if neither file is ever changed in place. The destination is replaced
+  atomically. Returns the method that was used.
+  """
+  folder = os.path.dirname(os.path.abspath(destination))
+  fd, temp_path = tempfile.mkstemp(prefix=".slic3r-", dir=folder)
+  os.close(fd)
+  os.remove(temp_path)
+
+  method = None
+  try:
+    try:
+      reflink(source, temp_path)
+      method = "reflink"
+    except Exception:
+      if allow_hardlink and hasattr(os, "link") and os.name != "nt":
+        try:
+          os.link(source, temp_path)
+          method = "hardlink"
+        except OSError:
+          pass
+    if method is None:
+      shutil.copyfile(source, temp_path)
+      method = "copy"
+
+    if os.name == "nt" and os.path.exists(destination):
+      os.remove(destination)
+    os.rename(temp_path, destination)
+  except Exception:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
+  return method
+
+def move_file(source, destination):
+  """Moves ``source`` to ``destination`` without copying its data if possible.
+
+  Within a filesystem that's an atomic rename, across filesystems a reflink
+  is tried before falling back to copying. Returns the method that was used
+  and the number of bytes that had to be copied.
+  """
+  try:
+    if os.name == "nt" and os.path.exists(destination):
+      os.remove(destination)
+    os.rename(source, destination)
+    return "rename", 0
+  except OSError as e:
+    if e.errno != errno.EXDEV:
+      raise
+
+  size = os.path.getsize(source)
+  method = place_file(source, destination)
+  os.remove(source)
+  return method, size if method == "copy" else 0
+
+def staging_path(destination, suffix=".gcode"):
+  """Returns a new hidden temporary file next to ``destination``.
+
+  Output written there can be moved into place by a rename. Falls back to
+  the default temporary folder if the destination's folder isn't writable.
+  """
+  try:
+    fd, path = tempfile.mkstemp(prefix=".slic3r-", suffix=suffix, dir=os.path.dirname(os.path.abspath(destination)))
+  except (IOError, OSError):
+    fd, path = tempfile.mkstemp(prefix="slic3r-", suffix=suffix)
+  os.close(fd)
+  return path
+
+def default_scratch_folder():
+  """A folder for short lived files, in memory (tmpfs) if possible."""
+  name = "octoprint-slic3r-%d" % os.getuid() if hasattr(os, "getuid") else "octoprint-slic3r"
+  for candidate in ("/dev/shm", os.environ.get("XDG_RUNTIME_DIR")):
+    if candidate and os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+      return os.path.join(candidate, name)
+  return os.path.join(tempfile.gettempdir(), name)
+
+class CacheStats(object):
+  """Counts the hits and misses of a cache's lookups, updated and read while
+  holding the cache's own lock."""
+
+  hits = 0
+  misses = 0
+
+  def _lookup_stats(self, **stats):
+    lookups = self.hits + self.misses
+    stats.update(hits=self.hits, misses=self.misses, hit_rate=float(self.hits) / lookups if lookups else 0.0)
+    return stats
+
+class ConfigScratch(CacheStats):
+  """Config files for jobs with overrides, one per effective config.
+
+  Files are named after the hash of their contents, so jobs with the same
+  overrides share a file that is only written once. ``writer`` is called with
+  the profile and the path to write it to. At most ``max_entries`` files are
+  kept, least recently used ones are removed first, but none that was used
+  within the last ``min_age`` seconds, it might still be read by an engine.
+  """
+
+  def __init__(self, folder, writer, max_entries=64, min_age=600):
+    self._folder = folder
+    self._writer = writer
+    self._entries = OrderedDict()
+    self._mutex = threading.Lock()
+
+    self.max_entries = max_entries
+    self.min_age = min_age
+
+  def get_path(self, profile):
+    key = hash_profile(profile)
+    path = os.path.join(self._folder, key + ".ini")
+    with self._mutex:
+      if key in self._entries and os.path.isfile(path):
+        self._entries.pop(key)
+        self._entries[key] = time.time()
+        self.hits += 1
+        return path
+      self.misses += 1
+
+      if not os.path.isdir(self._folder):
+        os.makedirs(self._folder, 0o700)
+      fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self._folder)
+      os.close(fd)
+      try:
+        self._writer(profile, temp_path)
+        if os.name == "nt" and os.path.exists(path):
+          os.remove(path)
+        os.rename(temp_path, path)
+      except Exception:
+        if os.path.exists(temp_path):
+          os.remove(temp_path)
+        raise
+
+      self._entries.pop(key, None)
+      self._entries[key] = time.time()
+      self._evict()
+    return path
+
+  def clear(self):
+    with self._mutex:
+      for key in list(self._entries.keys()):
+        self._remove(key)
+
+  def get_stats(self):
+    with self._mutex:
+      return self._lookup_stats(entries=len(self._entries), max_entries=self.max_entries, folder=self._folder)
+
+  def _evict(self):
+    now = time.time()
+    for key, last_used in list(self._entries.items()):
+      if len(self._entries) <= self.max_entries or now - last_used < self.min_age:
+        break
+      self._remove(key)
+
+  def _remove(self, key):
+    self._entries.pop(key, None)
+    path = os.path.join(self._folder, key + ".ini")
+    if os.path.exists(path):
+      os.remove(path)
+
+class SliceResultCache(CacheStats):
+  """Keeps sliced G-code plus its analysis around, keyed by a hash over
+  everything that goes into a slicing job.
+
+  Entries are evicted least recently used first once ``max_size`` bytes are
+  exceeded. Stored G-code is always handed out as a copy (or reflink) of its
+  own, entries whose file changed its size in the meantime are dropped.
+  """
+
+  def __init__(self, folder, max_size=500 * 1024 * 1024):
+    self._logger = logging.getLogger(__name__)
+    self._folder = folder
+    self._index_path = os.path.join(folder, "index.json")
+    self._entries = OrderedDict()
+    self._mutex = threading.RLock()
+
+    self.max_size = max_size
+    self.bytes_saved = 0
+
+    if not os.path.isdir(folder):
+      os.makedirs(folder)
+    self._load()
+
+  @classmethod
+  def make_key(cls, model_hash, profile_hash, center, engine, **extra):
+    parts = [model_hash, profile_hash, "%.3f,%.3f" % tuple(center), engine]
+    parts += ["%s=%s" % (key, extra[key]) for key in sorted(extra)]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+  @classmethod
+  def make_placement_key(cls, model_hash, profile_hash, engine, **extra):
+    """Like ``make_key``, but shared by all positions of the model on the bed."""
+    parts = [model_hash, profile_hash, engine]
+    parts += ["%s=%s" % (key, extra[key]) for key in sorted(extra)]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+  @property
+  def size(self):
+    with self._mutex:
+      return sum(entry["size"] for entry in self._entries.values())
+
+  def get(self, key):
+    with self._mutex:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+
+      path = self._path(key)
+      if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+        self._remove(key)
+        return None
+      return dict(entry)
+
+  def deliver(self, key, destination):
+    """Places the cached G-code for ``key`` at ``destination``.
+
+    Returns a tuple ``(hit, analysis, method)``, ``method`` being how the file
+    was placed (see ``place_file``). Never a hard link, editing the delivered
+    G-code would change the cached entry as well.
+    """
+    with self._mutex:
+      entry = self.get(key)
+      if entry is None:
+        self.misses += 1
+        return False, None, None
+
+      try:
+        method = place_file(self._path(key), destination)
+      except Exception:
+        self._logger.exception("Could not deliver cached result %s to %s" % (key, destination))
+        self._remove(key)
+        self.misses += 1
+        return False, None, None
+
+      entry["last_used"] = time.time()
+      self._entries[key] = entry
+      self._touch(key)
+      self.hits += 1
+      self.bytes_saved += entry["size"]
+      self._save()
+
+    self._logger.info("Delivered cached result %s to %s via %s" % (key, destination, method))
+    return True, entry.get("analysis"), method
+
+  def find_placement(self, placement):
+    """Returns ``(key, entry)`` of the most recently used result sliced from
+    the same model and profile at any position, None if there is none.
+
+    ``entry["center"]`` is the position the result was sliced for.
+    """
+    with self._mutex:
+      for key in reversed(list(self._entries.keys())):
+        if self._entries[key].get("placement") != placement:
+          continue
+        entry = self.get(key)
+        if entry is not None:
+          return key, entry
+    return None
+
+  def open(self, key):
+    """Opens the cached G-code for ``key`` for reading, None if it's gone.
+
+    On POSIX systems the file stays readable even if the entry is evicted in
+    the meantime.
+    """
+    with self._mutex:
+      if self.get(key) is None:
+        return None
+      self._touch(key)
+      return io.open(self._path(key), "rb")
+
+  def put(self, key, source, analysis=None, placement=None, center=None):
+    size = os.path.getsize(source)
+    if size > self.max_size:
+      return
+
+    with self._mutex:
+      path = self._path(key)
+      place_file(source, path)
+      entry = dict(size=size, analysis=analysis, created=time.time(), last_used=time.time())
+      if placement is not None:
+        entry.update(placement=placement, center=list(center))
+      self._entries[key] = entry
+      self._touch(key)
+      self._evict()
+      self._save()
+
+  def clear(self):
+    with self._mutex:
+      for key in list(self._entries.keys()):
+        self._remove(key)
+      self._save()
+
+  def get_stats(self):
+    with self._mutex:
+      return self._lookup_stats(entries=len(self._entries), size=self.size, max_size=self.max_size,
+                                bytes_saved=self.bytes_saved)
+
+  def _path(self, key):
+    return os.path.join(self._folder, key + ".gco")
+
+  def _touch(self, key):
+    entry = self._entries.pop(key)
+    self._entries[key] = entry
+
+  def _evict(self):
+    size = self.size
+    while self._entries and size > self.max_size:
+      key, entry = next(iter(self._entries.items()))
+      self._remove(key)
+      size -= entry["size"]
+      self._logger.debug("Evicted cached result %s" % key)
+
+  def _remove(self, key):
+    self._entries.pop(key, None)
+    path = self._path(key)
+    if os.path.exists(path):
+      os.remove(path)
+
+  def _load(self):
+    if not os.path.isfile(self._index_path):
+      return
+    try:
+      with io.open(self._index_path, "rt", encoding="utf-8") as f:
+        entries = json.load(f)
+      for key, entry in sorted(entries.items(), key=lambda item: item[1]["last_used"]):
+        if os.path.isfile(self._path(key)):
+          self._entries[key] = entry
+    except Exception:
+      self._logger.exception("Could not load the slicing result cache index from %s" % self._index_path)
+      self._entries = OrderedDict()
+
+  def _save(self):
+    data = json.dumps(self._entries)
+    temp_path = self._index_path + ".tmp"
+    with io.open(temp_path, "wt", encoding="utf-8") as f:
+      f.write(data if isinstance(data, type(u"")) else data.decode("utf-8"))
+    if os.name == "nt" and os.path.exists(self._index_path):
+      os.remove(self._index_path)
+    os.rename(temp_path, self._index_path)
+
+class ProfileCache(CacheStats):
+  """Keeps parsed profiles in memory, keyed by path.
+
+  An entry is only used while the file's mtime and size are unchanged, at most
+  ``max_entries`` profiles are kept, least recently used ones are dropped first.
+  ``loader`` is called with the path and has to return what should be cached.
+  """
+
+  def __init__(self, loader, max_entries=256):
+    self._loader = loader
+    self._entries = OrderedDict()
+    self._mutex = threading.Lock()
+
+    self.max_entries = max_entries
+
+  def get(self, path):
+    path = os.path.abspath(path)
+    try:
+      stat = os.stat(path)
+      signature = (stat.st_mtime, stat.st_size)
+    except OSError:
+      signature = None
+
+    with self._mutex:
+      entry = self._entries.pop(path, None)
+      if entry is not None and signature is not None and entry[0] == signature:
+        self._entries[path] = entry
+        self.hits += 1
+        return entry[1]
+      self.misses += 1
+
+    value = self._loader(path)
+    if signature is not None and value is not None:
+      with self._mutex:
+        self._entries[path] = (signature, value)
+        while len(self._entries) > self.max_entries:
+          self._entries.popitem(last=False)
+    return value
+
+  def invalidate(self, path=None):
+    """Drops the entry for ``path``, or all of them if it's None."""
+    with self._mutex:
+      if path is None:
+        self._entries.clear()
+      else:
+        self._entries.pop(os.path.abspath(path), None)
+
+  def get_stats(self):
+    with self._mutex:
+      return self._lookup_stats(entries=len(self._entries), max_entries=self.max_entries)
+
+class ProfileIndex(CacheStats):
+  """Display names and descriptions of profiles, persisted to ``path``.
+
+  Listing profiles only needs those, so they are kept apart from the parsed
+  settings and survive restarts. An entry is only used while the profile's
+  mtime and size are unchanged. ``reader`` is called with the path of a
+  profile that has to be (re)indexed and returns ``(display_name, description)``.
+  """
+
+  def __init__(self, path, reader):
+    self._logger = logging.getLogger(__name__)
+    self._path = path
+    self._reader = reader
+    self._entries = dict()
+    self._dirty = False
+    self._mutex = threading.Lock()
+
+    self._load()
+
+  def get(self, path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = [stat.st_mtime, stat.st_size]
+    with self._mutex:
+      entry = self._entries.get(path)
+      if entry is not None and entry["signature"] == signature:
+        self.hits += 1
+        return entry["display_name"], entry["description"]
+      self.misses += 1
+
+    display_name, description = self._reader(path)
+    with self._mutex:
+      self._entries[path] = dict(signature=signature, display_name=display_name, description=description)
+      self._dirty = True
+    return display_name, description
+
+  def prune(self, folder, paths):
+    """Drops the entries of profiles in ``folder`` that aren't in ``paths``."""
+    folder = os.path.abspath(folder)
+    keep = set(os.path.abspath(path) for path in paths)
+    with self._mutex:
+      for path in list(self._entries.keys()):
+        if os.path.dirname(path) == folder and path not in keep:
+          del self._entries[path]
+          self._dirty = True
+
+  def invalidate(self):
+    with self._mutex:
+      self._entries.clear()
+      self._dirty = True
+    self.save()
+
+  def save(self):
+    """Writes the index if anything changed since it was last written."""
+    with self._mutex:
+      if not self._dirty:
+        return
+      data = json.dumps(self._entries)
+      self._dirty = False
+
+    try:
+      temp_path = self._path + ".tmp"
+      with io.open(temp_path, "wt", encoding="utf-8") as f:
+        f.write(data if isinstance(data, type(u"")) else data.decode("utf-8"))
+      if os.name == "nt" and os.path.exists(self._path):
+        os.remove(self._path)
+      os.rename(temp_path, self._path)
+    except Exception:
+      self._logger.exception("Could not save the profile index to %s" % self._path)
+
+  def get_stats(self):
+    with self._mutex:
+      return self._lookup_stats(entries=len(self._entries))
+
+  def _load(self):
+    if not os.path.isfile(self._path):
+      return
+    try:
+      with io.open(self._path, "rt", encoding="utf-8") as f:
+        self._entries = json.load(f)
+    except Exception:
+      self._logger.exception("Could not load the profile index from %s" % self._path)
+      self._entries = dict()
+
+class ModelCache(CacheStats):
+  """Keeps what ``loader`` returns for a model, keyed by the model's path,
+  mtime and size, so looking it up doesn't have to read the model.
+
+  Least recently used entries are dropped once there are more than
+  ``max_entries``.
+  """
+
+  def __init__(self, loader, max_entries=1024):
+    self._loader = loader
+    self._entries = OrderedDict()
+    self._mutex = threading.Lock()
+
+    self.max_entries = max_entries
+
+  def get(self, path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    with self._mutex:
+      if key in self._entries:
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        self.hits += 1
+        return value
+      self.misses += 1
+
+    value = self._loader(path)
+    with self._mutex:
+      self._entries[key] = value
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+    return value
+
+  def invalidate(self):
+    with self._mutex:
+      self._entries.clear()
+
+  def get_stats(self):
+    with self._mutex:
+      return self._lookup_stats(entries=len(self._entries), max_entries=self.max_entries)
@@ -0,0 +1,270 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import io
+import json
+import logging
+import os
+import re
+import threading
+
+# settings passed as command line flags instead of through a config file,
+# more than that aren't worth keeping the command line short for
+MAX_CONFIG_FLAGS = 8
+MAX_CONFIG_FLAG_LENGTH = 256
+
+regex_config_key = re.compile(r"^[a-z][a-z0-9_]*$")
+
+def config_flag(key):
+  """The command line flag for setting ``key``, e.g. ``--layer-height``."""
+  return "--" + key.replace("_", "-")
+
+class EngineFlavors(object):
+  SLIC3R = "slic3r"
+  PRUSASLICER = "prusaslicer"
+
+class EngineCapabilities(object):
+  """Describes what the configured slicer executable can do.
+
+  Built once from the output of ``<engine> --help`` and then reused for every
+  slicing job, so that ``do_slice`` never has to spawn the engine just to find
+  out how to talk to it.
+  """
+
+  regex_banner = re.compile(r"^\s*(PrusaSlicer|Slic3r(?:\s*Prusa\s*Edition)?)[-\s]+v?([0-9]+(?:\.[0-9]+)*)", flags=re.IGNORECASE)
+  regex_flag = re.compile(r"(?:^|[\s,])(--[a-z][a-z0-9-]*|-[a-zA-Z])(?=[\s,=]|$)", flags=re.MULTILINE)
+
+  def __init__(self, flavor=EngineFlavors.SLIC3R, version=None, banner=None, flags=None):
+    self.flavor = flavor
+    self.version = version
+    self.banner = banner
+    self.flags = sorted(flags) if flags else []
+
+  @classmethod
+  def from_help_text(cls, help_text):
+    banner = None
+    for line in help_text.splitlines():
+      line = line.strip()
+      # PrusaSlicer >= 2.4 may print trace statements before the banner, e.g.
+      # [2022-04-22 21:44:51.396082] [0x75527010] [trace]   Initializing StaticPrintConfigs
+      if not line or line.startswith("[") or "[trace]" in line:
+        continue
+      banner = line
+      break
+
+    flavor = EngineFlavors.SLIC3R
+    version = None
+    if banner is not None:
+      m = cls.regex_banner.match(banner)
+      if m:
+        version = m.group(2)
+        if "prusa" in m.group(1).lower():
+          flavor = EngineFlavors.PRUSASLICER
+
+    flags = set(cls.regex_flag.findall(help_text))
+    return cls(flavor=flavor, version=version, banner=banner, flags=flags)
+
+  @classmethod
+  def from_dict(cls, data):
+    return cls(flavor=data.get("flavor", EngineFlavors.SLIC3R),
+               version=data.get("version"),
+               banner=data.get("banner"),
+               flags=data.get("flags"))
+
+  def to_dict(self):
+    return dict(
+      flavor=self.flavor,
+      version=self.version,
+      banner=self.banner,
+      flags=list(self.flags)
+    )
+
+  @property
+  def version_tuple(self):
+    if not self.version:
+      return ()
+    return tuple(int(part) for part in self.version.split(".") if part.isdigit())
+
+  @property
+  def is_prusaslicer(self):
+    return self.flavor == EngineFlavors.PRUSASLICER and self.version_tuple >= (2,)
+
+  def supports(self, flag):
+    return flag in self.flags
+
+  @property
+  def export_flag(self):
+    """The flag that makes the engine export G-code, None if that's the default."""
+    if not self.is_prusaslicer:
+      return None
+    if self.version_tuple[:2] in ((2, 3), (2, 4)):
+      return "-g"
+    return "--slice"
+
+  @property
+  def center_flag(self):
+    if self.is_prusaslicer:
+      return "--center"
+    return "--print-center"
+
+  @property
+  def streamable_output(self):
+    """Whether the engine writes its output sequentially to the given path.
+
+    PrusaSlicer writes to a temporary file next to the output, post-processes
+    that and then renames it, so it can't write into a pipe.
+    """
+    return self.flavor == EngineFlavors.SLIC3R
+
+  @property
+  def env(self):
+    if self.is_prusaslicer and self.version_tuple >= (2, 3):
+      # trace output is what we derive the slicing progress from
+      return dict(SLIC3R_LOGLEVEL="9")
+    return dict()
+
+  @property
+  def supports_binary_gcode(self):
+    """Whether the engine can write binary G-code (PrusaSlicer 2.7+)."""
+    return self.is_prusaslicer and self.supports("--binary-gcode")
+
+  def get_config_args(self, settings):
+    """Command line flags for ``settings``, None if they can't all be passed
+    that way and have to go into a config file instead.
+
+    PrusaSlicer accepts every setting on the command line (but only lists
+    them in ``--help-fff``), Slic3r lists the ones it accepts in ``--help``.
+    Boolean settings are switches without a value, since it's impossible to
+    tell those from numbers, anything that looks like one is left out, as
+    are multi line and very long values.
+    """
+    if not settings or len(settings) > MAX_CONFIG_FLAGS:
+      return None
+
+    args = []
+    for key in sorted(settings):
+      value = settings[key]
+      if isinstance(value, bool) or not regex_config_key.match(key):
+        return None
+      if isinstance(value, (tuple, list)):
+        value = ",".join(str(item) for item in value)
+      value = str(value)
+      if not value or value.strip().lower() in ("0", "1", "true", "false") or len(value) > MAX_CONFIG_FLAG_LENGTH \
+          or "\n" in value or "\r" in value or "\\" in value:
+        return None
+      flag = config_flag(key)
+      if not self.is_prusaslicer and not self.supports(flag):
+        return None
+      # a single argument, so negative values aren't mistaken for flags
+      args.append("%s=%s" % (flag, value))
+    return args
+
+  def get_args(self, profile_path, posX, posY, machinecode_path, model_path, binary=False, config_args=None):
+    args = []
+    if self.export_flag:
+      args.append(self.export_flag)
+    args += ["--load", profile_path, self.center_flag, "%f,%f" % (posX, posY)]
+    if config_args:
+      # settings on the command line take precedence over loaded ones
+      args += config_args
+    if binary:
+      args.append("--binary-gcode")
+    args += ["-o", machinecode_path, model_path]
+    return args
+
+  @property
+  def supports_batches(self):
+    """Whether several models can be sliced individually in one invocation.
+
+    PrusaSlicer processes each input file on its own unless told to
+    ``--merge`` them. Its output files are named after the inputs when
+    ``--output-filename-format`` can be forced and ``-o`` is a folder.
+    """
+    return self.is_prusaslicer and self.supports("--output-filename-format")
+
+  def get_batch_args(self, profile_path, posX, posY, output_folder, model_paths, binary=False, config_args=None):
+    """Arguments to write ``<output_folder>/<model name>.gcode`` (or ``.bgcode``) for each model."""
+    args = []
+    if self.export_flag:
+      args.append(self.export_flag)
+    args += ["--load", profile_path, self.center_flag, "%f,%f" % (posX, posY)]
+    if config_args:
+      args += config_args
+    if binary:
+      args.append("--binary-gcode")
+    args += ["--output-filename-format", "{input_filename_base}" + (".bgcode" if binary else ".gcode"), "-o", output_folder]
+    args += list(model_paths)
+    return args
+
+  def __repr__(self):
+    return "EngineCapabilities(flavor=%r, version=%r)" % (self.flavor, self.version)
+
+def probe_engine(executable):
+  """Runs ``<executable> --help`` and returns the resulting :class:`EngineCapabilities`."""
+  import subprocess
+
+  help_process = subprocess.Popen((executable, "--help"), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  stdout, stderr = help_process.communicate()
+  help_text = (stdout or b"") + b"\n" + (stderr or b"")
+  return EngineCapabilities.from_help_text(help_text.decode("utf-8", "replace"))
+
+class EngineCapabilitiesCache(object):
+  """Remembers the capabilities per executable, keyed by path, mtime and size.
+
+  If ``path`` is given, the probed records are persisted there as JSON so they
+  survive a restart of OctoPrint.
+  """
+
+  def __init__(self, path=None, probe=probe_engine):
+    self._logger = logging.getLogger(__name__)
+    self._path = path
+    self._probe = probe
+    self._records = dict()
+    self._mutex = threading.RLock()
+    self._load()
+
+  def get(self, executable):
+    key = self._key(executable)
+    if key is None:
+      return None
+
+    with self._mutex:
+      record = self._records.get(executable)
+      if record is not None and record["key"] == key:
+        return EngineCapabilities.from_dict(record["capabilities"])
+
+      capabilities = self._probe(executable)
+      self._logger.info("Detected slicer engine %s at %s" % (capabilities.banner, executable))
+      self._records[executable] = dict(key=key, capabilities=capabilities.to_dict())
+      self._save()
+      return capabilities
+
+  def _key(self, executable):
+    try:
+      stat = os.stat(executable)
+    except OSError:
+      return None
+    return [stat.st_mtime, stat.st_size]
+
+  def _load(self):
+    if not self._path or not os.path.isfile(self._path):
+      return
+    try:
+      with io.open(self._path, "rt", encoding="utf-8") as f:
+        self._records = json.load(f)
+    except Exception:
+      self._logger.exception("Could not load cached engine capabilities from %s" % self._path)
+      self._records = dict()
+
+  def _save(self):
+    if not self._path:
+      return
+    try:
+      data = json.dumps(self._records, indent=2, sort_keys=True)
+      with io.open(self._path, "wt", encoding="utf-8") as f:
+        f.write(data if isinstance(data, type(u"")) else data.decode("utf-8"))
+    except Exception:
+      self._logger.exception("Could not persist engine capabilities to %s" % self._path)
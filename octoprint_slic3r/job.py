@@ -0,0 +1,101 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import threading
+import time
+
+class SlicingPriorities(object):
+  INTERACTIVE = 0
+  BATCH = 10
+  BACKGROUND = 20
+
+class SlicingJob(object):
+  """State of a single slicing job as it moves through the plugin.
+
+  Jobs are identified by their ``machinecode_path``, just like OctoPrint
+  identifies them when cancelling.
+  """
+
+  def __init__(self, model_path, machinecode_path, profile_path, center, priority=SlicingPriorities.INTERACTIVE,
+               volume=None, overrides=None, on_progress=None, on_progress_args=None, on_progress_kwargs=None):
+    self.model_path = model_path
+    self.machinecode_path = machinecode_path
+    self.profile_path = profile_path
+    self.center = center
+    self.priority = priority
+    # print volume of the printer profile and the model's MeshInfo, if known
+    self.volume = volume
+    self.mesh = None
+    # settings overriding the profile's, passed to the engine as flags in
+    # ``config_args`` if possible
+    self.overrides = overrides
+    self.config_args = None
+
+    self.on_progress = on_progress
+    self.on_progress_args = on_progress_args if on_progress_args is not None else ()
+    self.on_progress_kwargs = on_progress_kwargs if on_progress_kwargs is not None else dict()
+
+    self.created = time.time()
+    # when the job got its slot in the scheduler
+    self.started = None
+    self.cancelled = False
+    self.metrics = dict()
+
+    # jobs with the same batch key may be sliced by one engine invocation,
+    # ``batch`` is the job whose thread does that
+    self.cache_key = None
+    # shared by all positions of the model, None if results can't be moved
+    self.placement_key = None
+    self.batch_key = None
+    self.batch = None
+    self.result = None
+    self._done = threading.Event()
+
+  @property
+  def id(self):
+    return self.machinecode_path
+
+  @property
+  def binary(self):
+    """Whether binary G-code was asked for by naming the output ``*.bgcode``."""
+    return self.machinecode_path.lower().endswith(".bgcode")
+
+  def report_progress(self, progress):
+    if self.on_progress is None:
+      return
+    self.on_progress_kwargs["_progress"] = progress
+    self.on_progress(*self.on_progress_args, **self.on_progress_kwargs)
+
+  def report_queue_position(self, position):
+    """Reports the position in the slicing queue through the progress callback.
+
+    OctoPrint's own progress callbacks only know ``_progress``, so the position
+    is only passed to callers that asked for it by including a
+    ``_queue_position`` keyword argument in ``on_progress_kwargs``.
+    """
+    if self.on_progress is None or "_queue_position" not in self.on_progress_kwargs:
+      return
+    self.on_progress_kwargs["_queue_position"] = position
+    self.report_progress(self.on_progress_kwargs.get("_progress", 0))
+
+  def finish(self, result):
+    """Hands the result of a job sliced as part of a batch to the job's thread.
+
+    ``result`` is either the ``do_slice`` return value or an exception to raise.
+    """
+    self.result = result
+    self._done.set()
+
+  def wait(self, timeout=None):
+    self._done.wait(timeout)
+    return self._done.is_set()
+
+  @property
+  def done(self):
+    return self._done.is_set()
+
+  def __repr__(self):
+    return "SlicingJob(%r -> %r)" % (self.model_path, self.machinecode_path)
@@ -0,0 +1,115 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import os
+import signal
+import threading
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+def _which(executable):
+  for folder in os.environ.get("PATH", "").split(os.pathsep):
+    path = os.path.join(folder, executable)
+    if os.path.isfile(path) and os.access(path, os.X_OK):
+      return path
+  return None
+
+class ResourceLimits(object):
+  """Limits the slicer process is run under, so it can't take the host down.
+
+  ``memory`` caps the address space in bytes, ``reserve_cpu`` keeps the
+  engine off one CPU core, ``nice`` lowers its CPU priority, ``io_idle`` only
+  lets it do I/O when nothing else does and ``timeout`` is the number of
+  seconds after which it's killed. Limits the platform doesn't support are
+  skipped.
+  """
+
+  def __init__(self, memory=None, reserve_cpu=False, nice=None, io_idle=False, timeout=None):
+    self.memory = memory or None
+    self.reserve_cpu = reserve_cpu
+    self.nice = nice or None
+    self.io_idle = io_idle
+    self.timeout = timeout or None
+
+  @property
+  def cpus(self):
+    if not self.reserve_cpu or not hasattr(os, "sched_getaffinity"):
+      return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < 2:
+      return None
+    # OctoPrint's own threads are free to use every core, the slicer leaves the first one alone
+    return set(cpus[1:])
+
+  def wrap_args(self, args):
+    if self.io_idle and os.name != "nt":
+      ionice = _which("ionice")
+      if ionice is not None:
+        # ionice execs the command, so it keeps the pid we track
+        return [ionice, "-c", "3"] + list(args)
+    return args
+
+  def apply(self, pid):
+    """Applies the limits to the freshly started process ``pid``.
+
+    Done from the outside instead of between fork and exec, which isn't safe
+    in a process running as many threads as OctoPrint. The engine spends its
+    first moments loading, so it's limited long before it gets large. Limits
+    the platform doesn't support are skipped, as is a process that's gone.
+    """
+    if os.name == "nt":
+      return
+    try:
+      if self.memory is not None and hasattr(resource, "prlimit"):
+        resource.prlimit(pid, resource.RLIMIT_AS, (self.memory, self.memory))
+      if self.nice is not None and hasattr(os, "setpriority"):
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + self.nice)
+      cpus = self.cpus
+      if cpus is not None:
+        os.sched_setaffinity(pid, cpus)
+    except (OSError, ValueError):
+      # the engine already exited
+      pass
+
+  def describe_failure(self, returncode, last_error):
+    """Explains a failed run with the limits, None if they're likely not the cause."""
+    if self.memory is None:
+      return None
+    error = (last_error or "").lower()
+    killed = returncode is not None and returncode < 0 and -returncode in (signal.SIGKILL, signal.SIGSEGV, signal.SIGABRT)
+    if killed or any(hint in error for hint in ("bad_alloc", "memory", "failed to map")):
+      return "Slicer ran out of memory, it's limited to %d MB" % (self.memory // (1024 * 1024))
+    return None
+
+  def __repr__(self):
+    return "ResourceLimits(memory=%r, reserve_cpu=%r, nice=%r, io_idle=%r, timeout=%r)" % (self.memory, self.reserve_cpu, self.nice, self.io_idle, self.timeout)
+
+class ProcessTimeout(object):
+  """Kills ``process`` if it's still running after ``timeout`` seconds."""
+
+  def __init__(self, process, timeout):
+    self.expired = False
+    self._process = process
+    self._timer = None
+    if timeout:
+      self._timer = threading.Timer(timeout, self._expire)
+      self._timer.daemon = True
+      self._timer.start()
+
+  def cancel(self):
+    if self._timer is not None:
+      self._timer.cancel()
+
+  def _expire(self):
+    if self._process.returncode is None:
+      self.expired = True
+      try:
+        self._process.kill()
+      except OSError:
+        pass
@@ -0,0 +1,242 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import gzip
+import logging
+import logging.handlers
+import os
+import re
+import shutil
+import threading
+import time
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+# The engine's output is logged line by line, at PrusaSlicer's trace level
+# that's hundreds of thousands of lines per job. Records are only created if
+# the level is enabled, are handed to a queue without formatting them and
+# are formatted and written by a listener thread, so the slicing threads
+# never wait for the disk.
+
+# attributes of records of a job's engine output, passed via ``extra``
+JOB_ATTRIBUTE = "slic3r_job"
+JOB_ONLY_ATTRIBUTE = "slic3r_job_only"
+JOB_END_ATTRIBUTE = "slic3r_job_end"
+
+regex_unsafe = re.compile(r"[^A-Za-z0-9._-]+")
+
+def is_trace_line(line):
+  # PrusaSlicer: "[2022-04-22 21:44:51.396082] [0x75527010] [trace]   ..."
+  if isinstance(line, bytes):
+    return b"[trace]" in line[:64]
+  return "[trace]" in line[:64]
+
+class LazyQueueHandler(logging.Handler):
+  """Puts records on a bounded queue as they are, for a QueueListener.
+
+  Unlike ``logging.handlers.QueueHandler`` the message isn't formatted
+  before, so arguments have to be immutable (strings, numbers). Records
+  that don't fit into the queue are counted in ``dropped`` and discarded
+  instead of blocking the caller.
+  """
+
+  def __init__(self, record_queue):
+    logging.Handler.__init__(self)
+    self.queue = record_queue
+    self.dropped = 0
+
+  def emit(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+class JobFilter(logging.Filter):
+  """Keeps records meant for per-job log files only out of a handler."""
+
+  def filter(self, record):
+    return not getattr(record, JOB_ONLY_ATTRIBUTE, False)
+
+class JobLogHandler(logging.Handler):
+  """Writes the records of each job to its own file in ``folder``.
+
+  Files stop growing at ``max_size`` bytes, are compressed with gzip once
+  the job is done and only the latest ``max_files`` are kept. Meant to run
+  in the listener thread, compression happens there as well.
+  """
+
+  def __init__(self, folder, max_size=10 * 1024 * 1024, max_files=50):
+    logging.Handler.__init__(self)
+    self.folder = folder
+    self.max_size = max_size
+    self.max_files = max_files
+    self._files = dict()
+
+  def emit(self, record):
+    name = getattr(record, JOB_ATTRIBUTE, None)
+    if name is None:
+      return
+    try:
+      if getattr(record, JOB_END_ATTRIBUTE, False):
+        self._finish(name)
+        return
+
+      entry = self._files.get(name)
+      if entry is None:
+        if not os.path.isdir(self.folder):
+          os.makedirs(self.folder)
+        entry = self._files[name] = dict(file=open(os.path.join(self.folder, name), "ab"), size=0, truncated=False)
+      if entry["truncated"]:
+        return
+      data = (self.format(record) + "\n").encode("utf-8", "replace")
+      if entry["size"] + len(data) > self.max_size:
+        data = ("... log truncated at %d bytes\n" % self.max_size).encode("utf-8")
+        entry["truncated"] = True
+      entry["file"].write(data)
+      entry["size"] += len(data)
+    except Exception:
+      self.handleError(record)
+
+  def close(self):
+    for name in list(self._files.keys()):
+      self._finish(name)
+    logging.Handler.close(self)
+
+  def _finish(self, name):
+    entry = self._files.pop(name, None)
+    if entry is None:
+      return
+    entry["file"].close()
+    path = os.path.join(self.folder, name)
+    with open(path, "rb") as source:
+      with gzip.open(path + ".gz", "wb") as destination:
+        shutil.copyfileobj(source, destination)
+    os.remove(path)
+    self._prune()
+
+  def _prune(self):
+    names = sorted(name for name in os.listdir(self.folder) if name.endswith(".log.gz"))
+    for name in names[:-self.max_files] if self.max_files else []:
+      os.remove(os.path.join(self.folder, name))
+
+class TraceSampler(object):
+  """Lets through at most ``rate`` lines per second, in bursts of ``burst``.
+
+  A token bucket shared by all jobs, the number of lines that weren't let
+  through is reported by :meth:`take_suppressed`.
+  """
+
+  def __init__(self, rate, burst=None):
+    self.rate = rate
+    self.burst = burst if burst is not None else max(1, rate)
+    self._tokens = float(self.burst)
+    self._last = time.time()
+    self._suppressed = 0
+    self._mutex = threading.Lock()
+
+  def allow(self):
+    with self._mutex:
+      now = time.time()
+      self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+      self._last = now
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return True
+      self._suppressed += 1
+      return False
+
+  def take_suppressed(self):
+    with self._mutex:
+      suppressed, self._suppressed = self._suppressed, 0
+      return suppressed
+
+class EngineLogPipeline(object):
+  """Moves writing ``logger``'s records to ``handlers`` into a background thread.
+
+  Falls back to attaching the handlers directly where the standard library
+  has no QueueListener (Python 2).
+  """
+
+  def __init__(self, logger, handlers, max_queued=100000):
+    self.logger = logger
+    self.handlers = handlers
+    self._listener = None
+    self._queue_handler = None
+
+    listener_class = getattr(logging.handlers, "QueueListener", None)
+    if listener_class is None:
+      for handler in handlers:
+        logger.addHandler(handler)
+      return
+
+    record_queue = queue.Queue(maxsize=max_queued)
+    self._queue_handler = LazyQueueHandler(record_queue)
+    self._listener = listener_class(record_queue, *handlers, respect_handler_level=True)
+    logger.addHandler(self._queue_handler)
+    self._listener.start()
+
+  @property
+  def dropped(self):
+    return self._queue_handler.dropped if self._queue_handler is not None else 0
+
+  def stop(self):
+    """Writes what's still queued and stops the listener."""
+    if self._listener is not None:
+      self.logger.removeHandler(self._queue_handler)
+      self._listener.stop()
+      self._listener = None
+    for handler in self.handlers:
+      handler.close()
+
+class EngineOutputLog(object):
+  """Logs one job's engine output to ``logger`` at debug level.
+
+  Does nothing unless debug logging is enabled. If ``name`` is set, every
+  line also goes to the job's own log file (see :class:`JobLogHandler`),
+  while trace lines the ``sampler`` doesn't let through only go there.
+  """
+
+  def __init__(self, logger, name=None, sampler=None):
+    self.logger = logger
+    self.name = name
+    self.sampler = sampler
+    self.enabled = logger.isEnabledFor(logging.DEBUG)
+    self._extra = {JOB_ATTRIBUTE: name} if name is not None else None
+    self._job_only = {JOB_ATTRIBUTE: name, JOB_ONLY_ATTRIBUTE: True} if name is not None else None
+
+  @classmethod
+  def make_name(cls, model_path):
+    """A unique file name for the log of a job slicing ``model_path``."""
+    base = regex_unsafe.sub("_", os.path.splitext(os.path.basename(model_path))[0])[:64]
+    return "%s_%06d_%s.log" % (time.strftime("%Y%m%d-%H%M%S"), int(time.time() * 1000000) % 1000000, base)
+
+  def stdout(self, line):
+    self._log("stdout: %s", line)
+
+  def stderr(self, line):
+    self._log("stderr: %s", line)
+
+  def close(self):
+    if not self.enabled:
+      return
+    if self.sampler is not None:
+      suppressed = self.sampler.take_suppressed()
+      if suppressed:
+        self.logger.debug("%d trace lines were left out of this log to keep up", suppressed)
+    if self.name is not None:
+      self.logger.debug("end of job log", extra={JOB_ATTRIBUTE: self.name, JOB_ONLY_ATTRIBUTE: True, JOB_END_ATTRIBUTE: True})
+
+  def _log(self, message, line):
+    if not self.enabled:
+      return
+    if self.sampler is not None and is_trace_line(line) and not self.sampler.allow():
+      if self._job_only is not None:
+        self.logger.debug(message, line, extra=self._job_only)
+      return
+    self.logger.debug(message, line, extra=self._extra)
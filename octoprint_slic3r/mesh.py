@@ -0,0 +1,279 @@
+# coding=utf-8
+from __future__ import absolute_import, division
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import math
+import mmap
+import os
+import re
+import struct
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+STL_HEADER_SIZE = 80
+STL_TRIANGLE_SIZE = 50
+
+# the nine vertex coordinates of a binary STL triangle record
+struct_triangle = struct.Struct("<12x9f2x")
+
+regex_vertex = re.compile(br"^\s*vertex\s+(\S+)\s+(\S+)\s+(\S+)", flags=re.MULTILINE)
+
+# the coordinates of a vertex, for parsing all of them in one go
+regex_vertex_line = re.compile(br"vertex([^\r\n]*)")
+
+if numpy is not None:
+  stl_dtype = numpy.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+
+# triangles processed at once, keeps the float64 temporaries small and in
+# the CPU caches
+CHUNK_SIZE = 64 * 1024
+
+# models this much larger than the print volume are still accepted, the
+# engine rounds as well
+FIT_TOLERANCE = 0.01
+
+class MeshInfo(object):
+  """Bounding box, triangle count and volume of a model."""
+
+  def __init__(self, minimum, maximum, triangles, volume):
+    self.min = tuple(minimum)
+    self.max = tuple(maximum)
+    self.triangles = triangles
+    self.volume = volume
+
+  @property
+  def size(self):
+    return tuple(high - low for low, high in zip(self.min, self.max))
+
+  @property
+  def height(self):
+    return self.max[2] - self.min[2]
+
+  def to_dict(self):
+    return dict(min=list(self.min), max=list(self.max), size=list(self.size), triangles=self.triangles, volume=self.volume)
+
+  def __repr__(self):
+    return "MeshInfo(size=%r, triangles=%d, volume=%.1f)" % (self.size, self.triangles, self.volume)
+
+def _is_binary_stl(path, size):
+  if size < STL_HEADER_SIZE + 4:
+    return False
+  with open(path, "rb") as f:
+    header = f.read(STL_HEADER_SIZE + 4)
+  count, = struct.unpack("<I", header[STL_HEADER_SIZE:])
+  # some exporters write "solid" into the header of binary files as well, so
+  # trust the triangle count if it matches the file size
+  return size == STL_HEADER_SIZE + 4 + count * STL_TRIANGLE_SIZE or not header.lstrip().startswith(b"solid")
+
+def inspect_model(path):
+  """Returns the :class:`MeshInfo` of the STL file at ``path``.
+
+  Returns None for other formats and for files without any triangles. Uses
+  NumPy on memory mapped data if it's installed, plain Python otherwise.
+  """
+  if not path.lower().endswith(".stl"):
+    return None
+
+  size = os.path.getsize(path)
+  if _is_binary_stl(path, size):
+    count = (size - STL_HEADER_SIZE - 4) // STL_TRIANGLE_SIZE
+    if count <= 0:
+      return None
+    if numpy is not None:
+      return _inspect_binary_numpy(path, count)
+    return _inspect_binary(path, count)
+
+  if size == 0:
+    return None
+  with open(path, "rb") as f:
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      if numpy is not None:
+        return _inspect_ascii_numpy(data)
+      return _inspect_ascii(data)
+    finally:
+      data.close()
+
+def get_bed_bounds(volume):
+  """Returns ``((min_x, max_x), (min_y, max_y), height, radius)`` of the print volume.
+
+  ``volume`` is the ``volume`` of an OctoPrint printer profile. ``radius``
+  is None unless the bed is circular, circular beds are centered around
+  the origin.
+  """
+  form_factor = volume.get("formFactor", "rectangular")
+  origin = volume.get("origin", "lowerleft")
+  width = float(volume.get("width", 0))
+  depth = float(volume.get("depth", 0))
+  height = float(volume.get("height", 0))
+
+  custom_box = volume.get("custom_box")
+  if isinstance(custom_box, dict):
+    return ((float(custom_box["x_min"]), float(custom_box["x_max"])),
+            (float(custom_box["y_min"]), float(custom_box["y_max"])),
+            float(custom_box["z_max"]) - float(custom_box["z_min"]),
+            None)
+  if origin == "center" or form_factor == "circular":
+    bounds = (-width / 2.0, width / 2.0), (-depth / 2.0, depth / 2.0)
+  else:
+    bounds = (0.0, width), (0.0, depth)
+  return bounds[0], bounds[1], height, width / 2.0 if form_factor == "circular" else None
+
+def get_fit_error(mesh, volume, center):
+  """Checks whether ``mesh`` fits the print volume once centered around ``center``.
+
+  ``volume`` is the ``volume`` of an OctoPrint printer profile. Returns a
+  message explaining why the model doesn't fit, None if it (possibly) does.
+  Circular beds are only checked for models that can't fit no matter their
+  shape.
+  """
+  size_x, size_y, size_z = mesh.size
+  x, y = center
+  (min_x, max_x), (min_y, max_y), height, radius = get_bed_bounds(volume)
+
+  dimensions = "%.1f x %.1f x %.1f mm" % (size_x, size_y, size_z)
+  if height > 0 and size_z > height + FIT_TOLERANCE:
+    return "Model is too tall for the printer: %s, the print volume is %.1f mm high" % (dimensions, height)
+
+  if radius is not None:
+    if radius <= 0:
+      return None
+    if max(size_x, size_y) > 2 * radius + FIT_TOLERANCE:
+      return "Model doesn't fit on the bed: %s, the bed is %.1f mm in diameter" % (dimensions, 2 * radius)
+    # every edge of the bounding box touches the model, if one of them lies
+    # entirely outside the bed, so does part of the model
+    left, right = x - size_x / 2.0, x + size_x / 2.0
+    front, back = y - size_y / 2.0, y + size_y / 2.0
+    for edge_x, edge_y in (((left, left), (front, back)), ((right, right), (front, back)),
+                           ((left, right), (front, front)), ((left, right), (back, back))):
+      nearest_x = min(max(0.0, edge_x[0]), edge_x[1])
+      nearest_y = min(max(0.0, edge_y[0]), edge_y[1])
+      if math.hypot(nearest_x, nearest_y) > radius + FIT_TOLERANCE:
+        return "Model doesn't fit on the bed at X%.1f Y%.1f: %s, the bed is %.1f mm in diameter" % (x, y, dimensions, 2 * radius)
+    return None
+
+  if max_x <= min_x or max_y <= min_y:
+    return None
+  if size_x > max_x - min_x + FIT_TOLERANCE or size_y > max_y - min_y + FIT_TOLERANCE:
+    return "Model doesn't fit on the bed: %s, the bed is %.1f x %.1f mm" % (dimensions, max_x - min_x, max_y - min_y)
+  if x - size_x / 2.0 < min_x - FIT_TOLERANCE or x + size_x / 2.0 > max_x + FIT_TOLERANCE \
+      or y - size_y / 2.0 < min_y - FIT_TOLERANCE or y + size_y / 2.0 > max_y + FIT_TOLERANCE:
+    return "Model doesn't fit on the bed at X%.1f Y%.1f: %s" % (x, y, dimensions)
+  return None
+
+def _signed_volume(v0, v1, v2):
+  # sum of the signed volumes of the tetrahedra spanned by the origin and each triangle
+  return (v0[0] * (v1[1] * v2[2] - v1[2] * v2[1])
+          - v0[1] * (v1[0] * v2[2] - v1[2] * v2[0])
+          + v0[2] * (v1[0] * v2[1] - v1[1] * v2[0])) / 6.0
+
+def _numpy_volume(coordinates):
+  # ``coordinates`` has one row per vertex coordinate (x0, y0, z0, x1, ...), one column per triangle
+  ax, ay, az, bx, by, bz, cx, cy, cz = coordinates
+  return float((ax * (by * cz - bz * cy) - ay * (bx * cz - bz * cx) + az * (bx * cy - by * cx)).sum()) / 6.0
+
+def _inspect_binary_numpy(path, count):
+  triangles = numpy.memmap(path, dtype=stl_dtype, mode="r", offset=STL_HEADER_SIZE + 4, shape=(count,))
+  try:
+    lows = []
+    highs = []
+    volume = 0.0
+    for start in range(0, count, CHUNK_SIZE):
+      # reductions along contiguous rows are a lot faster than across the
+      # interleaved records
+      coordinates = numpy.array(triangles["vertices"][start:start + CHUNK_SIZE].reshape(-1, 9).T, dtype=numpy.float64)
+      lows.append(coordinates.min(axis=1))
+      highs.append(coordinates.max(axis=1))
+      volume += _numpy_volume(coordinates)
+    low = numpy.min(lows, axis=0).reshape(3, 3).min(axis=0)
+    high = numpy.max(highs, axis=0).reshape(3, 3).max(axis=0)
+    return MeshInfo(low.tolist(), high.tolist(), count, abs(volume))
+  finally:
+    del triangles
+
+def _inspect_binary(path, count):
+  lows = []
+  highs = []
+  volume = 0.0
+  unpack = struct_triangle.unpack_from
+  with open(path, "rb") as f:
+    f.seek(STL_HEADER_SIZE + 4)
+    remaining = count
+    while remaining > 0:
+      chunk = min(remaining, CHUNK_SIZE)
+      data = f.read(chunk * STL_TRIANGLE_SIZE)
+      if len(data) < STL_TRIANGLE_SIZE:
+        break
+      chunk = len(data) // STL_TRIANGLE_SIZE
+      triangles = [unpack(data, offset) for offset in range(0, chunk * STL_TRIANGLE_SIZE, STL_TRIANGLE_SIZE)]
+      # one tuple per vertex coordinate, min and max of those run at C speed
+      columns = list(zip(*triangles))
+      lows.append([min(column) for column in columns])
+      highs.append([max(column) for column in columns])
+      volume += sum(ax * (by * cz - bz * cy) - ay * (bx * cz - bz * cx) + az * (bx * cy - by * cx)
+                    for ax, ay, az, bx, by, bz, cx, cy, cz in triangles) / 6.0
+      remaining -= chunk
+  if not lows:
+    return None
+  low = [min(values[i] for values in lows for i in (axis, axis + 3, axis + 6)) for axis in range(3)]
+  high = [max(values[i] for values in highs for i in (axis, axis + 3, axis + 6)) for axis in range(3)]
+  return MeshInfo(low, high, count - remaining, abs(volume))
+
+def read_ascii_triangles(data):
+  """Returns the triangles of ASCII STL ``data`` as lists of three ``(x, y, z)``.
+
+  Every three vertices make a triangle. Triangles with a malformed number
+  are skipped, as is an incomplete one at the end.
+  """
+  vertices = regex_vertex.findall(data)
+  triangles = []
+  for start in range(0, len(vertices) - 2, 3):
+    try:
+      triangles.append([tuple(float(value) for value in vertex) for vertex in vertices[start:start + 3]])
+    except ValueError:
+      continue
+  return triangles
+
+def read_ascii_triangles_numpy(data, dtype=None):
+  """Like :func:`read_ascii_triangles`, as an array of shape ``(triangles, 3, 3)``."""
+  dtype = dtype or numpy.float64
+  lines = regex_vertex_line.findall(data)
+  count = len(lines) // 3
+  try:
+    vertices = numpy.array(b" ".join(lines[:count * 3]).split(), dtype=dtype)
+  except ValueError:
+    vertices = None
+  if vertices is None or vertices.size != count * 9:
+    # malformed numbers, leave it to the slow path to skip them
+    return numpy.array(read_ascii_triangles(data), dtype=dtype).reshape(-1, 3, 3)
+  return vertices.reshape(count, 3, 3)
+
+def _inspect_ascii_numpy(data):
+  triangles = read_ascii_triangles_numpy(data)
+  if not len(triangles):
+    return None
+  vertices = triangles.reshape(-1, 3)
+  volume = _numpy_volume(triangles.reshape(-1, 9).T)
+  return MeshInfo(vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist(), len(triangles), abs(volume))
+
+def _inspect_ascii(data):
+  low = [float("inf")] * 3
+  high = [float("-inf")] * 3
+  volume = 0.0
+  triangles = read_ascii_triangles(data)
+  for triangle in triangles:
+    for vertex in triangle:
+      for axis in range(3):
+        if vertex[axis] < low[axis]:
+          low[axis] = vertex[axis]
+        if vertex[axis] > high[axis]:
+          high[axis] = vertex[axis]
+    volume += _signed_volume(*triangle)
+  if not triangles:
+    return None
+  return MeshInfo(low, high, len(triangles), abs(volume))
@@ -0,0 +1,133 @@
+# coding=utf-8
+from __future__ import absolute_import, division
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import threading
+import time
+from collections import deque
+
+class JobResults(object):
+  SUCCESS = "success"
+  FAILED = "failed"
+  CANCELLED = "cancelled"
+  CACHED = "cached"
+  TRANSLATED = "translated"
+
+# key in the job's metrics, metric name, help text
+METRICS = (
+  ("queue_wait", "slic3r_job_queue_wait_seconds", "Time spent waiting for a free slicing slot"),
+  ("probe", "slic3r_job_probe_seconds", "Time spent determining the engine's capabilities"),
+  ("inspect", "slic3r_job_inspect_seconds", "Time spent inspecting the model before slicing"),
+  ("spawn", "slic3r_job_spawn_seconds", "Time it took to start the engine process"),
+  ("wall", "slic3r_job_wall_seconds", "Wall clock time of the engine process"),
+  ("cpu", "slic3r_job_cpu_seconds", "CPU time (user and system) used by the engine process"),
+  ("peak_rss", "slic3r_job_peak_rss_bytes", "Peak resident set size of the engine process"),
+  ("output_size", "slic3r_job_output_bytes", "Size of the produced G-code"),
+  ("copied", "slic3r_job_copied_bytes", "Bytes copied while moving the G-code to its destination"),
+  ("translate", "slic3r_job_translate_seconds", "Time spent moving a cached result to the requested position"),
+  ("upload", "slic3r_job_upload_seconds", "Time spent sending the model and profile to a slicing worker"),
+  ("download", "slic3r_job_download_seconds", "Time spent fetching the G-code from a slicing worker"),
+  ("analysis", "slic3r_job_analysis_seconds", "Time spent extracting the analysis from the G-code"),
+  ("total", "slic3r_job_duration_seconds", "Total time spent in do_slice"),
+)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+def _quantile(values, q):
+  if not values:
+    return None
+  values = sorted(values)
+  index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+  return values[index]
+
+class SlicingMetrics(object):
+  """Keeps the metrics of the last ``size`` slicing jobs.
+
+  Counters and sums cover all jobs since startup, quantiles and the records
+  themselves only the jobs still in the ring buffer.
+  """
+
+  def __init__(self, size=200):
+    self._records = deque(maxlen=size)
+    self._mutex = threading.Lock()
+    self._results = dict()
+    self._sums = dict()
+    self._counts = dict()
+
+  def record(self, metrics, result):
+    record = dict(metrics)
+    record["result"] = result
+    record.setdefault("finished", time.time())
+
+    with self._mutex:
+      self._records.append(record)
+      self._results[result] = self._results.get(result, 0) + 1
+      for key, _, _ in METRICS:
+        value = record.get(key)
+        if value is None:
+          continue
+        self._sums[key] = self._sums.get(key, 0) + value
+        self._counts[key] = self._counts.get(key, 0) + 1
+    return record
+
+  def get_records(self):
+    with self._mutex:
+      return [dict(record) for record in self._records]
+
+  def get_summary(self):
+    with self._mutex:
+      records = list(self._records)
+      results = dict(self._results)
+
+    summary = dict()
+    for key, _, _ in METRICS:
+      values = [record[key] for record in records if record.get(key) is not None]
+      if not values:
+        continue
+      summary[key] = dict(count=len(values),
+                          mean=sum(values) / len(values),
+                          max=max(values),
+                          **dict(("p%d" % int(q * 100), _quantile(values, q)) for q in QUANTILES))
+    return dict(jobs=results, recent=summary)
+
+  def to_prometheus(self, gauges=None):
+    """Renders the metrics in Prometheus' text exposition format.
+
+    ``gauges`` may contain additional ``name: (help, value)`` pairs.
+    """
+    with self._mutex:
+      records = list(self._records)
+      results = dict(self._results)
+      sums = dict(self._sums)
+      counts = dict(self._counts)
+
+    lines = ["# HELP slic3r_jobs_total Slicing jobs handled since startup",
+             "# TYPE slic3r_jobs_total counter"]
+    for result in sorted(set(results) | set((JobResults.SUCCESS, JobResults.FAILED))):
+      lines.append('slic3r_jobs_total{result="%s"} %d' % (result, results.get(result, 0)))
+
+    for key, name, help_text in METRICS:
+      values = [record[key] for record in records if record.get(key) is not None]
+      lines.append("# HELP %s %s" % (name, help_text))
+      lines.append("# TYPE %s summary" % name)
+      for q in QUANTILES:
+        value = _quantile(values, q)
+        lines.append('%s{quantile="%s"} %s' % (name, q, _format(value)))
+      lines.append("%s_sum %s" % (name, _format(sums.get(key, 0))))
+      lines.append("%s_count %d" % (name, counts.get(key, 0)))
+
+    for name, (help_text, value) in sorted((gauges or dict()).items()):
+      lines.append("# HELP %s %s" % (name, help_text))
+      lines.append("# TYPE %s gauge" % name)
+      lines.append("%s %s" % (name, _format(value)))
+
+    return "\n".join(lines) + "\n"
+
+def _format(value):
+  if value is None:
+    return "NaN"
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
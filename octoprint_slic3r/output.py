@@ -0,0 +1,105 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import os
+import shutil
+import tempfile
+import threading
+
+from .analysis import TAIL_SIZES, get_analysis_from_tail
+
+class FifoTee(object):
+  """Lets the slicer write its output into a named pipe and streams it on to
+  ``machinecode_path``, keeping the tail of the stream around so that the
+  analysis can be extracted without reading the file back from disk. Pass
+  a staging path, the stream is incomplete if the slicer fails.
+
+  Only works for engines that write their output sequentially to the path they
+  were given. If the engine replaces the pipe with a regular file instead, the
+  file is moved to the destination when the tee is finished.
+  """
+
+  chunk_size = 64 * 1024
+
+  @classmethod
+  def is_supported(cls):
+    return hasattr(os, "mkfifo")
+
+  def __init__(self, machinecode_path, tail_size=TAIL_SIZES[-1]):
+    self.machinecode_path = machinecode_path
+    self.tail_size = tail_size
+    self.bytes_streamed = 0
+    self.analysis = None
+
+    self._folder = tempfile.mkdtemp(prefix=".slic3r-", dir=os.path.dirname(os.path.abspath(machinecode_path)))
+    self.path = os.path.join(self._folder, os.path.basename(machinecode_path))
+    os.mkfifo(self.path)
+
+    # The reader needs to exist before we can keep a writer open. The extra
+    # writer makes sure our reader doesn't see an EOF before the slicer even
+    # opened the pipe, it's closed once the slicer process is done.
+    import fcntl
+    self._read_fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+    self._keepalive_fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+    flags = fcntl.fcntl(self._read_fd, fcntl.F_GETFL)
+    fcntl.fcntl(self._read_fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+    self._tail = bytearray()
+    self._error = None
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+
+  def start(self):
+    self._thread.start()
+    return self
+
+  def finish(self):
+    """Waits for the stream to end after the slicer exited and cleans up.
+
+    Returns the analysis found in the streamed data, None if there was none.
+    """
+    self._close_keepalive()
+    self._thread.join()
+    try:
+      if self._error is not None:
+        raise self._error
+
+      if not self.bytes_streamed and os.path.isfile(self.path):
+        # the engine didn't write into our pipe but replaced it
+        shutil.move(self.path, self.machinecode_path)
+        return None
+
+      self.analysis = get_analysis_from_tail(self._tail, truncated=self.bytes_streamed > len(self._tail))
+      return self.analysis
+    finally:
+      shutil.rmtree(self._folder, ignore_errors=True)
+
+  def abort(self):
+    self._close_keepalive()
+    self._thread.join()
+    shutil.rmtree(self._folder, ignore_errors=True)
+
+  def _close_keepalive(self):
+    if self._keepalive_fd is not None:
+      os.close(self._keepalive_fd)
+      self._keepalive_fd = None
+
+  def _run(self):
+    try:
+      with os.fdopen(self._read_fd, "rb", 0) as source:
+        with open(self.machinecode_path, "wb") as destination:
+          while True:
+            chunk = source.read(self.chunk_size)
+            if not chunk:
+              break
+            destination.write(chunk)
+            self.bytes_streamed += len(chunk)
+
+            self._tail += chunk
+            if len(self._tail) > 2 * self.tail_size:
+              del self._tail[:len(self._tail) - self.tail_size]
+    except Exception as e:
+      self._error = e
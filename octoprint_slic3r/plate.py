@@ -0,0 +1,262 @@
+# coding=utf-8
+from __future__ import absolute_import, division
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import math
+import mmap
+import os
+import struct
+
+from .mesh import STL_HEADER_SIZE, STL_TRIANGLE_SIZE, FIT_TOLERANCE, _is_binary_stl, get_bed_bounds, numpy, read_ascii_triangles
+
+if numpy is not None:
+  from .mesh import read_ascii_triangles_numpy, stl_dtype
+
+# Several models are sliced as one print by packing their footprints onto
+# the bed, moving each model's triangles to its place and writing them all
+# into one STL, which is then sliced like any other model. The engine sees
+# a single object, so nothing depends on it supporting multiple objects or
+# keeping their positions.
+
+# a binary STL triangle record: normal, three vertices, attributes
+struct_record = struct.Struct("<12f2x")
+
+class PlateError(Exception):
+  pass
+
+class Plate(object):
+  """Where each model of a plate goes.
+
+  ``positions`` are the centers of the models' footprints on the bed,
+  ``cells`` the areas ``(min_x, min_y, max_x, max_y)`` reserved for them,
+  including half the spacing around each. ``center`` is the center of
+  the bounding box of all models, which is where the engine has to
+  center the combined model.
+  """
+
+  def __init__(self, meshes, positions, cells, spacing):
+    self.meshes = meshes
+    self.positions = positions
+    self.cells = cells
+    self.spacing = spacing
+
+    half = spacing / 2.0
+    min_x = min(cell[0] for cell in cells) + half
+    min_y = min(cell[1] for cell in cells) + half
+    max_x = max(cell[2] for cell in cells) - half
+    max_y = max(cell[3] for cell in cells) - half
+    self.center = ((min_x + max_x) / 2.0, (min_y + max_y) / 2.0)
+    self.size = (max_x - min_x, max_y - min_y)
+
+  def get_offset(self, index):
+    """The translation moving model ``index`` to its place, resting on the bed."""
+    mesh = self.meshes[index]
+    x, y = self.positions[index]
+    return (x - (mesh.min[0] + mesh.max[0]) / 2.0,
+            y - (mesh.min[1] + mesh.max[1]) / 2.0,
+            -mesh.min[2])
+
+  def get_objects(self, analysis=None):
+    """Describes each model on the plate, with its estimated share of ``analysis``.
+
+    The engine slices the plate as one object and only reports totals for
+    it. The per model figures are those totals split in proportion to the
+    models' volumes, so they're named ``estimated_*``.
+    """
+    total = sum(mesh.volume for mesh in self.meshes)
+    objects = []
+    for index, mesh in enumerate(self.meshes):
+      share = mesh.volume / total if total > 0 else 1.0 / len(self.meshes)
+      entry = dict(index=index,
+                   position=dict(x=self.positions[index][0], y=self.positions[index][1]),
+                   size=list(mesh.size),
+                   volume=mesh.volume,
+                   estimated_share=share)
+      if analysis:
+        entry["estimated_analysis"] = _split_analysis(analysis, share)
+      objects.append(entry)
+    return objects
+
+def pack_plate(meshes, volume, spacing=5.0):
+  """Packs the footprints of ``meshes`` (:class:`MeshInfo`) onto the bed.
+
+  ``volume`` is the ``volume`` of an OctoPrint printer profile, circular
+  beds and ``origin: center`` are taken into account. Models keep at least
+  ``spacing`` mm from each other and half of that from the edge of the bed.
+  Returns a :class:`Plate`, raises :class:`PlateError` if they don't all fit.
+  """
+  (min_x, max_x), (min_y, max_y), height, radius = get_bed_bounds(volume)
+  if max_x <= min_x or max_y <= min_y:
+    raise PlateError("The printer profile has no print volume")
+
+  sizes = []
+  for index, mesh in enumerate(meshes):
+    size_x, size_y, size_z = mesh.size
+    if height > 0 and size_z > height + FIT_TOLERANCE:
+      raise PlateError("Model %d is too tall for the printer: %.1f mm" % (index + 1, size_z))
+    sizes.append((size_x + spacing, size_y + spacing))
+
+  if radius is not None:
+    center_x, center_y = (min_x + max_x) / 2.0, (min_y + max_y) / 2.0
+    def get_row_bounds(bottom, top):
+      # the narrowest chord of the circle between bottom and top
+      furthest = max(abs(bottom - center_y), abs(top - center_y))
+      if furthest > radius:
+        return None
+      half_chord = math.sqrt(radius * radius - furthest * furthest)
+      return center_x - half_chord, center_x + half_chord
+    def get_row_start(top, size_x, size_y):
+      # the lowest row at or above top whose chords are all at least size_x long
+      if size_x / 2.0 > radius:
+        return None
+      reach = math.sqrt(radius * radius - size_x * size_x / 4.0)
+      bottom = max(top, center_y - reach)
+      if bottom + size_y > center_y + reach + FIT_TOLERANCE:
+        return None
+      return bottom
+    floor, ceiling = center_y - radius, center_y + radius
+  else:
+    def get_row_bounds(bottom, top):
+      return min_x, max_x
+    def get_row_start(top, size_x, size_y):
+      if top + size_y > max_y + FIT_TOLERANCE or size_x > max_x - min_x + FIT_TOLERANCE:
+        return None
+      return top
+    floor, ceiling = min_y, max_y
+
+  rows = _pack_rows(sizes, floor, get_row_bounds, get_row_start)
+  if rows is None:
+    raise PlateError("The models don't fit on the bed")
+
+  # center the rows vertically if they still fit there, a circle's chords
+  # get shorter towards its edge
+  used = rows[-1][0] + rows[-1][1] - rows[0][0]
+  start = (floor + ceiling - used) / 2.0
+  if start > rows[0][0]:
+    centered = _pack_rows(sizes, start, get_row_bounds, get_row_start)
+    if centered is not None and len(centered) <= len(rows):
+      rows = centered
+
+  positions = [None] * len(meshes)
+  cells = [None] * len(meshes)
+  for bottom, row_height, items in rows:
+    left, right = get_row_bounds(bottom, bottom + row_height)
+    width = sum(sizes[index][0] for index in items)
+    x = left + (right - left - width) / 2.0
+    for index in items:
+      size_x, size_y = sizes[index]
+      cells[index] = (x, bottom, x + size_x, bottom + size_y)
+      positions[index] = (x + size_x / 2.0, bottom + size_y / 2.0)
+      x += size_x
+  return Plate(meshes, positions, cells, spacing)
+
+def _pack_rows(sizes, floor, get_row_bounds, get_row_start):
+  """First fit decreasing height shelf packing.
+
+  ``get_row_start`` returns where a new row holding an item of the given
+  size can start at or above some height, None if there's no room left.
+  Returns a list of rows ``(bottom, height, indices)``, None if not all
+  sizes fit.
+  """
+  order = sorted(range(len(sizes)), key=lambda index: (-sizes[index][1], -sizes[index][0]))
+  rows = []
+  # free width per row
+  free = []
+  top = floor
+  for index in order:
+    size_x, size_y = sizes[index]
+    for row, (bottom, row_height, items) in enumerate(rows):
+      if free[row] >= size_x:
+        items.append(index)
+        free[row] -= size_x
+        break
+    else:
+      bottom = get_row_start(top, size_x, size_y)
+      if bottom is None:
+        return None
+      left, right = get_row_bounds(bottom, bottom + size_y)
+      rows.append((bottom, size_y, [index]))
+      free.append(right - left - size_x)
+      top = bottom + size_y
+  return rows
+
+def _split_analysis(analysis, share):
+  result = dict()
+  if "estimatedPrintTime" in analysis:
+    result["estimatedPrintTime"] = analysis["estimatedPrintTime"] * share
+  if "filament" in analysis:
+    result["filament"] = dict((tool, dict((key, value * share) for key, value in entry.items()))
+                              for tool, entry in analysis["filament"].items())
+  if "filamentCost" in analysis:
+    result["filamentCost"] = analysis["filamentCost"] * share
+  return result
+
+##~~ writing the plate
+
+def write_plate_stl(model_paths, plate, path):
+  """Writes the models moved to their places on ``plate`` into one binary STL at ``path``.
+
+  Triangles of ASCII models are read just like when inspecting them, so
+  malformed ones are skipped here as well.
+  """
+  count = 0
+  with open(path, "wb") as f:
+    f.write(b"OctoPrint-Slic3r plate".ljust(STL_HEADER_SIZE, b" "))
+    f.write(struct.pack("<I", 0))
+    for index, model_path in enumerate(model_paths):
+      offset = plate.get_offset(index)
+      if numpy is not None:
+        count += _write_moved_numpy(model_path, offset, f)
+      else:
+        count += _write_moved(model_path, offset, f)
+    f.seek(STL_HEADER_SIZE)
+    f.write(struct.pack("<I", count))
+
+def _write_moved_numpy(model_path, offset, f):
+  size = os.path.getsize(model_path)
+  shift = numpy.array(offset, dtype=numpy.float32)
+  if _is_binary_stl(model_path, size):
+    count = (size - STL_HEADER_SIZE - 4) // STL_TRIANGLE_SIZE
+    triangles = numpy.array(numpy.memmap(model_path, dtype=stl_dtype, mode="r", offset=STL_HEADER_SIZE + 4, shape=(count,)))
+    triangles["vertices"] += shift
+    triangles.tofile(f)
+    return count
+
+  with open(model_path, "rb") as source:
+    data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      vertices = read_ascii_triangles_numpy(data, dtype=numpy.float32)
+    finally:
+      data.close()
+  triangles = numpy.zeros(len(vertices), dtype=stl_dtype)
+  # slicers compute the normals themselves
+  triangles["vertices"] = vertices + shift
+  triangles.tofile(f)
+  return len(triangles)
+
+def _write_moved(model_path, offset, f):
+  dx, dy, dz = offset
+  size = os.path.getsize(model_path)
+  if _is_binary_stl(model_path, size):
+    count = (size - STL_HEADER_SIZE - 4) // STL_TRIANGLE_SIZE
+    with open(model_path, "rb") as source:
+      source.seek(STL_HEADER_SIZE + 4)
+      for _ in range(count):
+        values = list(struct_record.unpack(source.read(STL_TRIANGLE_SIZE)))
+        for axis_offset in (3, 6, 9):
+          values[axis_offset] += dx
+          values[axis_offset + 1] += dy
+          values[axis_offset + 2] += dz
+        f.write(struct_record.pack(*values))
+    return count
+
+  with open(model_path, "rb") as source:
+    triangles = read_ascii_triangles(source.read())
+  for triangle in triangles:
+    values = [0.0, 0.0, 0.0]
+    for x, y, z in triangle:
+      values += [x + dx, y + dy, z + dz]
+    f.write(struct_record.pack(*values))
+  return len(triangles)
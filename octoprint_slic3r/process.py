@@ -0,0 +1,131 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import errno
+import os
+import sys
+import threading
+
+try:
+  import selectors
+except ImportError:
+  selectors = None
+
+class LineSplitter(object):
+  """Splits a stream of byte chunks into lines.
+
+  Incomplete lines stay in a reusable buffer until the rest arrives, so
+  nothing is re-split or re-concatenated on every read.
+  """
+
+  def __init__(self):
+    self._buffer = bytearray()
+
+  def feed(self, data):
+    self._buffer += data
+    end = self._buffer.rfind(b"\n")
+    if end < 0:
+      return []
+    lines = memoryview(self._buffer)[:end].tobytes().split(b"\n")
+    del self._buffer[:end + 1]
+    return lines
+
+  def flush(self):
+    if not self._buffer:
+      return []
+    line = bytes(self._buffer)
+    del self._buffer[:]
+    return [line]
+
+def pump_output(process, on_stdout_line, on_stderr_line, chunk_size=64 * 1024):
+  """Reads ``process``' stdout and stderr until both are closed.
+
+  The callbacks are called with each complete line (as bytes, without the
+  newline). Blocks on the pipes instead of polling them: uses a selector where
+  pipes are supported by one, a reader thread per pipe otherwise (Windows,
+  Python 2). In the latter case the callbacks are called from those threads.
+  """
+  streams = [(process.stdout, on_stdout_line), (process.stderr, on_stderr_line)]
+  streams = [(stream, callback) for stream, callback in streams if stream is not None]
+
+  if selectors is not None and os.name != "nt":
+    _pump_selector(streams, chunk_size)
+  else:
+    _pump_threads(streams, chunk_size)
+
+def _pump_selector(streams, chunk_size):
+  selector = selectors.DefaultSelector()
+  try:
+    for stream, callback in streams:
+      selector.register(stream, selectors.EVENT_READ, (LineSplitter(), callback))
+
+    while selector.get_map():
+      for key, _ in selector.select():
+        splitter, callback = key.data
+        data = os.read(key.fd, chunk_size)
+        if data:
+          lines = splitter.feed(data)
+        else:
+          selector.unregister(key.fileobj)
+          lines = splitter.flush()
+        for line in lines:
+          callback(line)
+  finally:
+    selector.close()
+
+def _pump_threads(streams, chunk_size):
+  def reader(stream, callback):
+    splitter = LineSplitter()
+    while True:
+      data = os.read(stream.fileno(), chunk_size)
+      if not data:
+        break
+      for line in splitter.feed(data):
+        callback(line)
+    for line in splitter.flush():
+      callback(line)
+
+  threads = []
+  for stream, callback in streams:
+    thread = threading.Thread(target=reader, args=(stream, callback))
+    thread.daemon = True
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+
+def wait_process(process):
+  """Waits for ``process`` to exit, like ``process.wait()``.
+
+  Returns the resources the process used as a dict with ``cpu_user``,
+  ``cpu_system`` (seconds) and ``peak_rss`` (bytes), or None where that isn't
+  available (Windows).
+  """
+  if process.returncode is not None or not hasattr(os, "wait4"):
+    process.wait()
+    return None
+
+  while True:
+    try:
+      _, status, usage = os.wait4(process.pid, 0)
+      break
+    except OSError as e:
+      if e.errno == errno.EINTR:
+        continue
+      if e.errno == errno.ECHILD:
+        # already reaped elsewhere
+        process.wait()
+        return None
+      raise
+
+  if os.WIFSIGNALED(status):
+    process.returncode = -os.WTERMSIG(status)
+  else:
+    process.returncode = os.WEXITSTATUS(status)
+
+  # kilobytes on Linux, bytes on macOS
+  peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+  return dict(cpu_user=usage.ru_utime, cpu_system=usage.ru_stime, peak_rss=peak_rss)
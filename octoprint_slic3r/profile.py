@@ -5,9 +5,15 @@ __author__ = "Javier Martínez Arrieta <martinezarrietajavier@gmail.com>, Eyal S
 __license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
 __copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
 
+import io
 import logging
 import re
 
+try:
+  text_type = unicode
+except NameError:
+  text_type = str
+
 class GcodeFlavors(object):
   REPRAP = "reprap"
   TEACUP = "teacup"
@@ -43,41 +49,32 @@ class Profile(object):
 
   @classmethod
   def from_slic3r_ini(cls, path):
+    """Reads the profile stored at ``path``.
+
+    Returns a tuple ``(profile, display_name, description)`` or None if there
+    is no such file. For config bundles the first profile of the bundle is
+    returned, see :class:`ConfigBundle`.
+    """
     import os
     if not os.path.exists(path) or not os.path.isfile(path):
       return None
 
-    result = dict()
-    display_name = None
-    description = None
-    with open(path) as f:
-      for line in f:
-        if "#" in line:
-          if line.startswith("# Name: "):
-            display_name = line[len("# Name: "):]
-          elif line.startswith("# Description: "):
-            description = line[len("# Description: "):]
-        split_line = line.split("=", 1)
-        if len(split_line) != 2:
-          continue
-        key, v = map(str.strip, split_line)
-        # Only strip the comment if it's really a comment.
-        # Sometimes the parameter's value includes a #,
-        # for example, color.
-        if "#" in v and str.strip(v[0:v.find("#")]):
-          v = str.strip(v[0:v.find("#")])
+    bundle = ConfigBundle.from_file(path, first_only=True)
 
-        result[key] = v
-
-    return result, display_name, description
+    result = bundle.settings
+    if not result and bundle.sections:
+      for _, profile in bundle.get_profiles():
+        result = profile
+        break
+    return result, bundle.display_name, bundle.description
 
   @classmethod
   def to_slic3r_ini(cls, profile, path, display_name=None, description=None):
-    with open(path, "w") as f:
+    with io.open(path, "wt", encoding="utf-8") as f:
       if display_name is not None:
-        f.write("# Name: " + display_name + "\n")
+        f.write(u"# Name: " + _single_line(display_name) + u"\n")
       if description is not None:
-        f.write("# Description: " + description + "\n")
+        f.write(u"# Description: " + _single_line(description) + u"\n")
       for key in sorted(profile.keys()):
         if key.startswith("_"):
           continue
@@ -86,8 +83,13 @@ class Profile(object):
         if isinstance(value, bool):
           value = "true" if value else "false"
         elif isinstance(value, (tuple, list)):
-          value = ",".join(map(str, value))
-        f.write(key + " = " + str(value) + "\n")
+          value = ",".join(map(_to_text, value))
+        value = _to_text(value)
+        if "\n" in value or "\r" in value:
+          # a multi line value that didn't come from an INI file, e.g. G-code
+          # edited through the API
+          value = escape_value(value)
+        f.write(_to_text(key) + u" = " + value + u"\n")
 
   def __init__(self, profile, printer_profile, posX, posY, overrides=None):
     self._profile = profile
@@ -121,3 +123,334 @@ class Profile(object):
         return self._profile[key]
       else:
         return None
+
+# C style escapes as used by PrusaSlicer for string values, e.g. start_gcode,
+# any other escaped character stands for itself
+_escapes = {"n": "\n", "r": "\r"}
+_reverse_escapes = {"\n": "\\n", "\r": "\\r", "\\": "\\\\"}
+regex_escape = re.compile(r"\\(.)", flags=re.DOTALL)
+regex_needs_escape = re.compile(r"[\\\n\r]")
+
+def unescape_value(value):
+  """Turns an escaped INI value like ``G28\\nG1 Z5`` into the actual text."""
+  if "\\" not in value:
+    return value
+  return regex_escape.sub(lambda m: _escapes.get(m.group(1), m.group(1)), value)
+
+def escape_value(value):
+  """Inverse of :func:`unescape_value`."""
+  return regex_needs_escape.sub(lambda m: _reverse_escapes[m.group(0)], value)
+
+def _to_text(value):
+  if isinstance(value, text_type):
+    return value
+  if isinstance(value, bytes):
+    return value.decode("utf-8", "replace")
+  return text_type(value)
+
+def _single_line(value):
+  return " ".join(_to_text(value).splitlines())
+
+class ConfigBundle(object):
+  """Settings read from a Slic3r/PrusaSlicer INI file.
+
+  Plain exported configs only have ``settings``. Config bundles additionally
+  consist of sections like ``[print:0.15mm QUALITY]``, ``[filament:PLA]`` or
+  ``[printer:MK3S]``, available through ``sections`` keyed by ``(type, name)``.
+  Presets may inherit from others (``inherits = *common*; *PLA*``), those
+  named ``*...*`` are abstract and only serve as parents.
+
+  Values are kept exactly as written, including PrusaSlicer's escapes, so they
+  can be handed back to the engine unchanged. Comments are only recognized on
+  lines of their own, a ``#`` or ``;`` within a value is part of the value.
+  """
+
+  PRESET_TYPES = ("print", "filament", "printer")
+
+  def __init__(self):
+    self.settings = dict()
+    self.sections = dict()
+    self.skipped = set()
+    self.display_name = None
+    self.description = None
+
+  @classmethod
+  def from_lines(cls, lines, wanted=None):
+    """Parses ``lines``. If ``wanted`` is given, only the sections whose
+    ``(type, name)`` is in it keep their settings, the others just end up in
+    ``skipped``."""
+    bundle = cls()
+    lines = iter(lines)
+    line = bundle._read_settings(lines)
+    if line is None:
+      return bundle
+
+    discarded = dict()
+    current = bundle._start_section(line, wanted, discarded)
+    for line in lines:
+      line = line.strip()
+      if not line:
+        continue
+
+      first = line[0]
+      if first == "#" or first == ";":
+        continue
+
+      if first == "[" and line[-1] == "]":
+        current = bundle._start_section(line, wanted, discarded)
+        continue
+
+      key, separator, value = line.partition("=")
+      if not separator:
+        continue
+      current[key.rstrip()] = value.lstrip()
+
+    return bundle
+
+  @classmethod
+  def from_file(cls, path, first_only=False):
+    """Reads ``path``, see :meth:`from_opener`."""
+    return cls.from_opener(lambda: io.open(path, "rt", encoding="utf-8-sig", errors="replace"),
+                           first_only=first_only)
+
+  @classmethod
+  def from_opener(cls, opener, first_only=False):
+    """Reads the file returned by ``opener``.
+
+    Plain configs are read once. For bundles a first pass only collects the
+    section headers, ``inherits`` and the ``[presets]`` selection, the second
+    one then keeps just the print presets (only the first one with
+    ``first_only``), the selected filament and printer and their parents.
+    """
+    with opener() as f:
+      bundle = cls()
+      line = bundle._read_settings(f)
+      if line is None:
+        return bundle
+      parents, selected = _scan_sections(line, f)
+
+    names = sorted(name for section_type, name in parents
+                   if section_type == "print" and not _is_abstract(name))
+    if first_only:
+      names = names[:1]
+    pending = [("print", name) for name in names]
+    pending += [(section_type, selected[section_type]) for section_type in ("filament", "printer")
+                if selected.get(section_type)]
+    wanted = set([("presets", "")])
+    while pending:
+      key = pending.pop()
+      if key in wanted or key not in parents:
+        continue
+      wanted.add(key)
+      pending += [(key[0], parent) for parent in parents[key]]
+
+    with opener() as f:
+      return cls.from_lines(f, wanted=wanted)
+
+  def _read_settings(self, lines):
+    """Reads the top-level settings and header comments of ``lines``, returns
+    the first section header or None if there is none."""
+    settings = self.settings
+    for line in lines:
+      key, separator, value = line.partition("=")
+      if separator:
+        key = key.strip()
+        first = key[:1]
+        if first and first != "#" and first != ";" and first != "[":
+          settings[key] = value.strip()
+          continue
+
+      line = line.strip()
+      if line[:1] == "[" and line[-1:] == "]":
+        return line
+      if line.startswith("# Name: "):
+        self.display_name = line[8:].strip()
+      elif line.startswith("# Description: "):
+        self.description = line[15:].strip()
+    return None
+
+  def _start_section(self, line, wanted, discarded):
+    key = _section_key(line)
+    if wanted is not None and key not in wanted:
+      self.skipped.add(key)
+      discarded.clear()
+      return discarded
+    current = self.sections.get(key)
+    if current is None:
+      current = self.sections[key] = dict()
+    return current
+
+  @property
+  def is_bundle(self):
+    return any(section_type in self.PRESET_TYPES for section_type, _ in self.sections) \
+      or any(section_type in self.PRESET_TYPES for section_type, _ in self.skipped)
+
+  def presets(self, section_type):
+    """Names of the non abstract presets of ``section_type`` in the bundle."""
+    return sorted(name for t, name in self.sections
+                  if t == section_type and not _is_abstract(name))
+
+  def resolve(self, section_type, name, _seen=None):
+    """Settings of a preset including everything it inherits."""
+    if _seen is None:
+      _seen = set()
+    if (section_type, name) in _seen:
+      raise ValueError("Circular inheritance for {type}:{name}".format(type=section_type, name=name))
+    _seen.add((section_type, name))
+
+    section = self.sections.get((section_type, name))
+    if section is None:
+      raise KeyError("No such preset: {type}:{name}".format(type=section_type, name=name))
+
+    result = dict()
+    inherits = section.get("inherits", "")
+    for parent in inherits.split(";"):
+      parent = parent.strip().strip('"')
+      if parent and (section_type, parent) in self.sections:
+        result.update(self.resolve(section_type, parent, _seen=_seen))
+    # only the presets on the way down matter, siblings may share parents
+    _seen.discard((section_type, name))
+    result.update(section)
+    result.pop("inherits", None)
+    return result
+
+  def combine(self, print_preset=None, filament=None, printer=None):
+    """One flat profile out of a print, filament and printer preset."""
+    result = dict(self.settings)
+    for section_type, name in (("printer", printer), ("filament", filament), ("print", print_preset)):
+      if name:
+        result.update(self.resolve(section_type, name))
+    return result
+
+  def get_profile(self, name):
+    """The print preset ``name`` combined with the filament and printer preset
+    selected in the bundle's ``[presets]`` section, if any."""
+    selected = self.sections.get(("presets", ""), dict())
+    filament = selected.get("filament")
+    printer = selected.get("printer")
+    if filament and ("filament", filament) not in self.sections:
+      filament = None
+    if printer and ("printer", printer) not in self.sections:
+      printer = None
+    return self.combine(print_preset=name, filament=filament, printer=printer)
+
+  def get_profiles(self):
+    """Yields ``(name, profile)`` for every print preset in the bundle."""
+    for name in self.presets("print"):
+      yield name, self.get_profile(name)
+
+def _section_key(line):
+  section_type, _, name = line[1:-1].partition(":")
+  return section_type.strip(), name.strip()
+
+def _is_abstract(name):
+  return name.startswith("*") and name.endswith("*")
+
+def _scan_sections(line, lines):
+  """Collects the parents of every section and the ``[presets]`` selection,
+  starting at the section header ``line``."""
+  parents = dict()
+  selected = dict()
+  key = _section_key(line)
+  parents[key] = []
+  for line in lines:
+    first = line[:1]
+    if first == " " or first == "\t":
+      line = line.lstrip()
+      first = line[:1]
+    if first == "[":
+      line = line.rstrip()
+      if line[-1:] == "]":
+        key = _section_key(line)
+        parents.setdefault(key, [])
+      continue
+    if first != "i" and key != ("presets", ""):
+      continue
+    name, separator, value = line.partition("=")
+    if not separator:
+      continue
+    name = name.strip()
+    if key == ("presets", ""):
+      selected[name] = value.strip()
+    elif name == "inherits":
+      parents[key] = [parent.strip().strip('"') for parent in value.split(";") if parent.strip().strip('"')]
+  return parents, selected
+
+def read_profile_metadata(path):
+  """Reads just the ``# Name:`` and ``# Description:`` lines of a profile.
+
+  Those are written at the very top, so reading stops at the first line that
+  isn't a comment instead of parsing all settings. Returns a tuple
+  ``(display_name, description)``.
+  """
+  display_name = None
+  description = None
+  with io.open(path, "rt", encoding="utf-8-sig", errors="replace") as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      if line[0] != "#" and line[0] != ";":
+        break
+      if line.startswith("# Name: "):
+        display_name = line[8:].strip()
+      elif line.startswith("# Description: "):
+        description = line[15:].strip()
+  return display_name, description
+
+def read_profiles(path, filename=None):
+  """Reads all profiles from an INI file, a config bundle or a zip file of those.
+
+  Yields a dict per profile with ``source``, ``name``, ``profile``,
+  ``display_name`` and ``description``, or with ``source`` and ``error`` for
+  anything that couldn't be read. Every file is only read once, zip members are
+  parsed straight from the archive.
+  """
+  import os
+  import zipfile
+
+  if filename is None:
+    filename = os.path.basename(path)
+
+  if not zipfile.is_zipfile(path):
+    for entry in _bundle_entries(ConfigBundle.from_file(path), filename):
+      yield entry
+    return
+
+  with zipfile.ZipFile(path) as archive:
+    for info in archive.infolist():
+      member = info.filename
+      if member.endswith("/") or not member.lower().endswith((".ini", ".profile")):
+        continue
+      try:
+        bundle = ConfigBundle.from_opener(
+          lambda: io.TextIOWrapper(archive.open(info), encoding="utf-8-sig", errors="replace"))
+      except Exception as e:
+        yield dict(source=member, error=str(e))
+        continue
+      for entry in _bundle_entries(bundle, member):
+        yield entry
+
+def _bundle_entries(bundle, source):
+  import os
+
+  if not bundle.is_bundle:
+    name, _ = os.path.splitext(os.path.basename(source))
+    if bundle.settings:
+      yield dict(source=source,
+                 name=name,
+                 profile=bundle.settings,
+                 display_name=bundle.display_name or name,
+                 description=bundle.description)
+    else:
+      yield dict(source=source, error="No settings found")
+    return
+
+  for name in bundle.presets("print"):
+    preset_source = "{source} [print:{name}]".format(source=source, name=name)
+    try:
+      profile = bundle.get_profile(name)
+    except Exception as e:
+      yield dict(source=preset_source, error=str(e))
+      continue
+    yield dict(source=preset_source, name=name, profile=profile, display_name=name, description=None)
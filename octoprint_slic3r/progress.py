@@ -0,0 +1,153 @@
+# coding=utf-8
+from __future__ import absolute_import, division
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import math
+import re
+import time
+
+# Status lines as printed by the engines, e.g.
+#   PrusaSlicer: 45 => Making infill
+#   Slic3r:      => Generating perimeters
+regex_status = re.compile(r"^\s*(?:([0-9]+)%?\s*)?=>\s*(.*?)\s*$")
+
+# Trace lines with a layer number, e.g.
+#   [2022-04-22 21:44:51.396082] [0x75527010] [trace]   Generating perimeters for layer 12
+regex_trace_layer = re.compile(r"\[trace\]\s*(.*?layer)\s+([0-9]+)", flags=re.IGNORECASE)
+
+class SlicingPhases(object):
+  SLICING = "slicing"
+  PERIMETERS = "perimeters"
+  INFILL = "infill"
+  SUPPORT = "support"
+  SKIRT = "skirt"
+  GCODE = "gcode"
+
+# phase, keywords identifying it in a message, progress range covered by it
+PHASES = (
+  (SlicingPhases.SLICING, ("slicing", "triangulated mesh"), 0.0, 0.2),
+  (SlicingPhases.PERIMETERS, ("perimeter",), 0.2, 0.35),
+  (SlicingPhases.INFILL, ("infill",), 0.35, 0.7),
+  (SlicingPhases.SUPPORT, ("support",), 0.7, 0.85),
+  (SlicingPhases.SKIRT, ("skirt", "brim"), 0.85, 0.9),
+  (SlicingPhases.GCODE, ("g-code", "gcode", "export"), 0.9, 1.0),
+)
+
+def expected_layer_count(height, layer_height, first_layer_height=None):
+  """Number of layers the engine will produce for an object of ``height`` mm."""
+  if not height or not layer_height or layer_height <= 0:
+    return None
+  if not first_layer_height or first_layer_height <= 0:
+    first_layer_height = layer_height
+  if height <= first_layer_height:
+    return 1
+  return 1 + int(math.ceil((height - first_layer_height) / layer_height - 1e-6))
+
+def _phase_index(message):
+  message = message.lower()
+  # later phases first, "Exporting G-code" would otherwise not win against "slicing"
+  for index in range(len(PHASES) - 1, -1, -1):
+    if any(keyword in message for keyword in PHASES[index][1]):
+      return index
+  return None
+
+class SlicingProgress(object):
+  """Turns the engine's output into a monotonically increasing progress value.
+
+  Each phase (slicing, perimeters, infill, ...) covers a fixed range, within a
+  phase the progress is derived from the layers processed so far compared to
+  ``expected_layers``. If that isn't known up front, the number of layers seen
+  in the first phase is used for the later ones.
+
+  ``callback`` is called with ``(progress, eta)`` at most every ``interval``
+  seconds, ``eta`` being the estimated remaining seconds or None.
+  """
+
+  def __init__(self, expected_layers=None, callback=None, interval=0.5, clock=time.time):
+    self.expected_layers = expected_layers
+    self.progress = 0.0
+    self.phase = None
+
+    self._callback = callback
+    self._interval = interval
+    self._clock = clock
+    self._started = clock()
+    self._last_report = None
+    self._phase_index = -1
+    self._phase_layers = 0
+    self._seen_layers = 0
+
+  @property
+  def eta(self):
+    if self.progress < 0.02:
+      return None
+    elapsed = self._clock() - self._started
+    return elapsed * (1.0 - self.progress) / self.progress
+
+  def feed_line(self, line):
+    """Feeds one line of engine output, returns True if the progress changed."""
+    if "=>" in line:
+      m = regex_status.match(line)
+      if m:
+        return self._on_status(m.group(1), m.group(2))
+
+    if "layer" in line:
+      m = regex_trace_layer.search(line)
+      if m:
+        return self._on_layer(m.group(1), int(m.group(2)))
+
+    return False
+
+  def finish(self):
+    self._update(1.0, force=True)
+
+  def _on_status(self, percent, message):
+    index = _phase_index(message)
+    if index is not None:
+      self._enter_phase(index)
+
+    progress = PHASES[self._phase_index][2] if self._phase_index >= 0 else 0.0
+    if percent is not None:
+      progress = max(progress, int(percent) / 100.0)
+    return self._update(progress)
+
+  def _on_layer(self, message, layer):
+    index = _phase_index(message)
+    if index is None:
+      index = max(self._phase_index, 0)
+    self._enter_phase(index)
+    if index != self._phase_index:
+      # output from an earlier phase
+      return False
+
+    self._phase_layers = max(self._phase_layers, layer + 1)
+    self._seen_layers = max(self._seen_layers, layer + 1)
+
+    total = self.expected_layers or (self._seen_layers if self._phase_index > 0 else None)
+    if not total:
+      return False
+
+    _, _, start, end = PHASES[self._phase_index]
+    fraction = min(1.0, self._phase_layers / float(total))
+    return self._update(start + (end - start) * fraction)
+
+  def _enter_phase(self, index):
+    if index > self._phase_index:
+      self._phase_index = index
+      self._phase_layers = 0
+      self.phase = PHASES[index][0]
+
+  def _update(self, progress, force=False):
+    # never report 100% before the engine is actually done
+    progress = min(progress, 1.0 if force else 0.99)
+    if progress <= self.progress and not force:
+      return False
+    self.progress = max(self.progress, progress)
+
+    now = self._clock()
+    if self._callback is not None and (force or self._last_report is None or now - self._last_report >= self._interval):
+      self._last_report = now
+      self._callback(self.progress, self.eta)
+    return True
@@ -0,0 +1,328 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+try:
+  import http.client as httplib
+  from urllib.parse import urlparse
+except ImportError:
+  import httplib
+  from urlparse import urlparse
+
+from .cache import hash_file
+
+TOKEN_HEADER = "X-Slic3r-Token"
+
+class JobEvents(object):
+  """Types of the events a worker streams back while slicing a job."""
+  QUEUED = "queued"
+  STARTED = "started"
+  OUTPUT = "output"
+  PING = "ping"
+  DONE = "done"
+  CANCELLED = "cancelled"
+
+# errors that mean the worker couldn't be reached or went away
+CONNECTION_ERRORS = (socket.error, httplib.HTTPException)
+
+class RemoteUnavailable(Exception):
+  """The worker can't be used right now, the job may be sliced elsewhere."""
+  pass
+
+class RemoteCancelled(Exception):
+  pass
+
+def parse_worker_urls(value):
+  """Worker URLs from a list or a string with one URL per line or comma separated."""
+  if not value:
+    return []
+  if not isinstance(value, (list, tuple)):
+    value = value.replace(",", "\n").splitlines()
+  return [url.strip().rstrip("/") for url in value if url and url.strip()]
+
+class RemoteWorker(object):
+  """A slicing worker (see :mod:`octoprint_slic3r.worker`) at ``url``.
+
+  Keeps up to ``max_idle`` connections open for reuse between requests.
+  """
+
+  def __init__(self, url, token=None, timeout=30, max_idle=4):
+    parsed = urlparse(url if "://" in url else "http://" + url)
+    self.url = url
+    self.token = token
+    self.timeout = timeout
+    self.max_idle = max_idle
+    self._connection_class = httplib.HTTPSConnection if parsed.scheme == "https" else httplib.HTTPConnection
+    self._host = parsed.hostname
+    self._port = parsed.port
+
+    self.healthy = None
+    self.checked = None
+    self.load = 0
+    self.max_jobs = 1
+    self.engine = None
+    # jobs sent from here and not finished yet, the health check lags behind
+    self.active = 0
+
+    self._idle = []
+    self._mutex = threading.Lock()
+
+  def request(self, method, path, body=None, headers=None):
+    """Sends a request and returns ``(connection, response)``.
+
+    The response has to be read completely before handing the connection
+    back with :meth:`release`. A pooled connection that turns out to have
+    been closed by the worker in the meantime is replaced by a new one.
+    """
+    headers = dict(headers or dict())
+    if self.token:
+      headers[TOKEN_HEADER] = self.token
+
+    with self._mutex:
+      connection = self._idle.pop() if self._idle else None
+    reused = connection is not None
+    while True:
+      if connection is None:
+        connection = self._connection_class(self._host, self._port, timeout=self.timeout)
+      try:
+        if hasattr(body, "seek"):
+          body.seek(0)
+        connection.request(method, path, body=body, headers=headers)
+        return connection, connection.getresponse()
+      except CONNECTION_ERRORS:
+        connection.close()
+        connection = None
+        if not reused:
+          raise
+        reused = False
+
+  def release(self, connection, response):
+    if response.will_close or not response.isclosed():
+      connection.close()
+      return
+    with self._mutex:
+      if len(self._idle) < self.max_idle:
+        self._idle.append(connection)
+        return
+    connection.close()
+
+  def call(self, method, path, body=None, headers=None):
+    """Sends a request and returns ``(status, data)``, ``data`` parsed if JSON."""
+    connection, response = self.request(method, path, body=body, headers=headers)
+    try:
+      data = response.read()
+    except Exception:
+      connection.close()
+      raise
+    self.release(connection, response)
+    if data and response.getheader("Content-Type") == "application/json":
+      data = json.loads(data.decode("utf-8"))
+    return response.status, data
+
+  def check_health(self, timeout=2):
+    """Asks the worker how busy it is, returns whether it's reachable."""
+    connection = self._connection_class(self._host, self._port, timeout=timeout)
+    headers = {TOKEN_HEADER: self.token} if self.token else dict()
+    try:
+      connection.request("GET", "/health", headers=headers)
+      response = connection.getresponse()
+      data = response.read()
+      healthy = response.status == 200
+      if healthy:
+        health = json.loads(data.decode("utf-8"))
+        self.engine = health.get("engine")
+        self.max_jobs = max(1, health.get("max_jobs", 1))
+        self.load = float(health.get("running", 0) + health.get("queued", 0)) / self.max_jobs
+    except (ValueError,) + CONNECTION_ERRORS:
+      healthy = False
+    finally:
+      connection.close()
+    self.healthy = healthy
+    self.checked = time.time()
+    return healthy
+
+  def mark_unhealthy(self):
+    self.healthy = False
+    self.checked = time.time()
+    with self._mutex:
+      idle, self._idle = self._idle, []
+    for connection in idle:
+      connection.close()
+
+  def close(self):
+    self.mark_unhealthy()
+
+  def __repr__(self):
+    return "RemoteWorker(%r, healthy=%r, load=%r)" % (self.url, self.healthy, self.load)
+
+class RemoteBackend(object):
+  """Slices on a set of workers, picking the least busy healthy one per job.
+
+  Workers are checked on demand once their last check is older than
+  ``health_interval`` seconds, unreachable ones after ``retry_interval``.
+  """
+
+  def __init__(self, urls, token=None, health_interval=10, retry_interval=30, timeout=30):
+    self._logger = logging.getLogger(__name__)
+    self.workers = [RemoteWorker(url, token=token, timeout=timeout) for url in urls]
+    self.health_interval = health_interval
+    self.retry_interval = retry_interval
+    self._mutex = threading.Lock()
+
+  def choose(self):
+    """Returns the worker to send the next job to, None if none is reachable.
+
+    The job is counted against the worker until it's handed back with
+    :meth:`release`, whatever happens in between.
+    """
+    now = time.time()
+    for worker in self.workers:
+      interval = self.health_interval if worker.healthy else self.retry_interval
+      if worker.checked is None or now - worker.checked > interval:
+        if not worker.check_health():
+          self._logger.info("Slicing worker %s is unreachable" % worker.url)
+
+    with self._mutex:
+      candidates = [worker for worker in self.workers if worker.healthy]
+      if not candidates:
+        return None
+      worker = min(candidates, key=lambda w: (w.load + float(w.active) / w.max_jobs, self.workers.index(w)))
+      worker.active += 1
+      return worker
+
+  def release(self, worker):
+    with self._mutex:
+      worker.active -= 1
+
+  def slice(self, worker, model_path, profile_path, center, machinecode_path, binary=False, overrides=None,
+            on_line=None, on_job=None, is_cancelled=None, stats=None):
+    """Slices ``model_path`` on ``worker`` (as returned by :meth:`choose`) to ``machinecode_path``.
+
+    ``on_line`` is called with each line the engine printed to stdout,
+    ``on_job`` with the job's id once it's known, to allow cancelling it
+    with :meth:`cancel`. A cancellation the worker missed because it came
+    in too early is repeated if ``is_cancelled`` returns True.
+    Returns ``(returncode, error)``. Raises :class:`RemoteUnavailable` if
+    the worker couldn't be used, :class:`RemoteCancelled` if the job was
+    cancelled. Timings and sizes are stored in the ``stats`` dict.
+    """
+    if stats is None:
+      stats = dict()
+    try:
+      upload_start = time.time()
+      model = self._upload(worker, model_path, stats)
+      profile = self._upload(worker, profile_path, stats)
+      stats["upload"] = time.time() - upload_start
+
+      job_id = uuid.uuid4().hex
+      if on_job is not None:
+        on_job(job_id)
+      request = dict(id=job_id, model=model, profile=profile, center=list(center), binary=binary,
+                     overrides=overrides, extension=os.path.splitext(model_path)[1].lower())
+      done = self._stream_job(worker, request, on_line, is_cancelled)
+      if done.get("usage"):
+        stats.update(done["usage"])
+      if done.get("duration") is not None:
+        stats["wall"] = done["duration"]
+      if done.get("returncode") is None:
+        # the worker couldn't even start the engine
+        raise RemoteUnavailable("Slicing worker %s could not slice: %s" % (worker.url, done.get("error")))
+      if done.get("returncode") != 0:
+        return done.get("returncode"), done.get("error") or ""
+
+      download_start = time.time()
+      self._download(worker, job_id, machinecode_path)
+      stats["download"] = time.time() - download_start
+      return 0, ""
+    except CONNECTION_ERRORS as e:
+      worker.mark_unhealthy()
+      raise RemoteUnavailable("Slicing worker %s failed: %s" % (worker.url, e))
+
+  def cancel(self, worker, job_id):
+    try:
+      worker.call("DELETE", "/jobs/%s" % job_id)
+    except CONNECTION_ERRORS:
+      self._logger.exception("Could not cancel job %s on %s" % (job_id, worker.url))
+
+  def close(self):
+    for worker in self.workers:
+      worker.close()
+
+  def _upload(self, worker, path, stats):
+    digest = hash_file(path)
+    status, _ = worker.call("HEAD", "/files/%s" % digest)
+    if status == 200:
+      return digest
+    if status != 404:
+      raise RemoteUnavailable("Slicing worker %s refused %s: HTTP %d" % (worker.url, path, status))
+
+    with open(path, "rb") as f:
+      status, data = worker.call("PUT", "/files/%s" % digest, body=f,
+                                 headers={"Content-Length": str(os.path.getsize(path)),
+                                          "Content-Type": "application/octet-stream"})
+    if status != 201:
+      raise RemoteUnavailable("Could not upload %s to %s: %r" % (path, worker.url, data))
+    stats["uploaded"] = stats.get("uploaded", 0) + os.path.getsize(path)
+    return digest
+
+  def _stream_job(self, worker, request, on_line, is_cancelled):
+    body = json.dumps(request).encode("utf-8")
+    connection, response = worker.request("POST", "/jobs", body=body, headers={"Content-Type": "application/json"})
+    done = None
+    cancel_sent = False
+    try:
+      if response.status != 200:
+        data = response.read()
+        raise RemoteUnavailable("Slicing worker %s rejected the job: %s" % (worker.url, data.decode("utf-8", "replace")))
+
+      # the response is chunked, so it can be read line by line as it arrives
+      for line in iter(response.readline, b""):
+        event = json.loads(line.decode("utf-8"))
+        if event["type"] == JobEvents.OUTPUT and on_line is not None:
+          for output_line in event["lines"]:
+            on_line(output_line)
+        elif event["type"] == JobEvents.CANCELLED:
+          done = event
+        elif event["type"] == JobEvents.DONE:
+          done = event
+        if done is None and not cancel_sent and is_cancelled is not None and is_cancelled():
+          self.cancel(worker, request["id"])
+          cancel_sent = True
+      worker.release(connection, response)
+    except Exception:
+      connection.close()
+      raise
+
+    if done is None:
+      raise RemoteUnavailable("Slicing worker %s stopped without finishing the job" % worker.url)
+    if done["type"] == JobEvents.CANCELLED:
+      raise RemoteCancelled()
+    return done
+
+  def _download(self, worker, job_id, path):
+    connection, response = worker.request("GET", "/jobs/%s/output" % job_id)
+    try:
+      if response.status != 200:
+        raise RemoteUnavailable("Slicing worker %s has no output for job %s" % (worker.url, job_id))
+      expected = int(response.getheader("Content-Length") or 0)
+      size = 0
+      with open(path, "wb") as f:
+        for chunk in iter(lambda: response.read(1024 * 1024), b""):
+          f.write(chunk)
+          size += len(chunk)
+      if size != expected:
+        raise RemoteUnavailable("Got %d of %d bytes of output from %s" % (size, expected, worker.url))
+      worker.release(connection, response)
+    except Exception:
+      connection.close()
+      raise
@@ -0,0 +1,176 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import heapq
+import itertools
+import threading
+import time
+
+from .job import SlicingPriorities
+
+def default_max_jobs():
+  import multiprocessing
+  try:
+    return multiprocessing.cpu_count()
+  except NotImplementedError:
+    return 1
+
+class SlicingScheduler(object):
+  """Limits how many slicer processes run at once.
+
+  Jobs wait in a priority queue (lower priority values first, then first come
+  first served) until one of the ``max_jobs`` slots becomes free. Jobs that are
+  cancelled while still waiting never start.
+
+  Background jobs are preemptible: if a job with a higher priority has to wait
+  for a slot, ``on_preempt`` is called with a running background job, which is
+  expected to cancel it and so free its slot.
+  """
+
+  def __init__(self, max_jobs=None, on_preempt=None):
+    self._condition = threading.Condition()
+    self._counter = itertools.count()
+    self._queue = []
+    self._running = dict()
+    self._attached = dict()
+    self._max_jobs = max_jobs or default_max_jobs()
+    self.on_preempt = on_preempt
+
+  @property
+  def max_jobs(self):
+    return self._max_jobs
+
+  @max_jobs.setter
+  def max_jobs(self, value):
+    with self._condition:
+      self._max_jobs = value or default_max_jobs()
+      self._dispatch()
+
+  def acquire(self, job, on_position=None):
+    """Blocks until ``job`` may run.
+
+    ``on_position`` is called with the job's (zero based) position in the
+    queue whenever that changes. Returns False if the job was cancelled while
+    waiting, True otherwise.
+    """
+    with self._condition:
+      entry = [job.priority, next(self._counter), job, False]
+      heapq.heappush(self._queue, entry)
+      self._dispatch()
+      preempted = self._find_preemptible() if not entry[3] else None
+
+    if preempted is not None and self.on_preempt is not None:
+      self.on_preempt(preempted)
+
+    last_position = None
+    while True:
+      with self._condition:
+        while not entry[3] and not job.cancelled and self._position(entry) == last_position:
+          self._condition.wait()
+
+        if job.cancelled and not entry[3]:
+          if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+          self._condition.notify_all()
+          return False
+        if entry[3]:
+          return True
+        position = self._position(entry)
+
+      last_position = position
+      if on_position is not None:
+        on_position(job, position)
+
+  def release(self, job):
+    with self._condition:
+      self._running.pop(job.id, None)
+      self._attached.pop(job.id, None)
+      self._dispatch()
+
+  def take_batch(self, job, limit, accept=None):
+    """Takes up to ``limit`` queued jobs with the same ``batch_key`` as the
+    running ``job`` out of the queue, to be sliced together with it.
+
+    The taken jobs' ``acquire`` returns with their ``batch`` set to ``job``,
+    they don't occupy a slot of their own. ``accept`` is called with each
+    candidate and may veto it.
+    """
+    if not job.batch_key or limit <= 0:
+      return []
+
+    with self._condition:
+      taken = []
+      for entry in sorted(self._queue):
+        if len(taken) >= limit:
+          break
+        other = entry[2]
+        if other.cancelled or other.batch_key != job.batch_key:
+          continue
+        if accept is not None and not accept(other):
+          continue
+        self._queue.remove(entry)
+        other.batch = job
+        entry[3] = True
+        self._attached[other.id] = other
+        taken.append(other)
+
+      if taken:
+        heapq.heapify(self._queue)
+        self._condition.notify_all()
+      return taken
+
+  def cancel(self, job_id):
+    """Marks the queued or running job ``job_id`` as cancelled.
+
+    Returns True if the job was still waiting in the queue.
+    """
+    with self._condition:
+      for entry in self._queue:
+        if entry[2].id == job_id:
+          entry[2].cancelled = True
+          self._condition.notify_all()
+          return True
+      for running in (self._running, self._attached):
+        if job_id in running:
+          running[job_id].cancelled = True
+      return False
+
+  def get_stats(self):
+    with self._condition:
+      return dict(
+        max_jobs=self._max_jobs,
+        running=len(self._running),
+        batched=len(self._attached),
+        queued=len(self._queue)
+      )
+
+  def _find_preemptible(self):
+    """Returns a running background job to preempt for the waiting jobs of a
+    higher priority, None if there is none or enough are being preempted."""
+    waiting = sum(1 for entry in self._queue if entry[0] < SlicingPriorities.BACKGROUND and not entry[2].cancelled)
+    background = [job for job in self._running.values() if job.priority >= SlicingPriorities.BACKGROUND]
+    preempting = sum(1 for job in background if job.cancelled)
+    candidates = [job for job in background if not job.cancelled]
+    if waiting <= preempting or not candidates:
+      return None
+    # the one that started last has done the least work
+    job = max(candidates, key=lambda candidate: candidate.started or 0)
+    job.cancelled = True
+    return job
+
+  def _position(self, entry):
+    return sum(1 for other in self._queue if other[:2] < entry[:2])
+
+  def _dispatch(self):
+    while self._queue and len(self._running) < self._max_jobs:
+      entry = heapq.heappop(self._queue)
+      if entry[2].cancelled:
+        continue
+      entry[3] = True
+      entry[2].started = time.time()
+      self._running[entry[2].id] = entry[2]
+    self._condition.notify_all()
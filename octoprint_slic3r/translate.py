@@ -0,0 +1,157 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import re
+
+from .profile import unescape_value
+
+# Moving a model on the bed doesn't change how it's sliced, so G-code sliced
+# for one position can be turned into G-code for another one by shifting all
+# X/Y coordinates of the print moves. Everything that isn't part of the print
+# itself has to stay where it is: the start and end G-code, the wipe tower and
+# anything positioned relative to the bed. Whenever that can't be told apart
+# reliably, TranslationUnsafe is raised and the model has to be sliced again.
+
+regex_xy = re.compile(br"([XY])\s*(-?[0-9]*\.?[0-9]+)")
+regex_xy_text = re.compile(r"(^|[\s;])G0*[0-3](?![0-9])[^\n;]*[XY]", flags=re.IGNORECASE | re.MULTILINE)
+
+MOVE_COMMANDS = frozenset((b"G0", b"G1", b"G2", b"G3", b"G00", b"G01", b"G02", b"G03"))
+
+# custom G-code PrusaSlicer emits in the middle of the print without marking
+# it as such, any XY move in there would be shifted along with the model
+INLINE_GCODE_KEYS = ("before_layer_gcode", "layer_gcode", "toolchange_gcode", "between_objects_gcode",
+                     "color_change_gcode", "pause_print_gcode", "template_custom_gcode")
+
+# placeholders for the model's position, used e.g. for Prusa's M555 or to
+# purge next to the print
+PLACEMENT_PLACEHOLDERS = ("first_layer_print_", "first_layer_center", "objects_info")
+
+class TranslationUnsafe(Exception):
+  pass
+
+def _is_enabled(value):
+  return str(value).strip().lower() in ("1", "true")
+
+def get_profile_blocker(profile):
+  """Returns why G-code sliced with ``profile`` can't be moved, None if it can."""
+  if _is_enabled(profile.get("wipe_tower", "0")):
+    return "the wipe tower is enabled"
+  if str(profile.get("gcode_label_objects", "0")).strip().lower() not in ("", "0", "false", "disabled"):
+    return "objects are labelled"
+  for key in INLINE_GCODE_KEYS:
+    value = profile.get(key)
+    if value and regex_xy_text.search(unescape_value(str(value))):
+      return "%s contains XY moves" % key
+  for key in ("start_gcode", "end_gcode", "start_filament_gcode", "end_filament_gcode"):
+    value = str(profile.get(key) or "")
+    for placeholder in PLACEMENT_PLACEHOLDERS:
+      if placeholder in value:
+        return "%s uses %s" % (key, placeholder)
+  return None
+
+# shifted coordinates remembered per axis, G-code tends to repeat them a lot
+MAX_MEMO_SIZE = 64 * 1024
+
+def _format_coordinate(value):
+  # like PrusaSlicer, three decimals without trailing zeros
+  text = (b"%.3f" % value).rstrip(b"0").rstrip(b".")
+  if text in (b"-0", b""):
+    text = b"0"
+  return text
+
+def translate_gcode(source, destination, dx, dy):
+  """Streams the G-code in file ``source`` to file ``destination``, shifting
+  the print by ``dx``/``dy`` millimeters.
+
+  Only absolute (``G90``) moves between the first ``;LAYER_CHANGE`` and the
+  end G-code are shifted, custom G-code marked by ``;TYPE:Custom`` stays
+  untouched, as do arc center offsets which are relative anyway. Raises
+  :class:`TranslationUnsafe` if the G-code contains anything that would make
+  the result differ from slicing at the new position, the destination is
+  incomplete then. Returns a dict with the number of lines and shifted moves.
+  """
+  offsets = {b"X": dx, b"Y": dy}
+  memos = {b"X": dict(), b"Y": dict()}
+  def shift_word(axis, value):
+    memo = memos[axis]
+    word = memo.get(value)
+    if word is None:
+      if len(memo) >= MAX_MEMO_SIZE:
+        memo.clear()
+      word = memo[value] = axis + _format_coordinate(float(value) + offsets[axis])
+    return word
+  def shift(match):
+    return shift_word(match.group(1), match.group(2))
+
+  absolute = True
+  printing = False
+  custom = False
+  shifting = False
+  typed = False
+  lines = 0
+  moves = 0
+  write = destination.write
+
+  for line in source:
+    lines += 1
+
+    if shifting and line[:3] == b"G1 " and b";" not in line:
+      # fast path for the bulk of the G-code
+      body = line.rstrip()
+      words = body.split(b" ")
+      for index in range(1, len(words)):
+        axis = words[index][:1]
+        if axis == b"X" or axis == b"Y":
+          words[index] = shift_word(axis, words[index][1:])
+        elif axis == b"x" or axis == b"y":
+          raise TranslationUnsafe("G-code contains lower case moves")
+      write(b" ".join(words) + line[len(body):])
+      moves += 1
+      continue
+
+    first = line[:1]
+    if first == b";":
+      if line.startswith(b";LAYER_CHANGE"):
+        printing = True
+        custom = False
+      elif line.startswith(b";TYPE:"):
+        if line.startswith(b";TYPE:Wipe tower"):
+          raise TranslationUnsafe("G-code contains a wipe tower")
+        typed = True
+        custom = line[6:].strip() == b"Custom"
+      elif line.startswith(b";WIPE_TOWER"):
+        raise TranslationUnsafe("G-code contains a wipe tower")
+      elif b"objects_info" in line:
+        raise TranslationUnsafe("G-code contains object positions")
+
+    elif first == b"G" or first == b"g" or first == b" " or first == b"\t":
+      code, sep, comment = line.partition(b";")
+      words = code.split(None, 1)
+      command = words[0].upper() if words else b""
+      if command in MOVE_COMMANDS:
+        if shifting and len(words) > 1:
+          if b"x" in words[1] or b"y" in words[1]:
+            raise TranslationUnsafe("G-code contains lower case moves")
+          line = regex_xy.sub(shift, code) + sep + comment
+          moves += 1
+      elif command == b"G90":
+        absolute = True
+      elif command == b"G91":
+        absolute = False
+      elif command == b"G92" and len(words) > 1 and regex_xy.search(words[1].upper()):
+        raise TranslationUnsafe("G-code sets the XY position with G92")
+
+    elif b"EXCLUDE_OBJECT_DEFINE" in line:
+      raise TranslationUnsafe("G-code contains object positions")
+
+    shifting = printing and absolute and not custom
+    write(line)
+
+  if not printing or not typed:
+    raise TranslationUnsafe("G-code has no layer or extrusion type markers")
+  if not custom:
+    raise TranslationUnsafe("End G-code isn't marked as such")
+  return dict(lines=lines, moves=moves)
@@ -0,0 +1,565 @@
+# coding=utf-8
+"""A standalone slicing worker OctoPrint can offload slicing jobs to.
+
+Runs the configured engine for jobs posted over HTTP and streams its output
+back. Models and profiles are uploaded once and kept by their SHA256, so
+slicing the same model again only sends the job itself.
+
+Usage::
+
+    python -m octoprint_slic3r.worker --engine /usr/bin/prusa-slicer --port 5081 --token secret
+
+Endpoints:
+
+* ``GET /health``: engine, running and queued jobs, job limit
+* ``HEAD|PUT /files/<sha256>``: checks for or uploads a model or profile
+* ``POST /jobs``: slices, the response is a stream of JSON lines, see :class:`~octoprint_slic3r.remote.JobEvents`
+* ``GET /jobs/<id>/output``: the G-code of a finished job, removed once sent
+* ``DELETE /jobs/<id>``: cancels a job or drops its G-code
+"""
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+try:
+  string_types = basestring
+except NameError:
+  string_types = str
+
+from .cache import place_file
+from .engine import probe_engine
+from .limits import ProcessTimeout
+from .process import pump_output, wait_process
+from .profile import Profile
+from .remote import TOKEN_HEADER, JobEvents
+
+regex_file = re.compile(r"^/files/([0-9a-f]{64})\Z")
+regex_digest = re.compile(r"^[0-9a-f]{64}\Z")
+regex_key = re.compile(r"^[a-z0-9_]+\Z")
+regex_job = re.compile(r"^/jobs/([A-Za-z0-9_-]{1,64})(/output)?\Z")
+regex_extension = re.compile(r"^\.[A-Za-z0-9]{1,8}\Z")
+
+# settings that make the engine run commands, a worker never runs those
+FORBIDDEN_KEYS = ("post_process",)
+
+# how often the event stream is flushed, and kept alive while nothing happens
+FLUSH_INTERVAL = 0.2
+PING_INTERVAL = 5.0
+
+class WorkerError(Exception):
+  pass
+
+class WorkerJob(object):
+  def __init__(self, id):
+    self.id = id
+    self.process = None
+    self.cancelled = False
+    self.output_path = None
+    self.finished = None
+
+def validate_overrides(overrides):
+  """Returns the overrides of a job request as settings for its profile.
+
+  Keys have to be plain setting names and values must not span several
+  lines, either could smuggle further settings into the profile written
+  for the engine. Raises :class:`WorkerError` otherwise.
+  """
+  if not overrides:
+    return dict()
+  if not isinstance(overrides, dict):
+    raise WorkerError("Invalid overrides, expected an object")
+
+  result = dict()
+  for key, value in overrides.items():
+    if not isinstance(key, string_types) or not regex_key.match(key):
+      raise WorkerError("Invalid setting %r" % (key,))
+    if isinstance(value, bool):
+      value = "1" if value else "0"
+    elif isinstance(value, (list, tuple)):
+      value = ",".join("%s" % item for item in value)
+    elif value is not None and not isinstance(value, (string_types, int, float)):
+      raise WorkerError("Invalid value for %s" % key)
+    if isinstance(value, string_types) and ("\n" in value or "\r" in value):
+      raise WorkerError("Invalid value for %s, it spans several lines" % key)
+    result[key] = value
+  return result
+
+class SlicingWorker(object):
+  """Slices jobs with ``engine``, at most ``max_jobs`` at once.
+
+  Uploaded files and results are kept below ``folder``, files beyond
+  ``max_size`` bytes are evicted least recently used first and results
+  nobody fetched are removed after ``result_ttl`` seconds.
+  """
+
+  def __init__(self, engine, folder, max_jobs=1, token=None, timeout=None, max_size=500 * 1024 * 1024, result_ttl=600):
+    self._logger = logging.getLogger(__name__)
+    self.engine = engine
+    self.capabilities = probe_engine(engine)
+    self.max_jobs = max_jobs
+    self.token = token
+    self.timeout = timeout
+    self.max_size = max_size
+    self.result_ttl = result_ttl
+
+    self._files_folder = os.path.join(folder, "files")
+    self._jobs_folder = os.path.join(folder, "jobs")
+    for path in (self._files_folder, self._jobs_folder):
+      if not os.path.isdir(path):
+        os.makedirs(path)
+
+    self._slots = threading.Semaphore(max_jobs)
+    self._jobs = dict()
+    self._mutex = threading.Lock()
+    self._running = 0
+    self._queued = 0
+
+  def get_health(self):
+    with self._mutex:
+      return dict(engine="%s %s" % (self.capabilities.flavor, self.capabilities.version),
+                  running=self._running,
+                  queued=self._queued,
+                  max_jobs=self.max_jobs)
+
+  ##~~ files
+
+  def file_path(self, digest):
+    if not isinstance(digest, string_types) or not regex_digest.match(digest):
+      raise WorkerError("Invalid file %r, expected a SHA256" % (digest,))
+    return os.path.join(self._files_folder, digest)
+
+  def has_file(self, digest):
+    path = self.file_path(digest)
+    if not os.path.isfile(path):
+      return False
+    os.utime(path, None)
+    return True
+
+  def store_file(self, digest, stream, length):
+    fd, temp_path = tempfile.mkstemp(prefix=".", dir=self._files_folder)
+    try:
+      sha = hashlib.sha256()
+      with os.fdopen(fd, "wb") as f:
+        remaining = length
+        while remaining > 0:
+          chunk = stream.read(min(remaining, 1024 * 1024))
+          if not chunk:
+            raise WorkerError("Upload ended after %d of %d bytes" % (length - remaining, length))
+          sha.update(chunk)
+          f.write(chunk)
+          remaining -= len(chunk)
+      if sha.hexdigest() != digest:
+        raise WorkerError("Upload doesn't match its SHA256")
+      os.rename(temp_path, self.file_path(digest))
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+    self._evict_files()
+
+  def _evict_files(self):
+    entries = []
+    for name in os.listdir(self._files_folder):
+      if name.startswith("."):
+        continue
+      stat = os.stat(os.path.join(self._files_folder, name))
+      entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+      if total <= self.max_size:
+        break
+      os.remove(os.path.join(self._files_folder, name))
+      total -= size
+
+  ##~~ jobs
+
+  def prepare(self, job_id, request):
+    """Validates a job request, returns the engine arguments and the job."""
+    for key in ("model", "profile"):
+      digest = request.get(key)
+      if not isinstance(digest, string_types) or not regex_digest.match(digest):
+        raise WorkerError("Invalid %s %r, expected a SHA256" % (key, digest))
+      if not self.has_file(digest):
+        raise WorkerError("Unknown %s %r, upload it first" % (key, digest))
+
+    binary = bool(request.get("binary"))
+    if binary and not self.capabilities.supports_binary_gcode:
+      raise WorkerError("Binary G-code needs PrusaSlicer 2.7 or later")
+
+    # the engine only ever gets a profile that's been checked
+    profile, _, _ = Profile.from_slic3r_ini(self.file_path(request["profile"]))
+    profile.update(validate_overrides(request.get("overrides")))
+    for key, value in profile.items():
+      if key.strip().lower() in FORBIDDEN_KEYS and str(value or "").strip():
+        raise WorkerError("Profiles with %s aren't accepted" % key.strip())
+
+    # the engine guesses the model's format from its extension
+    extension = request.get("extension") or ".stl"
+    if not isinstance(extension, string_types) or not regex_extension.match(extension):
+      raise WorkerError("Invalid model extension %r" % (extension,))
+
+    job_folder = os.path.join(self._jobs_folder, job_id)
+    os.makedirs(job_folder)
+    profile_path = os.path.join(job_folder, "config.ini")
+    Profile.to_slic3r_ini(profile, profile_path)
+
+    model_path = os.path.join(job_folder, "model" + extension)
+    # the engine only reads the model
+    place_file(self.file_path(request["model"]), model_path, allow_hardlink=True)
+
+    job = WorkerJob(job_id)
+    job.output_path = os.path.join(job_folder, "output" + (".bgcode" if binary else ".gcode"))
+    center = request.get("center") or (0, 0)
+    args = [self.engine] + self.capabilities.get_args(profile_path, float(center[0]), float(center[1]), job.output_path,
+                                                      model_path, binary=binary)
+    return args, job
+
+  def run(self, job_id, request, emit):
+    """Slices the job, calling ``emit`` with each event for the client.
+
+    Raises an exception from ``emit`` (the client went away) after killing
+    the engine.
+    """
+    self._sweep()
+    with self._mutex:
+      if job_id in self._jobs:
+        raise WorkerError("Job %s exists already" % job_id)
+      self._jobs[job_id] = None
+
+    job = None
+    try:
+      args, job = self.prepare(job_id, request)
+      with self._mutex:
+        self._jobs[job_id] = job
+        self._queued += 1
+
+      try:
+        emit(type=JobEvents.QUEUED)
+        while not self._slots.acquire(False):
+          if job.cancelled:
+            emit(type=JobEvents.CANCELLED)
+            return
+          time.sleep(FLUSH_INTERVAL)
+      finally:
+        with self._mutex:
+          self._queued -= 1
+
+      try:
+        with self._mutex:
+          self._running += 1
+        self._slice(job, args, emit)
+      finally:
+        with self._mutex:
+          self._running -= 1
+        self._slots.release()
+    except Exception:
+      self._drop(job_id)
+      raise
+    finally:
+      if job is not None:
+        job.finished = time.time()
+        if job.cancelled or not os.path.exists(job.output_path):
+          self._drop(job_id)
+
+  def _slice(self, job, args, emit):
+    env = dict(os.environ)
+    env.update(self.capabilities.env)
+    self._logger.info("Running %r" % " ".join(args))
+
+    start = time.time()
+    job.process = p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    timeout = ProcessTimeout(p, self.timeout)
+    lines = queue.Queue()
+    state = dict(last_error="")
+
+    def on_stdout_line(line):
+      lines.put(line.decode("utf-8", "replace"))
+
+    def on_stderr_line(line):
+      if line.strip():
+        state["last_error"] = line.strip().decode("utf-8", "replace")
+
+    def pump():
+      try:
+        pump_output(p, on_stdout_line, on_stderr_line)
+        state["usage"] = wait_process(p)
+      finally:
+        lines.put(None)
+
+    thread = threading.Thread(target=pump)
+    thread.daemon = True
+    thread.start()
+
+    try:
+      emit(type=JobEvents.STARTED)
+      if job.cancelled:
+        p.kill()
+
+      last_sent = time.time()
+      done = False
+      while not done:
+        batch = []
+        deadline = time.time() + FLUSH_INTERVAL
+        while time.time() < deadline:
+          try:
+            line = lines.get(timeout=max(0.0, deadline - time.time()))
+          except queue.Empty:
+            break
+          if line is None:
+            done = True
+            break
+          batch.append(line)
+        if batch:
+          emit(type=JobEvents.OUTPUT, lines=batch)
+          last_sent = time.time()
+        elif time.time() - last_sent > PING_INTERVAL:
+          emit(type=JobEvents.PING)
+          last_sent = time.time()
+      thread.join()
+    finally:
+      timeout.cancel()
+      if p.returncode is None:
+        p.kill()
+        thread.join()
+      for stream in (p.stdout, p.stderr):
+        stream.close()
+
+    if job.cancelled:
+      emit(type=JobEvents.CANCELLED)
+      return
+
+    error = state["last_error"]
+    if timeout.expired:
+      error = "Slicing took longer than %d seconds and was aborted" % self.timeout
+    size = os.path.getsize(job.output_path) if p.returncode == 0 and os.path.exists(job.output_path) else None
+    emit(type=JobEvents.DONE, returncode=p.returncode, error=error, size=size,
+         duration=time.time() - start, usage=state.get("usage"))
+
+  def cancel(self, job_id):
+    with self._mutex:
+      if job_id not in self._jobs:
+        return False
+      job = self._jobs[job_id]
+    if job is None:
+      # still being prepared
+      return False
+    if job.finished is None:
+      job.cancelled = True
+      if job.process is not None and job.process.returncode is None:
+        try:
+          job.process.kill()
+        except OSError:
+          pass
+    else:
+      self._drop(job_id)
+    return True
+
+  def get_output(self, job_id):
+    with self._mutex:
+      job = self._jobs.get(job_id)
+    if job is None or job.finished is None or job.cancelled or not os.path.exists(job.output_path):
+      return None
+    return job.output_path
+
+  def _drop(self, job_id):
+    with self._mutex:
+      self._jobs.pop(job_id, None)
+    shutil.rmtree(os.path.join(self._jobs_folder, job_id), ignore_errors=True)
+
+  def _sweep(self):
+    now = time.time()
+    with self._mutex:
+      expired = [job.id for job in self._jobs.values() if job is not None and job.finished and now - job.finished > self.result_ttl]
+    for job_id in expired:
+      self._drop(job_id)
+
+class WorkerRequestHandler(BaseHTTPRequestHandler):
+  # keeps connections open, the client reuses them
+  protocol_version = "HTTP/1.1"
+
+  @property
+  def worker(self):
+    return self.server.worker
+
+  def log_message(self, format, *args):
+    logging.getLogger(__name__).debug("%s - %s" % (self.address_string(), format % args))
+
+  def do_GET(self):
+    if not self._authorize():
+      return
+    if self.path == "/health":
+      return self._send_json(200, self.worker.get_health())
+
+    match = regex_job.match(self.path)
+    if match is None or not match.group(2):
+      return self._send_json(404, dict(error="Not found"))
+    job_id = match.group(1)
+    path = self.worker.get_output(job_id)
+    if path is None:
+      return self._send_json(404, dict(error="No output for job %s" % job_id))
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/octet-stream")
+    self.send_header("Content-Length", str(os.path.getsize(path)))
+    self.end_headers()
+    with open(path, "rb") as f:
+      shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+    self.worker.cancel(job_id)
+
+  def do_HEAD(self):
+    if not self._authorize():
+      return
+    match = regex_file.match(self.path)
+    self.send_response(200 if match is not None and self.worker.has_file(match.group(1)) else 404)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+  def do_PUT(self):
+    if not self._authorize():
+      return
+    match = regex_file.match(self.path)
+    if match is None:
+      return self._send_json(404, dict(error="Not found"))
+    try:
+      self.worker.store_file(match.group(1), self.rfile, int(self.headers.get("Content-Length") or 0))
+    except WorkerError as e:
+      self.close_connection = True
+      return self._send_json(400, dict(error=str(e)))
+    self._send_json(201, dict())
+
+  def do_DELETE(self):
+    if not self._authorize():
+      return
+    match = regex_job.match(self.path)
+    if match is None or match.group(2):
+      return self._send_json(404, dict(error="Not found"))
+    self._send_json(200 if self.worker.cancel(match.group(1)) else 404, dict())
+
+  def do_POST(self):
+    if not self._authorize():
+      return
+    if self.path != "/jobs":
+      return self._send_json(404, dict(error="Not found"))
+    try:
+      request = json.loads(self._read_body().decode("utf-8"))
+      job_id = str(request.get("id") or "")
+      if not regex_job.match("/jobs/" + job_id):
+        raise WorkerError("Invalid job id %r" % job_id)
+    except (ValueError, WorkerError) as e:
+      return self._send_json(400, dict(error=str(e)))
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-ndjson")
+    self.send_header("Transfer-Encoding", "chunked")
+    self.end_headers()
+
+    def emit(**event):
+      data = (json.dumps(event) + "\n").encode("utf-8")
+      self.wfile.write(("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n")
+      self.wfile.flush()
+
+    try:
+      self.worker.run(job_id, request, emit)
+    except Exception as e:
+      logging.getLogger(__name__).exception("Job %s failed" % job_id)
+      try:
+        emit(type=JobEvents.DONE, returncode=None, error=str(e))
+      except Exception:
+        self.close_connection = True
+        return
+    self.wfile.write(b"0\r\n\r\n")
+
+  def _authorize(self):
+    token = self.worker.token
+    if not token or hmac.compare_digest(str(self.headers.get(TOKEN_HEADER) or ""), str(token)):
+      return True
+    self._read_body()
+    self._send_json(403, dict(error="Invalid token"))
+    return False
+
+  def _read_body(self):
+    length = int(self.headers.get("Content-Length") or 0)
+    return self.rfile.read(length) if length else b""
+
+  def _send_json(self, status, data):
+    body = json.dumps(data).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    if self.command != "HEAD":
+      self.wfile.write(body)
+
+class WorkerServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, address, worker):
+    HTTPServer.__init__(self, address, WorkerRequestHandler)
+    self.worker = worker
+
+def is_loopback(host):
+  return host in ("localhost", "::1") or host.startswith("127.")
+
+def main():
+  import argparse
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--engine", required=True, help="path of the Slic3r or PrusaSlicer executable")
+  parser.add_argument("--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 for all interfaces")
+  parser.add_argument("--port", type=int, default=5081, help="port to listen on")
+  parser.add_argument("--jobs", type=int, default=1, help="jobs to slice at once, further jobs are queued")
+  parser.add_argument("--token", default=os.environ.get("SLIC3R_WORKER_TOKEN"),
+                      help="token clients have to send, defaults to $SLIC3R_WORKER_TOKEN")
+  parser.add_argument("--folder", help="where uploads and results are kept, defaults to a temporary folder")
+  parser.add_argument("--cache-size", type=int, default=500, help="MB of uploaded files to keep")
+  parser.add_argument("--timeout", type=int, help="seconds after which a job is aborted")
+  args = parser.parse_args()
+
+  if not args.token and not is_loopback(args.host):
+    parser.error("Set a --token when listening on %s, anyone who can reach the worker could use it otherwise" % args.host)
+
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+  folder = args.folder or tempfile.mkdtemp(prefix="slic3r-worker-")
+  worker = SlicingWorker(args.engine, folder, max_jobs=max(1, args.jobs), token=args.token, timeout=args.timeout,
+                         max_size=args.cache_size * 1024 * 1024)
+  server = WorkerServer((args.host, args.port), worker)
+  # clean up on SIGTERM as well, e.g. when stopped by systemd
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  logging.getLogger(__name__).info("Slicing with %r on %s:%d" % (worker.capabilities, args.host, server.server_address[1]))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if args.folder is None:
+      shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+  main()
@@ -58,7 +58,10 @@ plugin_ignored_packages = []
 # Example:
 #     plugin_requires = ["someDependency==dev"]
 #     additional_setup_parameters = {"dependency_links": ["https://github.com/someUser/someRepo/archive/master.zip#egg=someDependency-dev"]}
-additional_setup_parameters = {}
+additional_setup_parameters = {
+	# speeds up inspecting large models before slicing
+	"extras_require": {"numpy": ["numpy"]}
+}
 
 ########################################################################################################################
 
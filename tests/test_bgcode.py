@@ -0,0 +1,119 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from octoprint_slic3r.bgcode import BgcodeError, BlockTypes, ChecksumTypes, CompressionTypes, is_bgcode, iter_blocks, \
+  read_metadata
+
+def block(block_type, data, compress=False, parameters=b"\0\0", checksum=True):
+  if compress:
+    compressed = zlib.compress(data)
+    header = struct.pack("<HHII", block_type, CompressionTypes.DEFLATE, len(data), len(compressed))
+    data = compressed
+  else:
+    header = struct.pack("<HHI", block_type, CompressionTypes.NONE, len(data))
+  result = header + parameters + data
+  if checksum:
+    result += struct.pack("<I", zlib.crc32(result) & 0xffffffff)
+  return result
+
+def file_header(checksum_type=ChecksumTypes.CRC32):
+  return struct.pack("<4sIH", b"GCDE", 1, checksum_type)
+
+class BgcodeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def write(self, data):
+    path = os.path.join(self.folder, "test.bgcode")
+    with open(path, "wb") as f:
+      f.write(data)
+    return path
+
+  def test_is_bgcode(self):
+    self.assertTrue(is_bgcode(self.write(file_header())))
+    self.assertFalse(is_bgcode(self.write(b"; generated by PrusaSlicer\nG28\n")))
+
+  def test_iter_blocks(self):
+    metadata = block(BlockTypes.FILE_METADATA, b"Producer=PrusaSlicer\n")
+    thumbnail = block(BlockTypes.THUMBNAIL, b"PNG", parameters=b"\0\0" + struct.pack("<HH", 16, 16))
+    gcode = block(BlockTypes.GCODE, b"G28\n" * 100, compress=True)
+    path = self.write(file_header() + metadata + thumbnail + gcode)
+
+    with open(path, "rb") as f:
+      blocks = [(block_type, compression, size, data_offset)
+                for block_type, compression, size, _, _, data_offset in iter_blocks(f)]
+    self.assertEqual([(BlockTypes.FILE_METADATA, CompressionTypes.NONE, 21, 10 + 8 + 2),
+                      (BlockTypes.THUMBNAIL, CompressionTypes.NONE, 3, 10 + len(metadata) + 8 + 6),
+                      (BlockTypes.GCODE, CompressionTypes.DEFLATE, len(zlib.compress(b"G28\n" * 100)),
+                       10 + len(metadata) + len(thumbnail) + 12 + 2)], blocks)
+
+  def test_iter_blocks_without_checksums(self):
+    data = file_header(ChecksumTypes.NONE) + block(BlockTypes.FILE_METADATA, b"a=1\n", checksum=False) \
+      + block(BlockTypes.GCODE, b"G28\n", checksum=False)
+    with open(self.write(data), "rb") as f:
+      self.assertEqual([BlockTypes.FILE_METADATA, BlockTypes.GCODE], [entry[0] for entry in iter_blocks(f)])
+
+  def test_read_metadata(self):
+    gcode = block(BlockTypes.GCODE, b"G28\n" * 1000)
+    data = file_header() \
+      + block(BlockTypes.FILE_METADATA, b"Producer=PrusaSlicer 2.7.0\n") \
+      + block(BlockTypes.PRINTER_METADATA, b"printer_model=MK4\nnozzle_diameter = 0.4\n") \
+      + block(BlockTypes.THUMBNAIL, b"PNG", parameters=b"\0" * 6) \
+      + block(BlockTypes.PRINT_METADATA, b"estimated printing time (normal mode)=1h 2m 3s\n") \
+      + block(BlockTypes.SLICER_METADATA, b"layer_height = 0.2\nstart_gcode = G28\\nG1 Z5\n", compress=True)
+    stats = dict()
+    metadata = read_metadata(self.write(data + gcode + block(BlockTypes.PRINT_METADATA, b"late=1\n")), stats=stats)
+
+    self.assertEqual({BlockTypes.FILE_METADATA: [("Producer", "PrusaSlicer 2.7.0")],
+                      BlockTypes.PRINTER_METADATA: [("printer_model", "MK4"), ("nozzle_diameter", "0.4")],
+                      BlockTypes.PRINT_METADATA: [("estimated printing time (normal mode)", "1h 2m 3s")],
+                      BlockTypes.SLICER_METADATA: [("layer_height", "0.2"), ("start_gcode", "G28\\nG1 Z5")]}, metadata)
+    # stops at the G-code
+    self.assertLessEqual(stats["bytes_read"], len(data) + 8 + 2)
+
+  def test_checksum_mismatch(self):
+    metadata = bytearray(block(BlockTypes.FILE_METADATA, b"Producer=PrusaSlicer\n"))
+    metadata[12] ^= 0xff
+    with self.assertRaises(BgcodeError):
+      read_metadata(self.write(file_header() + bytes(metadata)))
+
+    # not verified without checksums
+    unchecked = bytearray(block(BlockTypes.FILE_METADATA, b"Producer=PrusaSlicer\n", checksum=False))
+    unchecked[12] ^= 0x01
+    self.assertIn(BlockTypes.FILE_METADATA, read_metadata(self.write(file_header(ChecksumTypes.NONE) + bytes(unchecked))))
+
+  def test_skips_heatshrink_blocks(self):
+    heatshrink = bytearray(block(BlockTypes.SLICER_METADATA, b"not really heatshrink"))
+    heatshrink[2:4] = struct.pack("<H", CompressionTypes.HEATSHRINK_11_4)
+    heatshrink[8:8] = struct.pack("<I", len(b"not really heatshrink"))
+    heatshrink = bytes(heatshrink[:-4])
+    heatshrink += struct.pack("<I", zlib.crc32(heatshrink) & 0xffffffff)
+    metadata = read_metadata(self.write(file_header() + heatshrink + block(BlockTypes.FILE_METADATA, b"a=1\n")))
+    self.assertEqual({BlockTypes.FILE_METADATA: [("a", "1")]}, metadata)
+
+  def test_invalid_files(self):
+    with self.assertRaises(BgcodeError):
+      read_metadata(self.write(b"GCD"))
+    with self.assertRaises(BgcodeError):
+      read_metadata(self.write(b"; G-code\nG28\n"))
+    with self.assertRaises(BgcodeError):
+      read_metadata(self.write(file_header() + block(BlockTypes.FILE_METADATA, b"a=1\n")[:5]))
+    with self.assertRaises(BgcodeError):
+      read_metadata(self.write(file_header() + block(BlockTypes.FILE_METADATA, b"Producer=PrusaSlicer\n")[:-10]))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,223 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from octoprint_slic3r.profile import ConfigBundle, Profile, escape_value, read_profiles, unescape_value
+
+CONFIG = u"""# generated by PrusaSlicer 2.4.2
+# Name: Fine
+# Description: For small parts
+layer_height = 0.1
+start_gcode = M117 Printing #1\\nG28 ; home all
+extruder_colour = "#FF8000"
+; a comment = not a setting
+"""
+
+BUNDLE = u"""# generated by PrusaSlicer 2.4.2
+
+[print:*common*]
+layer_height = 0.2
+perimeters = 2
+infill_density = 15%
+
+[print:0.15mm QUALITY]
+inherits = *common*
+layer_height = 0.15
+
+[print:0.30mm DRAFT]
+inherits = "*common*"
+layer_height = 0.3
+perimeters = 1
+
+[filament:*PLA*]
+temperature = 210
+bed_temperature = 60
+
+[filament:Generic PLA]
+inherits = *PLA*
+filament_colour = #FF8000
+
+[filament:Generic PETG]
+temperature = 240
+
+[printer:*common*]
+bed_shape = 0x0,250x0,250x210,0x210
+
+[printer:MK3S]
+inherits = *common*
+nozzle_diameter = 0.4
+
+[printer:MINI]
+inherits = *common*
+bed_shape = 0x0,180x0,180x180,0x180
+
+[presets]
+print = 0.15mm QUALITY
+filament = Generic PLA
+printer = MK3S
+"""
+
+class ConfigBundleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def write(self, name, content):
+    path = os.path.join(self.folder, name)
+    with io.open(path, "wt", encoding="utf-8") as f:
+      f.write(content)
+    return path
+
+  def test_plain_config(self):
+    bundle = ConfigBundle.from_lines(CONFIG.splitlines(True))
+    self.assertFalse(bundle.is_bundle)
+    self.assertEqual("Fine", bundle.display_name)
+    self.assertEqual("For small parts", bundle.description)
+    # values are kept as written, comments only on lines of their own
+    self.assertEqual(dict(layer_height="0.1",
+                          start_gcode="M117 Printing #1\\nG28 ; home all",
+                          extruder_colour='"#FF8000"'), bundle.settings)
+
+  def test_sections(self):
+    bundle = ConfigBundle.from_lines(BUNDLE.splitlines(True))
+    self.assertTrue(bundle.is_bundle)
+    self.assertEqual(dict(), bundle.settings)
+    self.assertEqual(["0.15mm QUALITY", "0.30mm DRAFT"], bundle.presets("print"))
+    self.assertEqual(["Generic PETG", "Generic PLA"], bundle.presets("filament"))
+    self.assertEqual(dict(print="0.15mm QUALITY", filament="Generic PLA", printer="MK3S"),
+                     bundle.sections[("presets", "")])
+
+  def test_inherits(self):
+    bundle = ConfigBundle.from_lines(BUNDLE.splitlines(True))
+    self.assertEqual(dict(layer_height="0.3", perimeters="1", infill_density="15%"),
+                     bundle.resolve("print", "0.30mm DRAFT"))
+    self.assertEqual(dict(temperature="210", bed_temperature="60", filament_colour="#FF8000"),
+                     bundle.resolve("filament", "Generic PLA"))
+    with self.assertRaises(KeyError):
+      bundle.resolve("print", "missing")
+
+  def test_inherits_several_and_missing_parents(self):
+    bundle = ConfigBundle.from_lines(u"""[filament:*PLA*]
+temperature = 210
+[filament:*fast*]
+temperature = 230
+max_volumetric_speed = 15
+[filament:Fast PLA]
+inherits = *PLA*; *fast*; *missing*
+""".splitlines(True))
+    # later parents win
+    self.assertEqual(dict(temperature="230", max_volumetric_speed="15"), bundle.resolve("filament", "Fast PLA"))
+
+  def test_diamond_inheritance(self):
+    bundle = ConfigBundle.from_lines(u"""[print:*common*]
+infill_density = 15%
+[print:*015*]
+inherits = *common*
+layer_height = 0.15
+[print:*mk3*]
+inherits = *common*
+perimeters = 3
+[print:0.15mm QUALITY @MK3]
+inherits = *015*; *mk3*
+""".splitlines(True))
+    # both parents share *common*, like in PrusaSlicer's vendor bundles
+    self.assertEqual(dict(layer_height="0.15", perimeters="3", infill_density="15%"),
+                     bundle.resolve("print", "0.15mm QUALITY @MK3"))
+    self.assertEqual("0.15", bundle.get_profile("0.15mm QUALITY @MK3")["layer_height"])
+
+  def test_circular_inheritance(self):
+    bundle = ConfigBundle.from_lines(u"""[print:a]
+inherits = b
+[print:b]
+inherits = a
+""".splitlines(True))
+    with self.assertRaises(ValueError):
+      bundle.resolve("print", "a")
+
+  def test_profile_uses_presets_selection(self):
+    bundle = ConfigBundle.from_lines(BUNDLE.splitlines(True))
+    profile = bundle.get_profile("0.30mm DRAFT")
+    self.assertEqual("0.3", profile["layer_height"])
+    self.assertEqual("210", profile["temperature"])
+    self.assertEqual("0.4", profile["nozzle_diameter"])
+    self.assertEqual("0x0,250x0,250x210,0x210", profile["bed_shape"])
+    self.assertNotIn("inherits", profile)
+    self.assertEqual(["0.15mm QUALITY", "0.30mm DRAFT"], [name for name, _ in bundle.get_profiles()])
+
+  def test_profile_without_presets_selection(self):
+    bundle = ConfigBundle.from_lines(BUNDLE.split(u"[presets]")[0].splitlines(True))
+    profile = bundle.get_profile("0.15mm QUALITY")
+    self.assertEqual(dict(layer_height="0.15", perimeters="2", infill_density="15%"), profile)
+
+  def test_from_file_keeps_only_needed_sections(self):
+    path = self.write("bundle.ini", BUNDLE)
+    bundle = ConfigBundle.from_file(path)
+    self.assertEqual(set([("filament", "Generic PETG"), ("printer", "MINI")]), bundle.skipped)
+    self.assertTrue(bundle.is_bundle)
+    full = ConfigBundle.from_lines(BUNDLE.splitlines(True))
+    self.assertEqual(list(full.get_profiles()), list(bundle.get_profiles()))
+
+    first = ConfigBundle.from_file(path, first_only=True)
+    self.assertEqual(["0.15mm QUALITY"], first.presets("print"))
+    self.assertEqual(full.get_profile("0.15mm QUALITY"), first.get_profile("0.15mm QUALITY"))
+
+  def test_from_slic3r_ini(self):
+    profile, display_name, description = Profile.from_slic3r_ini(self.write("config.ini", CONFIG))
+    self.assertEqual("0.1", profile["layer_height"])
+    self.assertEqual(("Fine", "For small parts"), (display_name, description))
+
+    profile, display_name, _ = Profile.from_slic3r_ini(self.write("bundle.ini", BUNDLE))
+    self.assertEqual("0.15", profile["layer_height"])
+    self.assertEqual("210", profile["temperature"])
+    self.assertIsNone(display_name)
+
+    self.assertIsNone(Profile.from_slic3r_ini(os.path.join(self.folder, "missing.ini")))
+
+  def test_read_profiles(self):
+    config = self.write("Fine.ini", CONFIG)
+    bundle = self.write("bundle.ini", BUNDLE)
+    empty = self.write("empty.ini", u"# nothing\n")
+    archive = os.path.join(self.folder, "profiles.zip")
+    with zipfile.ZipFile(archive, "w") as f:
+      f.write(config, "Fine.ini")
+      f.write(bundle, "bundles/bundle.ini")
+      f.write(empty, "empty.ini")
+      f.writestr("readme.txt", "ignored")
+
+    entries = list(read_profiles(archive))
+    self.assertEqual(["Fine.ini", "bundles/bundle.ini [print:0.15mm QUALITY]", "bundles/bundle.ini [print:0.30mm DRAFT]",
+                      "empty.ini"], [entry["source"] for entry in entries])
+    self.assertEqual(["Fine", "0.15mm QUALITY", "0.30mm DRAFT", None], [entry.get("name") for entry in entries])
+    self.assertEqual("No settings found", entries[3]["error"])
+    self.assertEqual("0.4", entries[2]["profile"]["nozzle_diameter"])
+
+  def test_round_trip(self):
+    path = os.path.join(self.folder, "written.ini")
+    profile = dict(layer_height=0.2, support_material=True, bed_shape=["0x0", "200x200"],
+                   start_gcode=u"G28\nG1 Z5 ; lift\\", _internal="dropped")
+    Profile.to_slic3r_ini(profile, path, display_name=u"Two\nlines", description=u"Ä description")
+    read, display_name, description = Profile.from_slic3r_ini(path)
+    self.assertEqual(dict(layer_height="0.2", support_material="true", bed_shape="0x0,200x200",
+                          start_gcode=u"G28\\nG1 Z5 ; lift\\\\"), read)
+    self.assertEqual(u"G28\nG1 Z5 ; lift\\", unescape_value(read["start_gcode"]))
+    self.assertEqual((u"Two lines", u"Ä description"), (display_name, description))
+
+  def test_escapes(self):
+    self.assertEqual(u"a\nb\\c", unescape_value(u"a\\nb\\\\c"))
+    self.assertEqual(u"a\\nb\\\\c", escape_value(u"a\nb\\c"))
+    self.assertEqual(u"no escapes", unescape_value(u"no escapes"))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,210 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import threading
+import time
+import unittest
+
+from octoprint_slic3r.job import SlicingJob, SlicingPriorities
+from octoprint_slic3r.scheduler import SlicingScheduler
+
+TIMEOUT = 5.0
+
+def make_job(name, priority=SlicingPriorities.INTERACTIVE, batch_key=None):
+  job = SlicingJob(name + ".stl", name + ".gco", "profile.ini", None, priority=priority)
+  job.batch_key = batch_key
+  return job
+
+def wait_for(condition):
+  deadline = time.time() + TIMEOUT
+  while not condition():
+    if time.time() > deadline:
+      raise AssertionError("Timed out")
+    time.sleep(0.005)
+
+class Waiter(threading.Thread):
+  """Acquires a slot for ``job`` in the background and remembers the result."""
+
+  def __init__(self, scheduler, job, order=None):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.scheduler = scheduler
+    self.job = job
+    self.order = order
+    self.positions = []
+    self.result = None
+
+  def run(self):
+    self.result = self.scheduler.acquire(self.job, on_position=lambda job, position: self.positions.append(position))
+    if self.result and self.order is not None:
+      self.order.append(self.job.id)
+      self.scheduler.release(self.job)
+
+def queue_jobs(scheduler, jobs, order=None):
+  waiters = []
+  for job in jobs:
+    waiter = Waiter(scheduler, job, order=order)
+    waiter.start()
+    waiters.append(waiter)
+    # queue them one after the other so first come first served is well defined
+    wait_for(lambda: scheduler.get_stats()["queued"] == len(waiters))
+  return waiters
+
+class SlicingSchedulerTest(unittest.TestCase):
+
+  def test_runs_jobs_up_to_the_limit(self):
+    scheduler = SlicingScheduler(max_jobs=2)
+    first, second = make_job("first"), make_job("second")
+    self.assertTrue(scheduler.acquire(first))
+    self.assertTrue(scheduler.acquire(second))
+
+    waiters = queue_jobs(scheduler, [make_job("third")])
+    self.assertEqual(dict(max_jobs=2, running=2, batched=0, queued=1), scheduler.get_stats())
+
+    scheduler.release(first)
+    waiters[0].join(TIMEOUT)
+    self.assertTrue(waiters[0].result)
+    self.assertEqual([0], waiters[0].positions)
+
+  def test_priority_order(self):
+    scheduler = SlicingScheduler(max_jobs=1)
+    running = make_job("running")
+    self.assertTrue(scheduler.acquire(running))
+
+    order = []
+    jobs = [make_job("background", priority=SlicingPriorities.BACKGROUND),
+            make_job("batch 1", priority=SlicingPriorities.BATCH),
+            make_job("interactive", priority=SlicingPriorities.INTERACTIVE),
+            make_job("batch 2", priority=SlicingPriorities.BATCH)]
+    waiters = queue_jobs(scheduler, jobs, order=order)
+
+    scheduler.release(running)
+    for waiter in waiters:
+      waiter.join(TIMEOUT)
+    self.assertEqual(["interactive.gco", "batch 1.gco", "batch 2.gco", "background.gco"], order)
+
+  def test_cancel_queued_job(self):
+    scheduler = SlicingScheduler(max_jobs=1)
+    running = make_job("running")
+    scheduler.acquire(running)
+    queued = make_job("queued")
+    waiters = queue_jobs(scheduler, [queued])
+
+    self.assertTrue(scheduler.cancel(queued.id))
+    waiters[0].join(TIMEOUT)
+    self.assertFalse(waiters[0].result)
+    self.assertEqual(0, scheduler.get_stats()["queued"])
+
+    # the slot goes to the next job, not the cancelled one
+    scheduler.release(running)
+    self.assertTrue(scheduler.acquire(make_job("next")))
+
+  def test_cancel_running_job(self):
+    scheduler = SlicingScheduler(max_jobs=1)
+    running = make_job("running")
+    scheduler.acquire(running)
+
+    self.assertFalse(scheduler.cancel(running.id))
+    self.assertTrue(running.cancelled)
+    # stays in its slot until released
+    self.assertEqual(1, scheduler.get_stats()["running"])
+    scheduler.release(running)
+    self.assertEqual(0, scheduler.get_stats()["running"])
+
+  def test_cancel_unknown_job(self):
+    scheduler = SlicingScheduler(max_jobs=1)
+    self.assertFalse(scheduler.cancel("unknown.gco"))
+
+  def test_preempts_background_job(self):
+    preempted = []
+    scheduler = SlicingScheduler(max_jobs=1, on_preempt=preempted.append)
+    background = make_job("background", priority=SlicingPriorities.BACKGROUND)
+    scheduler.acquire(background)
+
+    waiters = queue_jobs(scheduler, [make_job("interactive")])
+    self.assertEqual([background], preempted)
+    self.assertTrue(background.cancelled)
+
+    scheduler.release(background)
+    waiters[0].join(TIMEOUT)
+    self.assertTrue(waiters[0].result)
+
+  def test_doesnt_preempt_for_background_jobs(self):
+    preempted = []
+    scheduler = SlicingScheduler(max_jobs=1, on_preempt=preempted.append)
+    background = make_job("background", priority=SlicingPriorities.BACKGROUND)
+    scheduler.acquire(background)
+
+    queue_jobs(scheduler, [make_job("other", priority=SlicingPriorities.BACKGROUND)])
+    self.assertEqual([], preempted)
+    self.assertFalse(background.cancelled)
+    scheduler.release(background)
+
+  def test_find_preemptible(self):
+    scheduler = SlicingScheduler(max_jobs=3)
+    interactive = make_job("interactive")
+    older = make_job("older", priority=SlicingPriorities.BACKGROUND)
+    newer = make_job("newer", priority=SlicingPriorities.BACKGROUND)
+    for job in (interactive, older, newer):
+      scheduler.acquire(job)
+    older.started, newer.started = 1.0, 2.0
+
+    # nothing is waiting
+    self.assertIsNone(scheduler._find_preemptible())
+
+    scheduler._queue.append([SlicingPriorities.INTERACTIVE, 0, make_job("waiting"), False])
+    # the job that started last has done the least work
+    self.assertIs(newer, scheduler._find_preemptible())
+    self.assertTrue(newer.cancelled)
+    # one waiting job only needs one slot
+    self.assertIsNone(scheduler._find_preemptible())
+
+    scheduler._queue.append([SlicingPriorities.INTERACTIVE, 1, make_job("waiting 2"), False])
+    self.assertIs(older, scheduler._find_preemptible())
+    # interactive jobs are never preempted
+    scheduler._queue.append([SlicingPriorities.INTERACTIVE, 2, make_job("waiting 3"), False])
+    self.assertIsNone(scheduler._find_preemptible())
+    self.assertFalse(interactive.cancelled)
+
+  def test_take_batch(self):
+    scheduler = SlicingScheduler(max_jobs=1)
+    running = make_job("running", batch_key="profile")
+    scheduler.acquire(running)
+
+    same = make_job("same", batch_key="profile")
+    other = make_job("other", batch_key="other profile")
+    vetoed = make_job("vetoed", batch_key="profile")
+    cancelled = make_job("cancelled", batch_key="profile")
+    waiters = queue_jobs(scheduler, [same, other, vetoed, cancelled])
+    scheduler.cancel(cancelled.id)
+
+    taken = scheduler.take_batch(running, 5, accept=lambda job: job is not vetoed)
+    self.assertEqual([same], taken)
+    waiters[0].join(TIMEOUT)
+    self.assertTrue(waiters[0].result)
+    self.assertIs(running, same.batch)
+    waiters[3].join(TIMEOUT)
+    self.assertFalse(waiters[3].result)
+    self.assertEqual(dict(max_jobs=1, running=1, batched=1, queued=2), scheduler.get_stats())
+
+    scheduler.release(same)
+    self.assertEqual(0, scheduler.get_stats()["batched"])
+    scheduler.release(running)
+
+  def test_take_batch_limit(self):
+    scheduler = SlicingScheduler(max_jobs=1)
+    running = make_job("running", batch_key="profile")
+    scheduler.acquire(running)
+    jobs = [make_job("job %d" % index, batch_key="profile") for index in range(3)]
+    queue_jobs(scheduler, jobs)
+
+    self.assertEqual(jobs[:2], scheduler.take_batch(running, 2))
+    self.assertEqual([], scheduler.take_batch(running, 0))
+    self.assertEqual([], scheduler.take_batch(make_job("unbatched"), 2))
+    self.assertEqual(1, scheduler.get_stats()["queued"])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,138 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import io
+import unittest
+
+from octoprint_slic3r.translate import TranslationUnsafe, get_profile_blocker, translate_gcode
+
+START = b"""; generated by PrusaSlicer 2.4.2
+G90
+M83
+G28 ; home all
+G1 X0 Y-3 F1000 ; intro line
+G92 E0
+"""
+
+PRINT = b""";LAYER_CHANGE
+;Z:0.2
+G1 Z.2 F7800
+;TYPE:Perimeter
+G1 X100.5 Y80.25 E.1
+G1 X120 Y80.25 E.5
+G2 X130 Y90 I10 J0 E.2 ; arc
+G91
+G1 X1 Y1 E.1
+G90
+;LAYER_CHANGE
+;Z:0.4
+G1 Z.4
+;TYPE:External perimeter
+G1 X100.5 Y80.25 F1800
+G3 X90 Y70 R10 E.2
+"""
+
+END = b""";TYPE:Custom
+; end gcode
+G1 X0 Y200 F3000 ; present print
+M104 S0
+"""
+
+# PRINT moved by 10/-5
+SHIFTED = b""";LAYER_CHANGE
+;Z:0.2
+G1 Z.2 F7800
+;TYPE:Perimeter
+G1 X110.5 Y75.25 E.1
+G1 X130 Y75.25 E.5
+G2 X140 Y85 I10 J0 E.2 ; arc
+G91
+G1 X1 Y1 E.1
+G90
+;LAYER_CHANGE
+;Z:0.4
+G1 Z.4
+;TYPE:External perimeter
+G1 X110.5 Y75.25 F1800
+G3 X100 Y65 R10 E.2
+"""
+
+def translate(gcode, dx, dy):
+  destination = io.BytesIO()
+  stats = translate_gcode(io.BytesIO(gcode), destination, dx, dy)
+  return destination.getvalue(), stats
+
+class TranslateGcodeTest(unittest.TestCase):
+
+  def test_shifts_print_moves_only(self):
+    result, stats = translate(START + PRINT + END, 10, -5)
+    self.assertEqual(START + SHIFTED + END, result)
+    self.assertEqual(len((START + PRINT + END).splitlines()), stats["lines"])
+    # Z moves included, relative ones aren't touched
+    self.assertEqual(7, stats["moves"])
+
+  def test_moving_back_restores_the_gcode(self):
+    shifted, _ = translate(START + PRINT + END, 10, -5)
+    result, _ = translate(shifted, -10, 5)
+    self.assertEqual(START + PRINT + END, result)
+
+  def test_no_shift_keeps_the_gcode(self):
+    result, _ = translate(START + PRINT + END, 0, 0)
+    self.assertEqual(START + PRINT + END, result)
+
+  def test_keeps_line_endings(self):
+    gcode = (START + PRINT + END).replace(b"\n", b"\r\n")
+    result, _ = translate(gcode, 10, -5)
+    self.assertEqual((START + SHIFTED + END).replace(b"\n", b"\r\n"), result)
+
+  def test_custom_gcode_between_layers_stays(self):
+    custom = b";TYPE:Custom\nG1 X5 Y5 ; park\n;LAYER_CHANGE\n;TYPE:Perimeter\nG1 X10 Y10 E1\n"
+    result, _ = translate(START + PRINT + custom + END, 1, 1)
+    self.assertIn(b";TYPE:Custom\nG1 X5 Y5 ; park\n;LAYER_CHANGE\n;TYPE:Perimeter\nG1 X11 Y11 E1\n", result)
+
+  def assertUnsafe(self, gcode, message):
+    with self.assertRaises(TranslationUnsafe) as context:
+      translate(gcode, 10, -5)
+    self.assertEqual(message, str(context.exception))
+
+  def test_unsafe_lower_case_moves(self):
+    self.assertUnsafe(START + PRINT + b"G1 x1 y2 E.1\n" + END, "G-code contains lower case moves")
+    self.assertUnsafe(START + PRINT + b"G1 X1 y2 E.1 ; fast path skipped\n" + END, "G-code contains lower case moves")
+    self.assertUnsafe(START + PRINT + b"g1 x1 y2\n" + END, "G-code contains lower case moves")
+
+  def test_unsafe_wipe_tower(self):
+    self.assertUnsafe(START + PRINT + b";TYPE:Wipe tower\nG1 X200 Y200 E1\n" + END, "G-code contains a wipe tower")
+    self.assertUnsafe(START + PRINT + b";WIPE_TOWER_START\n" + END, "G-code contains a wipe tower")
+
+  def test_unsafe_object_positions(self):
+    self.assertUnsafe(b"; objects_info = {}\n" + START + PRINT + END, "G-code contains object positions")
+    self.assertUnsafe(b"EXCLUDE_OBJECT_DEFINE NAME=model CENTER=100,100\n" + START + PRINT + END,
+                      "G-code contains object positions")
+
+  def test_unsafe_g92_xy(self):
+    self.assertUnsafe(START + PRINT + b"G92 X0 Y0\n" + END, "G-code sets the XY position with G92")
+
+  def test_unsafe_without_markers(self):
+    self.assertUnsafe(START + b"G1 X10 Y10 E1\n" + END, "G-code has no layer or extrusion type markers")
+    self.assertUnsafe(START + b";LAYER_CHANGE\nG1 X10 Y10 E1\n", "G-code has no layer or extrusion type markers")
+
+  def test_unsafe_unmarked_end_gcode(self):
+    self.assertUnsafe(START + PRINT + b"G1 X0 Y200\nM104 S0\n", "End G-code isn't marked as such")
+
+class ProfileBlockerTest(unittest.TestCase):
+
+  def test_movable_profile(self):
+    self.assertIsNone(get_profile_blocker(dict(wipe_tower="0", gcode_label_objects="0", start_gcode="G28\\nG1 Z5",
+                                               layer_gcode=";AFTER_LAYER_CHANGE\\nG1 E-1 F2100")))
+
+  def test_blockers(self):
+    self.assertEqual("the wipe tower is enabled", get_profile_blocker(dict(wipe_tower="1")))
+    self.assertEqual("objects are labelled", get_profile_blocker(dict(gcode_label_objects="octoprint")))
+    self.assertEqual("layer_gcode contains XY moves", get_profile_blocker(dict(layer_gcode="G1 Z1\\nG0 X5 Y5")))
+    self.assertEqual("start_gcode uses first_layer_print_", get_profile_blocker(dict(start_gcode="M555 X{first_layer_print_min[0]}")))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,137 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agpl.html'
+__copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from octoprint_slic3r import worker
+from octoprint_slic3r.engine import EngineCapabilities
+from octoprint_slic3r.profile import Profile
+from octoprint_slic3r.worker import SlicingWorker, WorkerError, is_loopback, validate_overrides
+
+HELP_TEXT = "PrusaSlicer-2.6.0+linux-x64-GTK3 based on Slic3r\n --export-gcode\n"
+
+class ValidateOverridesTest(unittest.TestCase):
+
+  def test_empty(self):
+    self.assertEqual(dict(), validate_overrides(None))
+    self.assertEqual(dict(), validate_overrides(dict()))
+
+  def test_converts_values(self):
+    self.assertEqual(dict(layer_height=0.2, perimeters=3, support_material="1", ensure_vertical_shell_thickness="0",
+                          extruder_colour="#FF8000,#00FF00", fill_pattern="gyroid", notes=None),
+                     validate_overrides(dict(layer_height=0.2, perimeters=3, support_material=True,
+                                             ensure_vertical_shell_thickness=False,
+                                             extruder_colour=["#FF8000", "#00FF00"], fill_pattern="gyroid", notes=None)))
+
+  def test_rejects_non_objects(self):
+    for overrides in (["layer_height", 0.2], "layer_height = 0.2"):
+      with self.assertRaises(WorkerError):
+        validate_overrides(overrides)
+
+  def test_rejects_keys(self):
+    for key in ("Post_Process", "post_process ", " post_process", "layer-height", "layer_height\n", "a = b\nc",
+                "", 1, u"lāyer"):
+      with self.assertRaises(WorkerError):
+        validate_overrides({key: "1"})
+
+  def test_rejects_multi_line_values(self):
+    for value in ("0.2\npost_process = /bin/sh", "0.2\r\npost_process = /bin/sh", ["a", "b\nc"]):
+      with self.assertRaises(WorkerError):
+        validate_overrides(dict(layer_height=value))
+
+  def test_rejects_other_values(self):
+    for value in (dict(a=1), object()):
+      with self.assertRaises(WorkerError):
+        validate_overrides(dict(layer_height=value))
+
+class IsLoopbackTest(unittest.TestCase):
+
+  def test_is_loopback(self):
+    for host in ("127.0.0.1", "127.1.2.3", "localhost", "::1"):
+      self.assertTrue(is_loopback(host), host)
+    for host in ("0.0.0.0", "", "::", "192.168.1.2", "localhost.example.com"):
+      self.assertFalse(is_loopback(host), host)
+
+class PrepareTest(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self._probe_engine = worker.probe_engine
+    worker.probe_engine = lambda engine: EngineCapabilities.from_help_text(HELP_TEXT)
+    self.worker = SlicingWorker("prusa-slicer", self.folder)
+    self.model = self.upload(b"solid model\nendsolid model\n")
+
+  def tearDown(self):
+    worker.probe_engine = self._probe_engine
+    shutil.rmtree(self.folder)
+
+  def upload(self, data):
+    digest = hashlib.sha256(data).hexdigest()
+    self.worker.store_file(digest, io.BytesIO(data), len(data))
+    return digest
+
+  def upload_profile(self, profile):
+    path = os.path.join(self.folder, "profile.ini")
+    Profile.to_slic3r_ini(profile, path)
+    with open(path, "rb") as f:
+      return self.upload(f.read())
+
+  def test_prepare(self):
+    profile = self.upload_profile(dict(layer_height="0.2"))
+    args, job = self.worker.prepare("job", dict(model=self.model, profile=profile, center=[10, 20],
+                                                overrides=dict(layer_height=0.1, notes="checked")))
+    self.assertEqual(["prusa-slicer", "--slice", "--load"], args[:3])
+    self.assertEqual(["--center", "10.000000,20.000000"], args[4:6])
+    written, _, _ = Profile.from_slic3r_ini(args[3])
+    self.assertEqual(dict(layer_height="0.1", notes="checked"), written)
+    self.assertEqual(job.output_path, args[7])
+
+  def test_rejects_invalid_digests(self):
+    profile = self.upload_profile(dict(layer_height="0.2"))
+    for request in (dict(model="../" + self.model[3:], profile=profile),
+                    dict(model=self.model, profile=profile.upper()),
+                    dict(model=self.model, profile=profile + "\n"),
+                    dict(model=self.model),
+                    dict(model=["a"], profile=profile)):
+      with self.assertRaises(WorkerError):
+        self.worker.prepare("job", request)
+
+  def test_rejects_unknown_files(self):
+    with self.assertRaises(WorkerError):
+      self.worker.prepare("job", dict(model=self.model, profile="0" * 64))
+
+  def test_rejects_post_process(self):
+    profile = self.upload_profile(dict(post_process="/usr/bin/evil"))
+    with self.assertRaises(WorkerError):
+      self.worker.prepare("job", dict(model=self.model, profile=profile))
+
+    # not through the profile's own keys either
+    digest = self.upload(b"layer_height = 0.2\nPost_Process  = /usr/bin/evil\n")
+    with self.assertRaises(WorkerError):
+      self.worker.prepare("job 2", dict(model=self.model, profile=digest))
+
+  def test_rejects_post_process_overrides(self):
+    profile = self.upload_profile(dict(layer_height="0.2"))
+    for overrides in (dict(post_process="/usr/bin/evil"),
+                      {"Post_Process": "/usr/bin/evil"},
+                      dict(notes="x\npost_process = /usr/bin/evil")):
+      with self.assertRaises(WorkerError):
+        self.worker.prepare("job", dict(model=self.model, profile=profile, overrides=overrides))
+
+  def test_rejects_invalid_extensions(self):
+    profile = self.upload_profile(dict(layer_height="0.2"))
+    for extension in ("/../../model.stl", ".stl\n", "stl"):
+      with self.assertRaises(WorkerError):
+        self.worker.prepare("job", dict(model=self.model, profile=profile, extension=extension))
+    self.assertEqual([], os.listdir(os.path.join(self.folder, "jobs")))
+
+if __name__ == "__main__":
+  unittest.main()